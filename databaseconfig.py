@@ -42,3 +42,122 @@ dir_output = "/home/script"
 
 # Uncomment the line below to provide the directory of original snapshot. If not, the tool will learn the original state and save it in the dir_output.
 # dir_original_snapshot = "/home/script"
+
+# Uncomment the line below to change how many monitors of the device the collector runs in threads at the same time.
+# max_sessions = 10
+
+# Uncomment the line below to change how many seconds a show command output is reused within a monitoring cycle (0 disables the cache).
+# command_cache_ttl = 30
+
+# Uncomment the lines below to change how many show commands are sent in one round trip (1 disables batching) and the timeout of a batch in seconds.
+# batch_size = 8
+# batch_timeout = 300
+
+# Uncomment the line below to read the built-in monitors from the NX-OS "| json" output instead of the genie text parsers.
+# Commands without JSON output on the running NX-OS release keep using the genie parsers.
+# Snapshots learned without this option should be learned again after turning it on.
+# structured_output = True
+
+# Uncomment the line below to change how many worker processes diff the all-detail outputs (1 diffs in the main process).
+# diff_workers = 4
+
+# Uncomment the line below to choose when the all details of the original state are learned:
+# "lazy" when the mode compare all detail differences is first turned on, "background" while the common information is monitored, or "startup".
+# alldetail_baseline = "lazy"
+
+# Uncomment the line below to open a pool of SSH sessions to the device so several monitors learn at the same time.
+# session_pool_size = 4
+
+# Uncomment the lines below to change the deadlines in seconds of one show command, one monitor, and one monitoring cycle (None disables a deadline).
+# A monitor that misses its deadline reports its last result for that cycle.
+# command_timeout = 120
+# monitor_timeout = 300
+# cycle_timeout = 600
+
+# The commands and monitors a device does not support with its platform, model and NX-OS version are remembered in capability_cache.json in dir_output and skipped on the next runs.
+# Uncomment the lines below to turn the capability cache off or to change how many seconds an entry is kept before it is probed again.
+# capability_cache = False
+# capability_ttl = 86400
+
+# A monitor failing breaker_threshold cycles in a row is skipped for breaker_backoff seconds, doubled each time it fails again up to breaker_max_backoff.
+# Uncomment the lines below to change them.
+# breaker_threshold = 3
+# breaker_backoff = 60
+# breaker_max_backoff = 3600
+
+# The session is probed every keepalive_interval seconds when idle (0 turns it off), and a lost connection is retried after reconnect_backoff seconds, doubled up to reconnect_max_backoff.
+# Set alternate_protocol to fall back to another transport (e.g. "telnet") when the device cannot be reached with SSH.
+# keepalive_interval = 30
+# reconnect_backoff = 1
+# reconnect_max_backoff = 60
+# alternate_protocol = "telnet"
+
+# Uncomment the lines below to wait poll_interval seconds between cycles and to take commands on a Unix socket without the --daemon flag (by default <dir_output>/<hostname>.sock in daemon mode).
+# poll_interval = 60
+# control_socket = "/run/nxos-genie-monitor.sock"
+
+# Uncomment the line below to serve the last state of every monitor as JSON on http://127.0.0.1:<http_port>/monitors.
+# Set http_address to listen on another address.
+# http_port = 8080
+# http_address = "127.0.0.1"
+
+# Every cycle reports what changed since the last cycle ("delta"). Uncomment one of the lines below to report the full difference from the original state every cycle ("full"),
+# or only the differences that changed since the last report ("change"), with a heartbeat line every heartbeat_interval seconds when nothing changes.
+# report_mode = "full"
+# report_mode = "change"
+# heartbeat_interval = 300
+
+# Uncomment the line below to also write a JSON record per monitor each time its difference changes to <dir_output>/<hostname>_diff.jsonl.
+# The file is rotated at json_max_bytes bytes or json_max_age seconds and the old file is compressed with json_compression ("gzip", or "zstd" with the zstandard module, or None).
+# json_output = True
+# json_max_bytes = 67108864
+# json_max_age = 86400
+# json_compression = "gzip"
+
+# Uncomment the lines below to send alerts when a monitor's difference changes or clears.
+# The changes within alert_window seconds are grouped in one message; each destination gets at most alert_rate_limit messages per minute (or its own rate_limit) and failed sends are retried alert_retries times.
+# alert_destinations = [
+#     {"type": "webhook", "url": "http://127.0.0.1:9000/alerts"},
+#     {"type": "smtp", "host": "127.0.0.1", "port": 25, "from": "monitor@example.com", "to": ["noc@example.com"], "rate_limit": 2},
+# ]
+# alert_window = 30
+# alert_rate_limit = 6
+# alert_retries = 3
+
+# Interfaces, OSPF neighbors and HSRP groups whose state changed flap_threshold times within their last flap_window cycles (at most 64) are reported as flapping,
+# or as dampened once they kept the same state for flap_quiet cycles. Uncomment the lines below to change them.
+# flap_window = 20
+# flap_threshold = 4
+# flap_quiet = 5
+
+# Uncomment the lines below to also compare every cycle with other original snapshot directories, each under a name.
+# They are compared from the same collection, so the device is polled once whatever the number of baselines.
+# baselines = {
+#     "pre-change": "/home/script/sw1_original_snapshot_20230101-080000",
+#     "last-known-good": "/home/script/sw1_original_snapshot_20230101-070000",
+# }
+
+# Uncomment the line below to promote the state collected in the last cycle to a new original snapshot every rebaseline_interval seconds, without sending commands.
+# "--control promote" does the same once. Each promoted snapshot directory has a snapshot_info.json with its version and the directory it replaced.
+# Uncomment baseline_retention to keep only the newest original snapshot directories of the device; the ones in use and in baselines are always kept.
+# rebaseline_interval = 86400
+# baseline_retention = 5
+
+# Plugin monitors are found in the "nxos_monitor.plugins" entry point group of the installed packages, and in the "module:Class" references below.
+# Each plugin runs in its own process, its commands going through the monitor's session; a run that fails or exceeds plugin_time_budget seconds or plugin_cpu_budget CPU seconds only degrades that plugin.
+# plugins = ["extra:ExtraFeature"]
+# disabled_plugins = []
+# plugin_time_budget = 60
+# plugin_cpu_budget = 30
+
+# Uncomment the lines below to monitor several devices from one process with "--fleet". Each device has a hostname and an ip, and may have its own username, password and nxapi_port;
+# the missing credentials are taken from input_dict. The commands of the monitors are fetched through NX-API ("feature nxapi" on the device) on one event loop,
+# and the SSH session of a device is only opened for the commands NX-API does not answer. Set nxapi = False to use SSH only.
+# fleet = [
+#     {"hostname": "leaf1", "ip": "192.168.1.11"},
+#     {"hostname": "leaf2", "ip": "192.168.1.12", "username": "admin", "password": "Cisco"},
+# ]
+# nxapi = True
+# nxapi_port = 443
+# nxapi_https = True
+# nxapi_verify = False
@@ -1,4 +1,11 @@
 class ExtraFeature:
+    # Optional: seconds between current() runs (0 for every cycle), and the commands to prefetch with the other monitors' commands.
+    poll_interval = 0
+    commands = []
+    # Optional: the run is a failure after time_budget seconds or cpu_budget CPU seconds, and the plugin is skipped after repeated failures.
+    # time_budget = 60
+    # cpu_budget = 30
+
     # __init__ need to have two arguments. The device will be passed when create an instance.
     def __init__(self, device, **kwargs) -> None:
         pass
@@ -14,23 +14,100 @@
 # pip install pyats[library]
 
 
-from genie import testbed
-from genie.ops.utils import get_ops
-from genie.libs.parser.utils import get_parser_exclude
-from genie.utils.diff import Diff
-from unicon.core.errors import ConnectionError
 import os
 from datetime import datetime
-from time import sleep
+from time import sleep, monotonic, process_time
 import concurrent.futures
+import multiprocessing
+import threading
+import asyncio
+import argparse
 import sys
 import re
+import random
+import signal
+import atexit
+import queue
+from collections import deque
 from getpass import getpass
 import json
-
+import pickle
+import hashlib
+import base64
+import ssl
+import shutil
+import copy
+from array import array
+
+try:
+    # orjson decodes the NX-OS | json output several times faster than json.
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    # Locks the capability cache shared by the monitors of several devices; not available on Windows.
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    # Limits the CPU time of the plugin processes; not available on Windows.
+    import resource
+except ImportError:
+    resource = None
+
+
+# genie and unicon take several seconds to import, so they are loaded by
+# import_genie() when the first Device is created instead of at module load.
+testbed = None
+get_ops = None
+get_parser_exclude = None
+Diff = None
 
 class_list = []
 
+# Stops the servers started by monitor() at exit; a daemon leaving without joining its threads runs them itself.
+cleanup_list = []
+
+unsupported_regex = r"% ?(Invalid|Incomplete) (command|input)"
+ipv4_regex = r"^((25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.){3}(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])$"
+
+
+def import_genie():
+    global testbed, get_ops, get_parser_exclude, Diff, ConnectionError
+
+    if testbed is not None:
+        return
+    from genie import testbed
+    from genie.ops.utils import get_ops
+    from genie.libs.parser.utils import get_parser_exclude
+    from genie.utils.diff import Diff
+    from unicon.core.errors import ConnectionError
+
+
+def run_cleanups():
+    while len(cleanup_list) > 0:
+        cleanup = cleanup_list.pop()
+        try:
+            cleanup()
+        except Exception as e:
+            print("Cannot stop {}: {}".format(cleanup, e))
+
+
+atexit.register(run_cleanups)
+
+
+def exit_status(code) -> int:
+    """Return the process exit status of sys.exit(code)."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
 
 def decorator_instance(class_monitor):
     global class_list
@@ -38,6 +115,16 @@ def decorator_instance(class_monitor):
     return class_monitor
 
 
+def json_rows(output_dict, table, row) -> list:
+    """Return the rows of an NX-OS | json table as a list; NX-OS gives a dict when there is only one row."""
+    if len(output_dict) == 0:
+        return []
+    rows = output_dict[table][row]
+    if isinstance(rows, dict):
+        return [rows]
+    return rows
+
+
 def comparedict(original_dict, current_dict, key_list):
     diff_dict = {}
     diff_dict["Missing keys"] = {}
@@ -84,45 +171,579 @@ def comparedict(original_dict, current_dict, key_list):
     return diff_dict
 
 
+class FlapTracker:
+    """Classify objects as stable, flapping or dampened from their last window samples.
+
+    The recent states of an object are the bits of one 64-bit word in an array,
+    so a sample is a shift and a mask, and classifying it counts the state changes
+    in that word whatever the number of objects tracked. An object is flapping when
+    its state changed at least threshold times in the window, and dampened when
+    it did but kept the same state for its last quiet samples.
+    """
+
+    def __init__(self, window=20, threshold=4, quiet=5) -> None:
+        self.window = max(min(window, 64), 2)
+        self.mask = (1 << self.window) - 1
+        self.threshold = threshold
+        self.quiet = quiet
+        self.quiet_mask = (1 << quiet) - 1
+        self.index_dict = {}
+        self.history = array("Q")
+        self.samples = array("B")
+        self.flapping_set = set()
+        self.dampened_set = set()
+
+    def update(self, key, state):
+        index = self.index_dict.get(key, None)
+        if index is None:
+            index = len(self.history)
+            self.index_dict[key] = index
+            self.history.append(0)
+            self.samples.append(0)
+        history = ((self.history[index] << 1) | (1 if state else 0)) & self.mask
+        samples = min(self.samples[index] + 1, self.window)
+        self.history[index] = history
+        self.samples[index] = samples
+
+        changes = bin((history ^ (history >> 1)) &
+                      ((1 << (samples - 1)) - 1)).count("1")
+        self.flapping_set.discard(key)
+        self.dampened_set.discard(key)
+        if changes >= self.threshold:
+            if samples >= self.quiet and (history & self.quiet_mask) in (0, self.quiet_mask):
+                self.dampened_set.add(key)
+            else:
+                self.flapping_set.add(key)
+
+    def update_all(self, state_dict):
+        """Add one sample for every object; the tracked objects missing from state_dict are sampled as False."""
+
+        for key in self.index_dict:
+            if key not in state_dict:
+                self.update(key, False)
+        for key, state in state_dict.items():
+            self.update(key, state)
+
+    def __str__(self) -> str:
+        return "{} tracked, {} flapping, {} dampened".format(len(self.index_dict), len(self.flapping_set), len(self.dampened_set))
+
+
+def new_flap_tracker():
+    return FlapTracker(get_option("flap_window", 20), get_option("flap_threshold", 4), get_option("flap_quiet", 5))
+
+
 class Device:
     def __init__(self, testbed_dict, hostname, lost_safe_tuple, dir_original_snapshot_import="default", dir_original_snapshot_create="default") -> None:
         self.testbed_dict = testbed_dict
         self.hostname = hostname
         self.unsupport_list = []
+        # Filled by FeatureMonitor; None until the enabled features have been learned from the device.
+        self.feature_enabled_list = None
+        self.feature_disabled_list = []
+        self.deferred_list = []
+        self.breaker_dict = {}
+        # Set by the polling loop and the control socket.
+        self.is_detail = False
+        self.cycle_event = threading.Event()
+        self.rebaseline_requested = False
+        self.promote_requested = False
+        self.exit_requested = False
+        self.cycle_count = 0
+        self.last_cycle = None
+        self.baseline_diff_dict = {}
+        # Counts the original snapshots promoted from collected state in this run.
+        self.baseline_version = 0
         self.lost_mac_safe, self.lost_arp_safe, self.lost_routes_safe = lost_safe_tuple
+        self.ops_class_dict = {}
+        import_genie()
+        # An alternate transport to fall back to when the device cannot be reached through the vty connection.
+        self.connection_list = ["vty"]
+        alternate_protocol = get_option("alternate_protocol", None)
+        connection_dict = self.testbed_dict["devices"][self.hostname]["connections"]
+        if alternate_protocol is not None and "vty" in connection_dict:
+            connection_dict["alternate"] = dict(
+                connection_dict["vty"], protocol=alternate_protocol)
+            self.connection_list.append("alternate")
+        self.last_command = monotonic()
         testbed_nxos = testbed.load(self.testbed_dict)
         self.device_genie = testbed_nxos.devices[self.hostname]
+        self.command_cache_ttl = get_option("command_cache_ttl", 30)
+        self.command_cache_dict = {}
+        self.command_lock_dict = {}
+        self.command_cache_lock = threading.Lock()
+        self.command_timeout = get_option("command_timeout", 120)
+        self.session_pool_size = get_option("session_pool_size", 1)
+        self.session_lock = threading.BoundedSemaphore(self.session_pool_size)
+        self.snapshot_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1)
+        self.snapshot_future_list = []
+        self.batch_size = get_option("batch_size", 8)
+        self.structured_output = get_option("structured_output", False)
+        self.structured_unsupport_list = []
+        self.batch_timeout = get_option("batch_timeout", 300)
+        self.capability_file = None
+        self.capability_key = None
+        self.capability_dict = {}
+        self.capability_ttl = get_option("capability_ttl", 86400)
+        self.capability_lock = threading.Lock()
+        # Set when a command's support, a monitor or the features change, so the file is only written then.
+        self.capability_dirty = False
+        # Set while the all-detail learn runs in a thread, so its commands are not recorded.
+        self.unrecorded = threading.local()
+        # genie parsers and Ops learns all end up in device.execute, so caching there also
+        # covers parse(), learn() and the monitors and extra classes calling execute() directly.
+        self.device_genie.execute = self.execute
         self.dir_original_snapshot_import = dir_original_snapshot_import
         self.dir_original_snapshot_create = dir_original_snapshot_create
+        # Set for the devices of a fleet: an NxapiSession prefetches the commands, and the
+        # SSH session is only opened for the commands NX-API did not answer.
+        self.nxapi = None
+        self.connect_on_demand = False
 
-    def make_connection(self):
+    def make_connection(self, via="vty"):
 
         if not self.device_genie.is_connected():
             print(
                 "\nThe program is trying to connect to the host {} {} {} device via line VTY {} port {}.".format(
                     self.device_genie.name,
-                    self.testbed_dict["devices"][self.device_genie.name]["connections"]["vty"]["ip"],
+                    self.testbed_dict["devices"][self.device_genie.name]["connections"][via]["ip"],
                     self.testbed_dict["devices"][self.device_genie.name]["os"].upper(
                     ),
-                    self.testbed_dict["devices"][self.device_genie.name]["connections"]["vty"]["protocol"].upper(
+                    self.testbed_dict["devices"][self.device_genie.name]["connections"][via]["protocol"].upper(
                     ),
-                    22,
+                    23 if self.testbed_dict["devices"][self.device_genie.name]["connections"][via]["protocol"] == "telnet" else 22,
                 )
             )
-            self.device_genie.connect(
-                log_stdout=False, prompt_recovery=True, reconnect=True)
-            # self.device_genie.connect(via="vty", pool_size=10, log_stdout=False, prompt_recovery=True)
+            if self.session_pool_size > 1:
+                self.device_genie.connect(
+                    via=via, pool_size=self.session_pool_size, log_stdout=False, prompt_recovery=True)
+            else:
+                self.device_genie.connect(
+                    via=via, log_stdout=False, prompt_recovery=True, reconnect=True)
+
+    def write_snapshot(self, snapshot_file, data):
+        """Write data as a member of the original snapshot in the background."""
+        self.snapshot_future_list.append(self.snapshot_executor.submit(
+            self.write_snapshot_file, "{}/{}".format(self.dir_original_snapshot_create, snapshot_file), data))
+
+    @staticmethod
+    def write_snapshot_file(file_name, data):
+        with open(file_name, 'w') as f:
+            f.write(json.dumps(data, indent=4))
+
+    def wait_snapshots(self):
+        """Wait for the snapshot members written in the background and report the ones that failed."""
+        for future in self.snapshot_future_list:
+            try:
+                future.result()
+            except Exception as e:
+                print("Cannot write the original snapshot file: {}".format(e))
+        self.snapshot_future_list = []
+
+    def load_capability(self, capability_file):
+        """Load what this device is known to support with its platform, model and NX-OS version from capability_file.
+
+        The file is shared by all devices and keeps one entry per device and
+        version, because a command of a disabled feature fails like an unsupported
+        one. An entry has each command's support and typical runtime, the monitors
+        that could not run and the enabled features. Entries older than
+        capability_ttl seconds are probed again.
+        """
+
+        self.capability_file = capability_file
+        try:
+            version = self.device_genie.parse("show version")
+            self.capability_key = "{} {} {} {}".format(
+                self.hostname, version["platform"]["name"], version["platform"]["hardware"]["model"], version["platform"]["software"]["system_version"])
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except ConnectionError:
+            raise ConnectionError
+        except:
+            print("Cannot read the platform and NX-OS version. The capability cache is not used.")
+            self.capability_key = None
+            return None
+
+        capability_all_dict = {}
+        try:
+            if os.path.isfile(capability_file):
+                with open(capability_file, 'r') as f:
+                    capability_all_dict = json.load(f)
+        except:
+            print("Cannot read {}. The capabilities will be learned again.".format(
+                capability_file))
+
+        self.capability_dict = capability_all_dict.get(
+            self.capability_key, {"commands": {}, "monitors": {}})
+        now = datetime.now().timestamp()
+        for group in ("commands", "monitors"):
+            for key, value in list(self.capability_dict.setdefault(group, {}).items()):
+                if self.capability_ttl is not None and now - value.get("recorded", 0) > self.capability_ttl:
+                    del self.capability_dict[group][key]
+
+        for instance_name, value in self.capability_dict["monitors"].items():
+            if not value["supported"] and instance_name not in self.unsupport_list:
+                self.unsupport_list.append(instance_name)
+
+    def save_capability(self, instance_monitor_dict=None):
+        """Record the monitors that cannot run on this device and write its capabilities to the capability file.
+
+        A monitor is recorded only when all of its commands are recorded as
+        unsupported, not when it failed for a timeout, a parse error or an empty table.
+        The file is only written when something other than a runtime changed,
+        under a lock on capability_file.lock, as other monitors may update it too.
+        """
+
+        if self.capability_key is None:
+            return None
+        now = datetime.now().timestamp()
+        with self.capability_lock:
+            for instance_name, instance in (instance_monitor_dict or {}).items():
+                command_list = getattr(instance, "commands", [])
+                if getattr(instance, "unsupport", False) and instance_name not in self.capability_dict["monitors"] and len(command_list) > 0 and all(self.is_unsupported(cmd) for cmd in command_list):
+                    self.capability_dict["monitors"][instance_name] = {
+                        "supported": False, "recorded": now}
+                    self.capability_dirty = True
+            if not self.capability_dirty:
+                return None
+            self.capability_dirty = False
+            data = json.loads(json.dumps(self.capability_dict))
+
+        try:
+            with open("{}.lock".format(self.capability_file), 'w') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                capability_all_dict = {}
+                if os.path.isfile(self.capability_file):
+                    with open(self.capability_file, 'r') as f:
+                        capability_all_dict = json.load(f)
+                capability_all_dict[self.capability_key] = data
+                tmp_file = "{}.{}.tmp".format(self.capability_file, os.getpid())
+                with open(tmp_file, 'w') as f:
+                    f.write(json.dumps(capability_all_dict, indent=4))
+                os.replace(tmp_file, self.capability_file)
+        except:
+            print("Cannot write the capability cache {}.".format(
+                self.capability_file))
+            with self.capability_lock:
+                self.capability_dirty = True
+
+    def is_unsupported(self, cmd):
+        command = self.capability_dict.get("commands", {}).get(cmd, None)
+        return command is not None and not command["supported"]
+
+    def record_command(self, cmd, supported, runtime=None):
+        with self.capability_lock:
+            if "commands" not in self.capability_dict:
+                return None
+            command = self.capability_dict["commands"].get(cmd, None)
+            if command is None or command["supported"] != supported:
+                self.capability_dirty = True
+            command = self.capability_dict["commands"].setdefault(
+                cmd, {"supported": supported, "runtime": runtime})
+            command["supported"] = supported
+            command["recorded"] = datetime.now().timestamp()
+            if runtime is not None:
+                # Keep a moving average so one slow cycle does not define the typical runtime.
+                command["runtime"] = runtime if command.get(
+                    "runtime") is None else round(0.8 * command["runtime"] + 0.2 * runtime, 3)
+
+    def reset_unsupport_list(self):
+        """Keep in unsupport_list only the monitors the capability cache records as unsupported, before a new original state is learned."""
+
+        with self.capability_lock:
+            self.unsupport_list[:] = [instance_name for instance_name, value in self.capability_dict.get(
+                "monitors", {}).items() if not value["supported"]]
+
+    def set_features(self, feature_list):
+        """Keep the features enabled on the device; the commands recorded as unsupported are probed again once they change."""
+
+        with self.capability_lock:
+            previous_list = self.feature_enabled_list
+            if previous_list is None:
+                previous_list = self.capability_dict.get("features", None)
+            if "commands" in self.capability_dict:
+                if previous_list is not None and sorted(previous_list) != sorted(feature_list):
+                    for cmd, command in list(self.capability_dict["commands"].items()):
+                        if not command["supported"]:
+                            del self.capability_dict["commands"][cmd]
+                    self.capability_dict["monitors"] = {}
+                if self.capability_dict.get("features", None) != sorted(feature_list):
+                    self.capability_dirty = True
+                self.capability_dict["features"] = sorted(feature_list)
+        self.feature_enabled_list = feature_list
+
+    def gate_features(self, instance_monitor_dict):
+        """Update feature_disabled_list with the monitors whose feature_dependency is not enabled on the device."""
+
+        if self.feature_enabled_list is None:
+            return None
+        for instance_name, instance in instance_monitor_dict.items():
+            dependency_list = getattr(instance, "feature_dependency", [])
+            if all(feature in self.feature_enabled_list for feature in dependency_list):
+                if instance_name in self.feature_disabled_list:
+                    self.feature_disabled_list.remove(instance_name)
+            elif instance_name not in self.feature_disabled_list:
+                self.feature_disabled_list.append(instance_name)
+
+    def get_breaker(self, instance_name):
+        """Return the circuit breaker of a monitor, shared by everything running it on this device."""
+
+        if instance_name not in self.breaker_dict:
+            self.breaker_dict[instance_name] = CircuitBreaker(get_option("breaker_threshold", 3), get_option(
+                "breaker_backoff", 60), get_option("breaker_max_backoff", 3600))
+        return self.breaker_dict[instance_name]
+
+    def new_cycle(self):
+        """Forget the command outputs of the previous cycle."""
+        with self.command_cache_lock:
+            self.command_cache_dict.clear()
+
+    def execute(self, cmd, **kwargs):
+        """Run cmd on the device, reusing its output if it already ran in this cycle within command_cache_ttl seconds."""
+
+        # A timeout only bounds the run of a command that is not cached.
+        if not isinstance(cmd, str) or len(set(kwargs) - {"timeout"}) > 0 or self.command_cache_ttl <= 0:
+            return self.execute_uncached(cmd, **kwargs)
+
+        with self.command_cache_lock:
+            command_lock = self.command_lock_dict.setdefault(
+                cmd, threading.Lock())
+        # Monitors asking for the same command at the same time wait for the first one's output.
+        with command_lock:
+            with self.command_cache_lock:
+                cached = self.command_cache_dict.get(cmd, None)
+            if cached is not None and monotonic() - cached[0] < self.command_cache_ttl:
+                return cached[1]
+            output = self.execute_uncached(cmd, **kwargs)
+            with self.command_cache_lock:
+                self.command_cache_dict[cmd] = (monotonic(), output)
+            return output
+
+    def learn_json(self, cmd, function):
+        """Return function(output) for the decoded | json output of cmd, or None to use the genie parser.
+
+        A command whose JSON output is rejected or cannot be read (older NX-OS
+        releases) falls back to the genie parser for the rest of the run. Other
+        errors, such as timeouts, are raised.
+        """
+
+        cmd_json = "{} | json".format(cmd)
+        if not self.structured_output or cmd_json in self.structured_unsupport_list:
+            return None
+        if self.is_unsupported(cmd_json):
+            return None
+        try:
+            output = self.device_genie.execute(cmd_json)
+        except Exception as e:
+            if re.search(unsupported_regex, str(e)):
+                self.structured_unsupport_list.append(cmd_json)
+                return None
+            raise
+        try:
+            if len(output.strip()) == 0:
+                return function({})
+            return function(json_loads(output))
+        except (ValueError, KeyError, TypeError):
+            self.structured_unsupport_list.append(cmd_json)
+            return None
+
+    def execute_batch(self, cmd_list) -> dict:
+        """Run cmd_list in one round trip and return the output of each command.
+
+        The commands are chained on one command line, behind a start marker
+        and with an echo marker after each of them, and the output is split back
+        at the markers; what comes before the start marker, such as the echoed
+        command line, is dropped. If the device rejects the command line or its
+        output cannot be split, batching is turned off for the device and an
+        empty dictionary is returned, so the commands run one by one.
+        """
+
+        start_marker = "### nxos-genie-monitor batch start ###"
+        marker_list = ["### nxos-genie-monitor batch {} ###".format(i)
+                       for i in range(len(cmd_list))]
+        line = "echo {} ; ".format(start_marker) + " ; ".join("{} ; echo {}".format(cmd, marker)
+                                                               for cmd, marker in zip(cmd_list, marker_list))
+        try:
+            output = self.execute_uncached(line, timeout=self.batch_timeout)
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except ConnectionError:
+            raise ConnectionError
+        except Exception as e:
+            if re.search(unsupported_regex, str(e)):
+                self.stop_batching()
+            return {}
+
+        output_dict = {}
+        output_lines = []
+        index = None
+        for output_line in str(output).splitlines(True):
+            if index is None:
+                if output_line.strip() == start_marker:
+                    index = 0
+            elif index < len(marker_list) and output_line.strip() == marker_list[index]:
+                output_dict[cmd_list[index]] = "".join(output_lines)
+                output_lines = []
+                index = index + 1
+            else:
+                output_lines.append(output_line)
+        if index != len(cmd_list):
+            self.stop_batching()
+            return {}
+        return output_dict
+
+    def stop_batching(self):
+        if self.batch_size > 1:
+            print("{} does not run chained commands. The commands are sent one by one.".format(
+                self.hostname))
+        self.batch_size = 1
+
+    def prefetch_commands(self, instance_monitor_dict) -> list:
+        """Return the commands declared by the active monitors, with "| json" where their JSON output is read."""
+
+        cmd_list = []
+        for instance_name, instance in instance_monitor_dict.items():
+            if instance_name in self.unsupport_list or instance_name in self.feature_disabled_list:
+                continue
+            for cmd in getattr(instance, "commands", []):
+                if self.is_unsupported(cmd):
+                    continue
+                if self.structured_output and cmd in getattr(instance, "json_commands", []) and "{} | json".format(cmd) not in self.structured_unsupport_list:
+                    cmd = "{} | json".format(cmd)
+                if cmd not in cmd_list:
+                    cmd_list.append(cmd)
+        return cmd_list
+
+    def prefetch(self, instance_monitor_dict):
+        """Run the commands declared by the active monitors as a few batches and cache their outputs."""
+
+        if self.command_cache_ttl <= 0 or self.batch_size < 2:
+            return None
+
+        cmd_list = self.prefetch_commands(instance_monitor_dict)
+        for i in range(0, len(cmd_list), self.batch_size):
+            output_dict = self.execute_batch(cmd_list[i:i + self.batch_size])
+            with self.command_cache_lock:
+                for cmd, output in output_dict.items():
+                    self.command_cache_dict[cmd] = (monotonic(), output)
+
+    async def async_prefetch(self, instance_monitor_dict):
+        """Fetch the commands declared by the active monitors through NX-API and cache their outputs.
+
+        The commands NX-API rejects, or all of them if it cannot be reached,
+        are left to the monitors, which run them over SSH.
+        """
+
+        if self.command_cache_ttl <= 0:
+            return None
+
+        cmd_list = self.prefetch_commands(instance_monitor_dict)
+        batch_size = max(self.batch_size, 1)
+        for i in range(0, len(cmd_list), batch_size):
+            try:
+                output_dict = await self.nxapi.run(cmd_list[i:i + batch_size])
+            except (OSError, ValueError, asyncio.TimeoutError) as e:
+                if self.nxapi.reachable:
+                    print("Cannot fetch the commands of {} through NX-API: {!r}. They run over SSH until it answers.".format(
+                        self.hostname, e))
+                self.nxapi.reachable = False
+                return None
+            self.nxapi.reachable = True
+            with self.command_cache_lock:
+                for cmd, output in output_dict.items():
+                    self.command_cache_dict[cmd] = (monotonic(), output)
+
+    def execute_uncached(self, cmd, **kwargs):
+        # device_genie.execute is shadowed by the cache, so look it up on the connection through pyATS.
+        # The session lock lets background learns share the session one command at a time.
+        if self.is_unsupported(cmd):
+            raise ValueError(
+                "The command is not supported on this platform: {}".format(cmd))
+        if self.command_timeout is not None:
+            kwargs.setdefault("timeout", self.command_timeout)
+        if not self.session_lock.acquire(timeout=kwargs.get("timeout", -1)):
+            raise TimeoutError(
+                "The session is busy with another command: {}".format(cmd))
+        # Batched command lines and the all-detail commands are not recorded, only the monitors' commands run on their own.
+        is_recorded = isinstance(cmd, str) and " ; " not in cmd and not getattr(
+            self.unrecorded, "active", False)
+        try:
+            if self.connect_on_demand and not self.device_genie.is_connected():
+                self.make_connection()
+            start = monotonic()
+            self.last_command = start
+            output = type(self.device_genie).__getattr__(
+                self.device_genie, "execute")(cmd, **kwargs)
+        except Exception as e:
+            if is_recorded and re.search(unsupported_regex, str(e)):
+                self.record_command(cmd, False)
+            raise
+        finally:
+            self.session_lock.release()
+        if is_recorded:
+            self.record_command(cmd, True, monotonic() - start)
+        return output
+
+    def learn_ops(self, feature, attributes=None):
+        """Learn a genie Ops feature with a new Ops object of the cached Ops class.
+
+        attributes limits the learn to the given attribute paths, so genie only
+        runs the show commands needed to fill them.
+        """
+
+        # An Ops object keeps its maker's outputs and leafs after learn(), so it is not reused.
+        Ops = self.get_ops(feature)
+        ops_object = Ops(device=self.device_genie, attributes=attributes)
+        ops_object.learn()
+        return ops_object
+
+    def get_ops(self, feature):
+        # Resolve each Ops class once; get_ops walks the genie Ops packages on every call.
+        if feature not in self.ops_class_dict:
+            self.ops_class_dict[feature] = get_ops(feature, self.device_genie)
+        return self.ops_class_dict[feature]
 
 
 @decorator_instance
 class FeatureMonitor:
+    snapshot_file = "feature_enabled.json"
+    state_name = "feature_enabled"
+    commands = ["show feature", "show feature-set"]
+    json_commands = ["show feature", "show feature-set"]
+
     def __init__(self, device) -> None:
         self.device = device
         self.unsupport = False
 
+    @staticmethod
+    def feature_from_json(output_dict):
+        feature_enabled = []
+        for row in json_rows(output_dict, "TABLE_cfcFeatureCtrlTable", "ROW_cfcFeatureCtrlTable"):
+            if row["cfcFeatureCtrlOpStatus2"] == "enabled" and row["cfcFeatureCtrlName2"] not in feature_enabled:
+                feature_enabled.append(row["cfcFeatureCtrlName2"])
+        return feature_enabled
+
+    @staticmethod
+    def feature_set_from_json(output_dict):
+        feature_enabled = []
+        for row in json_rows(output_dict, "TABLE_cfcFeatureSetTable", "ROW_cfcFeatureSetTable"):
+            if row["cfcFeatureSetOpStatus"] == "enabled" and row["cfcFeatureSetName"] not in feature_enabled:
+                feature_enabled.append(row["cfcFeatureSetName"])
+        return feature_enabled
+
     def learn_feature(self):
         feature_enabled = []
         try:
+            feature_json = self.device.learn_json(
+                "show feature", self.feature_from_json)
+            feature_set_json = self.device.learn_json(
+                "show feature-set", self.feature_set_from_json)
+            if feature_json is not None and feature_set_json is not None:
+                self.unsupport = False
+                self.device.set_features(feature_json + feature_set_json)
+                return feature_json + feature_set_json
+
             cmd = "show feature"
             output = self.device.device_genie.parse(cmd)
             for key, value in output["feature"].items():
@@ -139,12 +760,14 @@ class FeatureMonitor:
                         feature_enabled.append(key)
                         break
             self.unsupport = False
+            self.device.set_features(list(feature_enabled))
         except KeyboardInterrupt:
             raise KeyboardInterrupt
         except ConnectionError:
             raise ConnectionError
         except:
             self.unsupport = True
+            self.failed = True
             print("Cannot monitor feature.")
         return feature_enabled
 
@@ -153,13 +776,12 @@ class FeatureMonitor:
         if self.device.dir_original_snapshot_import == "default" and self.device.dir_original_snapshot_create != "default":
             self.feature_enabled_original = self.learn_feature()
 
-            with open("{}/feature_enabled.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(self.feature_enabled_original, indent=4))
+            self.device.write_snapshot(self.snapshot_file, self.feature_enabled_original)
 
         else:
             try:
-                if os.path.isfile("{}/feature_enabled.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/feature_enabled.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         self.feature_enabled_original = json.load(f)
                 else:
                     self.device.unsupport_list.append(
@@ -177,13 +799,16 @@ class FeatureMonitor:
         if hasattr(self, "feature_enabled_original"):
             self.feature_enabled_current = self.learn_feature()
             if not self.unsupport:
-                self.feature_changed, self.delta_feature, self.percentage_delta_feature = self.__find_feature_diff()
+                self.compare()
         else:
             print("The original feature of {} have not been learned yet.".format(
                 self.device.device_genie.name))
 
         return None
 
+    def compare(self):
+        self.feature_changed, self.delta_feature, self.percentage_delta_feature = self.__find_feature_diff()
+
     def __find_feature_diff(self):
         feature_changed = []
         for feature in self.feature_enabled_original:
@@ -220,22 +845,43 @@ class FeatureMonitor:
 
         return string
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "feature_changed") and hasattr(self, "delta_feature") and hasattr(self, "percentage_delta_feature"):
+            return {"counts": {"features_disabled": self.delta_feature},
+                    "percentages": {"features_disabled": self.percentage_delta_feature},
+                    "items": {"features_disabled": self.feature_changed}}
+        return {}
+
 
 @decorator_instance
 class InterfaceMonitor:
+    snapshot_file = "interface_up_list.json"
+    state_name = "intf_up_list"
+    commands = ["show interface"]
+    json_commands = ["show interface"]
+    ops_attributes = ["info[(.*)][oper_status]"]
 
     def __init__(self, device):
 
         self.device = device
         self.unsupport = False
+        self.flap_tracker = new_flap_tracker()
+
+    @staticmethod
+    def interfaces_from_json(output_dict):
+        return [row["interface"] for row in json_rows(output_dict, "TABLE_interface", "ROW_interface") if row.get("state", None) == "up"]
 
     def learn_interfaces(self) -> list:
 
         intf_up_list = []
         try:
-            Interface = get_ops("interface", self.device.device_genie)
-            interface_object = Interface(device=self.device.device_genie)
-            interface_object.learn()
+            intf_up_list_json = self.device.learn_json(
+                "show interface", self.interfaces_from_json)
+            if intf_up_list_json is not None:
+                self.unsupport = False
+                return intf_up_list_json
+
+            interface_object = self.device.learn_ops("interface", self.ops_attributes)
 
             for intf in interface_object.info:
                 if (
@@ -250,6 +896,7 @@ class InterfaceMonitor:
             raise ConnectionError
         except:
             self.unsupport = True
+            self.failed = True
             print("Cannot monitor interfaces.")
         return intf_up_list
 
@@ -257,13 +904,12 @@ class InterfaceMonitor:
 
         if self.device.dir_original_snapshot_import == "default" and self.device.dir_original_snapshot_create != "default":
             self.intf_up_list_original = self.learn_interfaces()
-            with open("{}/interface_up_list.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(self.intf_up_list_original, indent=4))
+            self.device.write_snapshot(self.snapshot_file, self.intf_up_list_original)
 
         else:
             try:
-                if os.path.isfile("{}/interface_up_list.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/interface_up_list.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         self.intf_up_list_original = json.load(f)
                 else:
                     self.device.unsupport_list.append(
@@ -282,13 +928,20 @@ class InterfaceMonitor:
         if hasattr(self, "intf_up_list_original"):
             self.intf_up_list_current = self.learn_interfaces()
             if not self.unsupport:
-                self.intf_down_list, self.delta_intf, self.percentage_delta_intf = self.__find_interfaces_down()
+                self.compare()
+                self.flap_tracker.update_all(
+                    {intf: True for intf in self.intf_up_list_current})
+                self.flapping_list = sorted(self.flap_tracker.flapping_set)
+                self.dampened_list = sorted(self.flap_tracker.dampened_set)
             return None
         else:
             print("The original interfaces of {} have not been learned yet.".format(
                 self.device.device_genie.name))
             return None
 
+    def compare(self):
+        self.intf_down_list, self.delta_intf, self.percentage_delta_intf = self.__find_interfaces_down()
+
     def __find_interfaces_down(self) -> tuple:
 
         intf_down_list = []
@@ -308,7 +961,7 @@ class InterfaceMonitor:
 
     def is_changed(self):
         if hasattr(self, "intf_down_list"):
-            if len(self.intf_down_list) > 0:
+            if len(self.intf_down_list) > 0 or len(getattr(self, "flapping_list", [])) > 0:
                 return True
             else:
                 return False
@@ -323,11 +976,29 @@ class InterfaceMonitor:
             if len(self.intf_down_list) > 0:
                 for intf in self.intf_down_list:
                     string = string + "   {}\n".format(intf)
+        if len(getattr(self, "flapping_list", [])) > 0:
+            string = string + "{} interfaces are flapping:\n".format(
+                len(self.flapping_list))
+            for intf in self.flapping_list:
+                string = string + "   {}\n".format(intf)
         return string
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "intf_down_list") and hasattr(self, "delta_intf") and hasattr(self, "percentage_delta_intf"):
+            return {"counts": {"interfaces_down": self.delta_intf, "interfaces_flapping": len(getattr(self, "flapping_list", [])),
+                               "interfaces_dampened": len(getattr(self, "dampened_list", []))},
+                    "percentages": {"interfaces_down": self.percentage_delta_intf},
+                    "items": {"interfaces_down": self.intf_down_list, "interfaces_flapping": getattr(self, "flapping_list", []),
+                              "interfaces_dampened": getattr(self, "dampened_list", [])}}
+        return {}
+
 
 @decorator_instance
 class FabricpathMonitor:
+    snapshot_file = "fabricpath.json"
+    state_name = "fabricpath_dict"
+    feature_dependency = ["fabricpath"]
+    commands = ["show fabricpath switch-id | json", "show fabricpath isis adjacency", "show fabricpath isis interface brief | json"]
 
     def __init__(self, device) -> None:
         self.device = device
@@ -340,7 +1011,7 @@ class FabricpathMonitor:
         try:
             cmd = "show fabricpath switch-id | json"
             output = self.device.device_genie.execute(cmd)
-            output_dict = json.loads(output)
+            output_dict = json_loads(output)
             fabricpath_dict["show fabricpath switch-id"] = {
                 "list switch-id": []}
             fabricpath_dict["show fabricpath switch-id"]["local_swid_present"] = output_dict["local_swid_present"]
@@ -369,7 +1040,7 @@ class FabricpathMonitor:
 
             cmd = "show fabricpath isis interface brief | json"
             output = self.device.device_genie.execute(cmd)
-            output_dict = json.loads(output)
+            output_dict = json_loads(output)
             fabricpath_dict["show fabricpath isis interface brief"] = {}
             if "intf-name-out" in output_dict["TABLE_process_tag"]["ROW_process_tag"].keys():
                 if type(output_dict["TABLE_process_tag"]["ROW_process_tag"]["intf-name-out"]) == list:
@@ -439,6 +1110,7 @@ class FabricpathMonitor:
                 )
             )
             self.unsupport = True
+            self.failed = True
 
         return fabricpath_dict
 
@@ -446,14 +1118,12 @@ class FabricpathMonitor:
 
         if self.device.dir_original_snapshot_import == "default" and self.device.dir_original_snapshot_create != "default":
             self.fabricpath_dict_original = self.learn_fabricpath()
-            with open("{}/fabricpath.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(
-                    self.fabricpath_dict_original, indent=4))
+            self.device.write_snapshot(self.snapshot_file, self.fabricpath_dict_original)
         else:
             try:
-                if os.path.isfile("{}/fabricpath.json".format(self.device.dir_original_snapshot_import)):
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
 
-                    with open("{}/fabricpath.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         self.fabricpath_dict_original = json.load(f)
                 else:
 
@@ -472,7 +1142,7 @@ class FabricpathMonitor:
         if hasattr(self, "fabricpath_dict_original"):
             self.fabricpath_dict_current = self.learn_fabricpath()
             if not self.unsupport:
-                self.fabricpath_diff_dict = self.__find_fabricpath_diff()
+                self.compare()
             return None
         else:
 
@@ -480,6 +1150,9 @@ class FabricpathMonitor:
                 self.device.device_genie.name))
             return None
 
+    def compare(self):
+        self.fabricpath_diff_dict = self.__find_fabricpath_diff()
+
     def __find_fabricpath_diff(self):
         fabricpath_diff_dict = {}
 
@@ -591,20 +1264,57 @@ class FabricpathMonitor:
         else:
             return ""
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "fabricpath_diff_dict"):
+            record = {"counts": {"switch_ids_lost": int(self.fabricpath_diff_dict["num_switchid_lost"]),
+                                 "interfaces_changed": self.fabricpath_diff_dict["delta_fabricpath_interface"]},
+                      "percentages": {"interfaces_changed": self.fabricpath_diff_dict["percentage_delta_fabricpath_interface"]},
+                      "items": {"interfaces_lost": self.fabricpath_diff_dict.get("Interfaces lost", {})}}
+            if self.fabricpath_diff_dict["Adjacencies lost"] != "Not support":
+                record["counts"]["adjacencies_changed"] = self.fabricpath_diff_dict["delta_fabricpath_adjacency"]
+                record["percentages"]["adjacencies_changed"] = self.fabricpath_diff_dict["percentage_delta_fabricpath_adjacency"]
+                # "Adjacencies lost" is 0 when no adjacency changed.
+                record["items"]["adjacencies_lost"] = self.fabricpath_diff_dict["Adjacencies lost"] or {}
+            return record
+        return {}
+
 
 @ decorator_instance
 class VlanMonitor:
+    snapshot_file = "vlan.json"
+    state_name = "vlan_dict"
+    commands = ["show vlan"]
+    json_commands = ["show vlan"]
+    ops_attributes = ["info[vlans][(.*)][name]", "info[vlans][(.*)][state]"]
 
     def __init__(self, device):
         self.device = device
         self.unsupport = False
 
+    @staticmethod
+    def vlans_from_json(output_dict):
+        vlan_dict = {}
+        for row in json_rows(output_dict, "TABLE_vlanbrief", "ROW_vlanbrief"):
+            vlan_id = str(row["vlanshowbr-vlanid-utf"])
+            vlan_dict[vlan_id] = {"vlan_id": vlan_id,
+                                  "name": row["vlanshowbr-vlanname"],
+                                  "state": row["vlanshowbr-vlanstate"]}
+            if row.get("vlanshowbr-shutstate", None) == "shutdown":
+                vlan_dict[vlan_id]["state"] = "shutdown"
+        return vlan_dict
+
     def learn_vlans(self) -> dict:
 
         try:
-            Vlan = get_ops('vlan', self.device.device_genie)
-            vlan_object = Vlan(device=self.device.device_genie)
-            vlan_object.learn()
+            vlan_dict_json = self.device.learn_json(
+                "show vlan", self.vlans_from_json)
+            if vlan_dict_json is not None:
+                if len(vlan_dict_json) == 0:
+                    print("There are 0 VLAN. Cannot monitor VLAN.")
+                self.unsupport = False
+                return vlan_dict_json
+
+            vlan_object = self.device.learn_ops("vlan", self.ops_attributes)
             vlan_dict = {}
             if vlan_object.info.get("vlans", None):
                 vlan_object.info["vlans"].pop("interface_vlan_enabled", None)
@@ -625,6 +1335,7 @@ class VlanMonitor:
             raise ConnectionError
         except:
             self.unsupport = True
+            self.failed = True
             print("Cannot monitor VLANs.")
         return {}
 
@@ -634,13 +1345,12 @@ class VlanMonitor:
 
             self.vlan_dict_original = self.learn_vlans()
 
-            with open("{}/vlan.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(self.vlan_dict_original, indent=4))
+            self.device.write_snapshot(self.snapshot_file, self.vlan_dict_original)
 
         else:
             try:
-                if os.path.isfile("{}/vlan.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/vlan.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         self.vlan_dict_original = json.load(f)
                 else:
                     self.device.unsupport_list.append("VlanMonitor_instance")
@@ -657,13 +1367,16 @@ class VlanMonitor:
         if hasattr(self, "vlan_dict_original"):
             self.vlan_dict_current = self.learn_vlans()
             if not self.unsupport:
-                self.vlan_changed_dict, self.delta_vlan, self.percentage_delta_vlan = self.__find_vlans_change()
+                self.compare()
             return None
         else:
             print("The original VLANs of {} have not been learned yet.".format(
                 self.device.device_genie.name))
             return None
 
+    def compare(self):
+        self.vlan_changed_dict, self.delta_vlan, self.percentage_delta_vlan = self.__find_vlans_change()
+
     def __find_vlans_change(self) -> tuple:
 
         vlan_changed_dict = {}
@@ -709,22 +1422,43 @@ class VlanMonitor:
 
         return string
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "vlan_changed_dict") and hasattr(self, "delta_vlan") and hasattr(self, "percentage_delta_vlan"):
+            return {"counts": {"vlans_down": self.delta_vlan},
+                    "percentages": {"vlans_down": self.percentage_delta_vlan},
+                    "items": {"vlans_down": self.vlan_changed_dict}}
+        return {}
+
 
 @ decorator_instance
 class FdbMonitor:
+    snapshot_file = "fdb.json"
+    state_name = "total_mac_addresses"
+    snapshot_key = "total_mac_addresses_original"
+    commands = ["show mac address-table"]
+    json_commands = ["show mac address-table"]
+    ops_attributes = ["info[mac_table][vlans][(.*)][mac_addresses][(.*)][mac_address]"]
 
     def __init__(self, device):
 
         self.device = device
         self.unsupport = False
 
+    @staticmethod
+    def mac_addresses_from_json(output_dict):
+        return len(json_rows(output_dict, "TABLE_mac_address", "ROW_mac_address"))
+
     def learn_fdb(self) -> int:
 
         total_mac_addresses = 0
         try:
-            Fdb = get_ops('fdb', self.device.device_genie)
-            fdb_object = Fdb(self.device.device_genie)
-            fdb_object.learn()
+            total_mac_addresses_json = self.device.learn_json(
+                "show mac address-table", self.mac_addresses_from_json)
+            if total_mac_addresses_json is not None:
+                self.unsupport = False
+                return total_mac_addresses_json
+
+            fdb_object = self.device.learn_ops("fdb", self.ops_attributes)
 
             try:
                 for key in fdb_object.info["mac_table"]["vlans"]:
@@ -734,6 +1468,7 @@ class FdbMonitor:
                 self.unsupport = False
             except:
                 self.unsupport = True
+                self.failed = True
                 print("Cannot monitor MAC address table.")
                 return total_mac_addresses
         except KeyboardInterrupt:
@@ -742,6 +1477,7 @@ class FdbMonitor:
             raise ConnectionError
         except:
             self.unsupport = True
+            self.failed = True
             print("Cannot monitor MAC address table.")
         return total_mac_addresses
 
@@ -752,13 +1488,12 @@ class FdbMonitor:
             self.total_mac_addresses_original = self.learn_fdb()
             fdb_dict = dict()
             fdb_dict["total_mac_addresses_original"] = self.total_mac_addresses_original
-            with open("{}/fdb.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(fdb_dict, indent=4))
+            self.device.write_snapshot(self.snapshot_file, fdb_dict)
 
         else:
             try:
-                if os.path.isfile("{}/fdb.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/fdb.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         fdb_dict = json.load(f)
                         self.total_mac_addresses_original = fdb_dict["total_mac_addresses_original"]
                 else:
@@ -776,13 +1511,16 @@ class FdbMonitor:
         if hasattr(self, "total_mac_addresses_original"):
             self.total_mac_addresses_current = self.learn_fdb()
             if not self.unsupport:
-                self.delta_mac, self.percentage_delta_mac = self.__find_delta()
+                self.compare()
             return None
         else:
             print("The original FDB - MAC Address table of {} have not been learned yet.".format(
                 self.device.device_genie.name))
             return None
 
+    def compare(self):
+        self.delta_mac, self.percentage_delta_mac = self.__find_delta()
+
     def __find_delta(self) -> tuple:
 
         delta_mac = 0
@@ -815,38 +1553,65 @@ class FdbMonitor:
         else:
             return ""
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "delta_mac") and hasattr(self, "percentage_delta_mac"):
+            return {"counts": {"mac_addresses_lost": self.delta_mac},
+                    "percentages": {"mac_addresses_lost": self.percentage_delta_mac},
+                    "items": {}}
+        return {}
+
 
 @ decorator_instance
 class ArpMonitor:
+    snapshot_file = "arp.json"
+    state_name = "arp_entries"
+    snapshot_key = "total_arp_entries_original"
+    commands = ["show ip arp detail vrf all"]
+    json_commands = ["show ip arp detail vrf all"]
+    mac_regex = r"^([0-9a-f]{4}[.]){2}([0-9a-f]{4})$"
 
     def __init__(self, device):
 
         self.device = device
         self.unsupport = False
 
+    @classmethod
+    def arp_from_json(cls, output_dict):
+        arp_entries = 0
+        for vrf_row in json_rows(output_dict, "TABLE_vrf", "ROW_vrf"):
+            if "TABLE_adj" not in vrf_row:
+                continue
+            for adj_row in json_rows(vrf_row, "TABLE_adj", "ROW_adj"):
+                if re.search(cls.mac_regex, adj_row.get("mac", "")):
+                    arp_entries = arp_entries + 1
+        return arp_entries
+
     def learn_arp(self) -> int:
 
         arp_entries = 0
 
         try:
             cmd = "show ip arp detail vrf all"
-            arp_object_output = self.device.device_genie.parse(cmd)
-
-            if len(arp_object_output) < 1:
-                return arp_entries
-            if len(arp_object_output["interfaces"]) < 1:
-                return arp_entries
-
-            regex = r"^([0-9a-f]{4}[.]){2}([0-9a-f]{4})$"
-            for key in arp_object_output["interfaces"]:
-                for ip_key in arp_object_output["interfaces"][key]["ipv4"]["neighbors"]:
-                    if re.search(
-                        regex,
-                        arp_object_output["interfaces"][key]["ipv4"]["neighbors"][ip_key][
-                            "link_layer_address"
-                        ],
-                    ):
-                        arp_entries = arp_entries + 1
+            arp_entries_json = self.device.learn_json(cmd, self.arp_from_json)
+            if arp_entries_json is not None:
+                arp_entries = arp_entries_json
+            else:
+                arp_object_output = self.device.device_genie.parse(cmd)
+
+                if len(arp_object_output) < 1:
+                    return arp_entries
+                if len(arp_object_output["interfaces"]) < 1:
+                    return arp_entries
+
+                for key in arp_object_output["interfaces"]:
+                    for ip_key in arp_object_output["interfaces"][key]["ipv4"]["neighbors"]:
+                        if re.search(
+                            self.mac_regex,
+                            arp_object_output["interfaces"][key]["ipv4"]["neighbors"][ip_key][
+                                "link_layer_address"
+                            ],
+                        ):
+                            arp_entries = arp_entries + 1
             self.unsupport = False
         except ConnectionError:
             print("\nThe connection is disconnected. The device may be reloading.")
@@ -860,10 +1625,11 @@ class ArpMonitor:
                 )
             )
             self.unsupport = True
+            self.failed = True
 
-        if arp_entries == 0:
+        # An empty table is a valid sample once the original state has entries.
+        if arp_entries == 0 and not hasattr(self, "arp_entries_original"):
             print("There are 0 ARP. Cannot monitor ARP.")
-            self.unsupport = True
 
         return arp_entries
 
@@ -874,13 +1640,12 @@ class ArpMonitor:
             self.arp_entries_original = self.learn_arp()
             arp_dict = dict()
             arp_dict["total_arp_entries_original"] = self.arp_entries_original
-            with open("{}/arp.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(arp_dict, indent=4))
+            self.device.write_snapshot(self.snapshot_file, arp_dict)
 
         else:
             try:
-                if os.path.isfile("{}/arp.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/arp.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         arp_dict = json.load(f)
                         self.arp_entries_original = arp_dict["total_arp_entries_original"]
                 else:
@@ -898,13 +1663,16 @@ class ArpMonitor:
         if hasattr(self, "arp_entries_original"):
             self.arp_entries_current = self.learn_arp()
             if not self.unsupport:
-                self.delta_arp, self.percentage_delta_arp = self.__find_delta()
+                self.compare()
             return None
         else:
             print("The original ARP table of {} have not been learned yet.".format(
                 self.device.device_genie.name))
             return None
 
+    def compare(self):
+        self.delta_arp, self.percentage_delta_arp = self.__find_delta()
+
     def __find_delta(self) -> tuple:
 
         delta_arp = 0
@@ -937,9 +1705,21 @@ class ArpMonitor:
         else:
             return ""
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "delta_arp") and hasattr(self, "percentage_delta_arp"):
+            return {"counts": {"arp_entries_lost": self.delta_arp},
+                    "percentages": {"arp_entries_lost": self.percentage_delta_arp},
+                    "items": {}}
+        return {}
+
 
 @ decorator_instance
 class RoutingMonitor:
+    snapshot_file = "routing.json"
+    state_name = "num_routes"
+    snapshot_key = "num_routes_original"
+    commands = ["show ip route vrf all", "show ipv6 route vrf all"]
+    ops_attributes = ["info[vrf][(.*)][address_family][(.*)][routes][(.*)][route]"]
 
     def __init__(self, device):
         self.device = device
@@ -949,9 +1729,7 @@ class RoutingMonitor:
 
         num_routes = 0
         try:
-            Routing = get_ops('routing', self.device.device_genie)
-            routing_object = Routing(device=self.device.device_genie)
-            routing_object.learn()
+            routing_object = self.device.learn_ops("routing", self.ops_attributes)
 
             for vrf_key in routing_object.info["vrf"]:
                 for ip_protocol_key in routing_object.info["vrf"][vrf_key]["address_family"]:
@@ -969,6 +1747,7 @@ class RoutingMonitor:
             raise ConnectionError
         except:
             self.unsupport = True
+            self.failed = True
             print("Cannot monitor routing table.")
         return num_routes
 
@@ -979,13 +1758,12 @@ class RoutingMonitor:
             self.num_routes_original = self.learn_routing()
             routing_dict = dict()
             routing_dict["num_routes_original"] = self.num_routes_original
-            with open("{}/routing.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(routing_dict, indent=4))
+            self.device.write_snapshot(self.snapshot_file, routing_dict)
 
         else:
             try:
-                if os.path.isfile("{}/routing.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/routing.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         routing_dict = json.load(f)
                         self.num_routes_original = routing_dict["num_routes_original"]
                 else:
@@ -1004,13 +1782,16 @@ class RoutingMonitor:
         if hasattr(self, "num_routes_original"):
             self.num_routes_current = self.learn_routing()
             if not self.unsupport:
-                self.delta_routes, self.percentage_delta_routes = self.__find_delta()
+                self.compare()
             return None
         else:
             print("The original Routing table of {} have not been learned yet.".format(
                 self.device.device_genie.name))
             return None
 
+    def compare(self):
+        self.delta_routes, self.percentage_delta_routes = self.__find_delta()
+
     def __find_delta(self) -> tuple:
 
         delta_routes = 0
@@ -1043,22 +1824,35 @@ class RoutingMonitor:
         else:
             return ""
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "delta_routes") and hasattr(self, "percentage_delta_routes"):
+            return {"counts": {"routes_lost": self.delta_routes},
+                    "percentages": {"routes_lost": self.percentage_delta_routes},
+                    "items": {}}
+        return {}
+
 
 @ decorator_instance
 class OspfMonitor:
+    snapshot_file = "ospf_neighbors_list.json"
+    state_name = "ospf_neighbor_list"
+    feature_dependency = ["ospf"]
+    # genie's attribute filter takes one key per level, so every link type and leaf gets its own path.
+    ops_attributes = ["info[feature_ospf]"] + [
+        "info[vrf][(.*)][address_family][ipv4][instance][(.*)][areas][(.*)][{}][(.*)][neighbors][(.*)][{}]".format(link, leaf)
+        for link in ["virtual_links", "sham_links", "interfaces"] for leaf in ["neighbor_router_id", "address", "state"]]
 
     def __init__(self, device):
 
         self.device = device
         self.unsupport = False
+        self.flap_tracker = new_flap_tracker()
 
     def learn_ospf(self) -> list:
 
         ospf_neighbor_list = []
         try:
-            Ospf = get_ops('ospf', self.device.device_genie)
-            ospf_object = Ospf(device=self.device.device_genie)
-            ospf_object.learn()
+            ospf_object = self.device.learn_ops("ospf", self.ops_attributes)
             if ospf_object.info["feature_ospf"] == True and ospf_object.info.get("vrf", None):
                 for vrf in list(ospf_object.info["vrf"].keys()):
                     for instance in list(ospf_object.info["vrf"][vrf]["address_family"]["ipv4"]["instance"].keys()):
@@ -1125,6 +1919,7 @@ class OspfMonitor:
             raise ConnectionError
         except:
             self.unsupport = True
+            self.failed = True
             print("Cannot monitor OSPF neighbors")
         return ospf_neighbor_list
 
@@ -1132,13 +1927,12 @@ class OspfMonitor:
 
         if self.device.dir_original_snapshot_import == "default" and self.device.dir_original_snapshot_create != "default":
             self.ospf_neighbor_list_original = self.learn_ospf()
-            with open("{}/ospf_neighbors_list.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(self.ospf_neighbor_list_original, indent=4))
+            self.device.write_snapshot(self.snapshot_file, self.ospf_neighbor_list_original)
 
         else:
             try:
-                if os.path.isfile("{}/ospf_neighbors_list.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/ospf_neighbors_list.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         self.ospf_neighbor_list_original = json.load(f)
                 else:
                     self.device.unsupport_list.append("OspfMonitor_instance")
@@ -1158,13 +1952,25 @@ class OspfMonitor:
 
             self.ospf_neighbor_list_current = self.learn_ospf()
             if not self.unsupport:
-                self.neighbor_change_list, self.delta_ospf, self.percentage_delta_ospf = self.__find_ospf_neighbors_change()
+                self.compare()
+                self.flap_tracker.update_all({self.neighbor_key(neighbor): neighbor["state"] == "full"
+                                              for neighbor in self.ospf_neighbor_list_current})
+                self.flapping_list = sorted(self.flap_tracker.flapping_set)
+                self.dampened_list = sorted(self.flap_tracker.dampened_set)
             return None
         else:
             print("The original OSPF of {} have not been learned yet.".format(
                 self.device.device_genie.name))
             return None
 
+    def compare(self):
+        self.neighbor_change_list, self.delta_ospf, self.percentage_delta_ospf = self.__find_ospf_neighbors_change()
+
+    @staticmethod
+    def neighbor_key(neighbor):
+        return "VRF {} instance {} area {} {} neighbor {}".format(neighbor["vrf"], neighbor["ospf_instance"], neighbor["area"], neighbor.get(
+            "virtual_link", neighbor.get("sham_link", neighbor.get("interface", ""))), neighbor["neighbor_router_id"])
+
     def __find_ospf_neighbors_change(self) -> tuple:
 
         neighbor_change_list = []
@@ -1233,7 +2039,7 @@ class OspfMonitor:
 
     def is_changed(self):
         if hasattr(self, "neighbor_change_list"):
-            if len(self.neighbor_change_list) > 0:
+            if len(self.neighbor_change_list) > 0 or len(getattr(self, "flapping_list", [])) > 0:
                 return True
             else:
                 return False
@@ -1250,33 +2056,49 @@ class OspfMonitor:
                     for key, value in neighbor_dict.items():
                         string = string + "   {}: {}\n".format(key, value)
                     string = string + "\n"
-                return string
             else:
                 string = string + "   None\n"
-                return string
+            if len(getattr(self, "flapping_list", [])) > 0:
+                string = string + "{} OSPF neighbors are flapping:\n".format(
+                    len(self.flapping_list))
+                for neighbor in self.flapping_list:
+                    string = string + "   {}\n".format(neighbor)
+            return string
         else:
             return ""
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "neighbor_change_list") and hasattr(self, "delta_ospf") and hasattr(self, "percentage_delta_ospf"):
+            return {"counts": {"neighbors_changed": self.delta_ospf, "neighbors_flapping": len(getattr(self, "flapping_list", [])),
+                               "neighbors_dampened": len(getattr(self, "dampened_list", []))},
+                    "percentages": {"neighbors_changed": self.percentage_delta_ospf},
+                    "items": {"neighbors_changed": self.neighbor_change_list, "neighbors_flapping": getattr(self, "flapping_list", []),
+                              "neighbors_dampened": getattr(self, "dampened_list", [])}}
+        return {}
+
 
 @ decorator_instance
 class HsrpMonitor:
+    snapshot_file = "hsrp.json"
+    state_name = "hsrp_dict"
+    feature_dependency = ["hsrp_engine"]
+    hsrp_keys = ["active_ip_address", "active_ipv6_address", "active_mac_address", "active_router",
+                 "standby_ip_address", "standby_ipv6_address", "standby_mac_address", "standby_router", "hsrp_router_state"]
+    ops_attributes = ["info[(.*)][address_family][(.*)][version][(.*)][groups][(.*)][{}]".format(key)
+                      for key in hsrp_keys]
+
     def __init__(self, device):
 
         self.device = device
         self.unsupport = False
+        self.flap_tracker = new_flap_tracker()
 
     def learn_hsrp(self) -> dict:
 
         hsrp_dict = {}
         try:
-            Hsrp = get_ops("hsrp", self.device.device_genie)
-            hsrp_object = Hsrp(device=self.device.device_genie)
-            # , attributes=['name[(.*)][address_family][(.*)][version][(.*)][groups][(.*)][active_ip_address|active_ipv6_address|active_mac_address]'])
-            hsrp_keys = ["active_ip_address", "active_ipv6_address", "active_mac_address", "active_router",
-                         "standby_ip_address", "standby_ipv6_address", "standby_mac_address", "standby_router", "hsrp_router_state"]
-
-            hsrp_object.learn()
-            if hsrp_object.info["enabled"] == False:
+            hsrp_object = self.device.learn_ops("hsrp", self.ops_attributes)
+            if hsrp_object.info.get("enabled", None) == False:
                 self.unsupport = True
             hsrp_object.info.pop("enabled", None)
             hsrp_object.info.pop("logging", None)
@@ -1285,8 +2107,8 @@ class HsrpMonitor:
                     for version in hsrp_object.info[intf]["address_family"][addrFamily]["version"]:
                         for group in hsrp_object.info[intf]["address_family"][addrFamily]["version"][version]["groups"]:
 
-                            for key in hsrp_object.info[intf]["address_family"][addrFamily]["version"][version]["groups"][group]:
-                                if key not in hsrp_keys:
+                            for key in list(hsrp_object.info[intf]["address_family"][addrFamily]["version"][version]["groups"][group]):
+                                if key not in self.hsrp_keys:
                                     hsrp_object.info[intf]["address_family"][addrFamily]["version"][version]["groups"][group].pop(
                                         key, None)
 
@@ -1299,6 +2121,7 @@ class HsrpMonitor:
             raise ConnectionError
         except:
             self.unsupport = True
+            self.failed = True
             print("Cannot monitor HSRP.")
         return hsrp_dict
 
@@ -1306,13 +2129,12 @@ class HsrpMonitor:
 
         if self.device.dir_original_snapshot_import == "default" and self.device.dir_original_snapshot_create != "default":
             self.hsrp_dict_original = self.learn_hsrp()
-            with open("{}/hsrp.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(self.hsrp_dict_original, indent=4))
+            self.device.write_snapshot(self.snapshot_file, self.hsrp_dict_original)
 
         else:
             try:
-                if os.path.isfile("{}/hsrp.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/hsrp.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         self.hsrp_dict_original = json.load(f)
                 else:
                     self.device.unsupport_list.append(
@@ -1331,19 +2153,40 @@ class HsrpMonitor:
         if hasattr(self, "hsrp_dict_original"):
             self.hsrp_dict_current = self.learn_hsrp()
             if not self.unsupport:
-                self.hsrp_changed_dict, self.delta_hsrp, self.percentage_delta_hsrp = self.__find_hsrp_diff()
+                self.compare()
+                self.flap_tracker.update_all(self.group_state_dict())
+                self.flapping_list = sorted(self.flap_tracker.flapping_set)
+                self.dampened_list = sorted(self.flap_tracker.dampened_set)
             return None
         else:
             print("The original HSRP of {} have not been learned yet.".format(
                 self.device.device_genie.name))
             return None
 
+    def compare(self):
+        self.hsrp_changed_dict, self.delta_hsrp, self.percentage_delta_hsrp = self.__find_hsrp_diff()
+
+    def group_state_dict(self) -> dict:
+        """Return whether each HSRP group is in the router state it had in the original state."""
+
+        state_dict = {}
+        for intf in self.hsrp_dict_current:
+            for addrFamily in self.hsrp_dict_current[intf].get("address_family", {}):
+                for version in self.hsrp_dict_current[intf]["address_family"][addrFamily].get("version", {}):
+                    for group, value in self.hsrp_dict_current[intf]["address_family"][addrFamily]["version"][version].get("groups", {}).items():
+                        try:
+                            original_state = self.hsrp_dict_original[intf]["address_family"][
+                                addrFamily]["version"][version]["groups"][group]["hsrp_router_state"]
+                        except (KeyError, TypeError):
+                            original_state = None
+                        state_dict["{} {} version {} group {}".format(intf, addrFamily, version, group)] = value.get(
+                            "hsrp_router_state", None) == original_state
+        return state_dict
+
     def __find_hsrp_diff(self) -> tuple:
 
         hsrp_changed_dict = {}
 
-        hsrp_keys = ["active_ip_address", "active_ipv6_address", "active_mac_address", "active_router",
-                     "standby_ip_address", "standby_ipv6_address", "standby_mac_address", "standby_router", "hsrp_router_state"]
         for intf in self.hsrp_dict_original:
 
             hsrp_changed_dict[intf] = {"Missing": [],
@@ -1357,7 +2200,7 @@ class HsrpMonitor:
                 for version in self.hsrp_dict_original[intf]["address_family"][addrFamily]["version"]:
                     try:
                         group_diff = comparedict(self.hsrp_dict_original[intf]["address_family"][addrFamily]["version"][version]["groups"],
-                                                 self.hsrp_dict_current[intf]["address_family"][addrFamily]["version"][version]["groups"], hsrp_keys)
+                                                 self.hsrp_dict_current[intf]["address_family"][addrFamily]["version"][version]["groups"], self.hsrp_keys)
 
                         if group_diff["Missing delta"] > 0:
                             for key in group_diff["Missing keys"]:
@@ -1392,7 +2235,7 @@ class HsrpMonitor:
 
     def is_changed(self):
         if hasattr(self, "hsrp_changed_dict"):
-            if self.delta_hsrp > 0:
+            if self.delta_hsrp > 0 or len(getattr(self, "flapping_list", [])) > 0:
                 return True
             else:
                 return False
@@ -1419,21 +2262,229 @@ class HsrpMonitor:
                                 string = string + \
                                     "{}{}: {} --> {}\n".format(
                                         " "*9, atribute, value["original"], value["current"])
+        if len(getattr(self, "flapping_list", [])) > 0:
+            string = string + "{} HSRP groups are flapping:\n".format(
+                len(self.flapping_list))
+            for group in self.flapping_list:
+                string = string + "   {}\n".format(group)
 
         return string
 
+    def diff_record(self) -> dict:
+        if hasattr(self, "hsrp_changed_dict") and hasattr(self, "delta_hsrp") and hasattr(self, "percentage_delta_hsrp"):
+            return {"counts": {"interfaces_changed": self.delta_hsrp, "groups_flapping": len(getattr(self, "flapping_list", [])),
+                               "groups_dampened": len(getattr(self, "dampened_list", []))},
+                    "percentages": {"interfaces_changed": self.percentage_delta_hsrp},
+                    "items": {"interfaces_changed": self.hsrp_changed_dict, "groups_flapping": getattr(self, "flapping_list", []),
+                              "groups_dampened": getattr(self, "dampened_list", [])}}
+        return {}
+
+
+def item_fingerprints(items) -> dict:
+    # Lists are keyed by their elements and dictionaries by their keys, so a changed value shows up as new.
+    if isinstance(items, dict):
+        return {key: json.dumps(value, sort_keys=True, default=str) for key, value in items.items()}
+    if not isinstance(items, (list, tuple, set)):
+        # A single value is one item, and no value is no item.
+        items = [] if items is None or items == 0 or items == "" else [items]
+    return {item if isinstance(item, str) else json.dumps(item, sort_keys=True, default=str): item for item in items}
+
+
+def record_delta(previous_record, current_record) -> dict:
+    """Return what changed between two diff_record() results of a monitor.
+
+    The result has the counts that moved, and the items that are new or cleared
+    since the previous record; it is empty when nothing changed.
+    """
+
+    delta = {}
+    previous_count_dict = previous_record.get("counts", {})
+    for name, count in current_record.get("counts", {}).items():
+        if previous_count_dict.get(name, 0) != count:
+            delta.setdefault("counts", {})[name] = [
+                previous_count_dict.get(name, 0), count]
+
+    previous_item_dict = previous_record.get("items", {})
+    current_item_dict = current_record.get("items", {})
+    for name in list(current_item_dict) + [name for name in previous_item_dict if name not in current_item_dict]:
+        previous_fingerprint_dict = item_fingerprints(
+            previous_item_dict.get(name, []))
+        current_fingerprint_dict = item_fingerprints(
+            current_item_dict.get(name, []))
+        new_list = [key if isinstance(current_item_dict.get(name), dict) else value for key, value in current_fingerprint_dict.items()
+                    if previous_fingerprint_dict.get(key, None) != value]
+        cleared_list = [key if isinstance(previous_item_dict.get(name), dict) else value for key, value in previous_fingerprint_dict.items()
+                        if key not in current_fingerprint_dict]
+        if len(new_list) > 0:
+            delta.setdefault("new", {})[name] = new_list
+        if len(cleared_list) > 0:
+            delta.setdefault("cleared", {})[name] = cleared_list
+    return delta
+
+
+def delta_text(instance_name, delta) -> str:
+    string = "{} since the last cycle:\n".format(instance_name)
+    for name, (previous_count, count) in delta.get("counts", {}).items():
+        string = string + "   {}: {} --> {}\n".format(name, previous_count, count)
+    for name, item_list in delta.get("new", {}).items():
+        string = string + "   new {}: {}\n".format(name, ", ".join(
+            item if isinstance(item, str) else json.dumps(item, default=str) for item in item_list))
+    for name, item_list in delta.get("cleared", {}).items():
+        string = string + "   cleared {}: {}\n".format(name, ", ".join(
+            item if isinstance(item, str) else json.dumps(item, default=str) for item in item_list))
+    return string
+
+
+def diff_command(original_dict, current_dict, exclude) -> str:
+    """Run genie Diff on one command's outputs; all-detail worker processes call this."""
+    import_genie()
+    diff = Diff(original_dict, current_dict, exclude=exclude)
+    diff.findDiff()
+    return str(diff)
+
+
+class MerkleDiff:
+    """Diff two parsed outputs by comparing structural hashes of their subtrees.
+
+    Every dictionary gets a BLAKE2 digest built from its keys and its children's
+    digests, so identical subtrees are skipped without walking them. Only the branches
+    whose hashes differ are handed to genie Diff, which keeps its report format.
+    The hashes of the original output are computed once and reused every cycle.
+    With more than one worker, the changed commands are diffed in a process pool.
+    """
+
+    def __init__(self, workers=1) -> None:
+        self.workers = workers
+        self.executor = None
+        self.exclude = None
+        self.excluded_key_dict = {}
+        self.original = None
+        self.original_tree = None
+
+    def set_exclude(self, exclude):
+        self.exclude = list(exclude)
+        self.excluded_key_dict = {}
+        self.original = None
+        if len(self.exclude) > 0:
+            self.exclude_regex = re.compile(
+                "|".join(re.escape(str(key)) for key in self.exclude))
+        else:
+            self.exclude_regex = None
+
+    def is_excluded(self, key) -> bool:
+        if key not in self.excluded_key_dict:
+            self.excluded_key_dict[key] = self.exclude_regex is not None and self.exclude_regex.fullmatch(
+                str(key)) is not None
+        return self.excluded_key_dict[key]
+
+    def hash_tree(self, value):
+        """Return the digest of value, or (digest, children) for a dictionary.
+
+        children maps each non-excluded key of the dictionary to the node of its value.
+        Values are encoded with their type, so 1, "1" and True get different digests.
+        """
+
+        if isinstance(value, dict):
+            children = {}
+            entry_list = []
+            for key, child in value.items():
+                excluded = self.excluded_key_dict.get(key, None)
+                if excluded is None:
+                    excluded = self.is_excluded(key)
+                if not excluded:
+                    node = self.hash_tree(child)
+                    children[key] = node
+                    entry_list.append(hashlib.blake2b(repr(key).encode() + self.node_hash(node),
+                                                      digest_size=16).digest())
+            # Sorting the entries keeps the digest independent of the key order.
+            return (hashlib.blake2b(b"d" + b"".join(sorted(entry_list)), digest_size=16).digest(), children)
+        if isinstance(value, list):
+            return hashlib.blake2b(b"l" + b"".join(self.node_hash(self.hash_tree(item)) for item in value),
+                                   digest_size=16).digest()
+        return hashlib.blake2b("v{}:{!r}".format(type(value).__name__, value).encode(), digest_size=16).digest()
+
+    @staticmethod
+    def node_hash(node):
+        return node[0] if type(node) is tuple else node
+
+    def prune(self, original, current, original_node, current_node) -> tuple:
+        """Return copies of original and current that only keep the branches whose hashes differ."""
+
+        original_pruned = {}
+        current_pruned = {}
+        current_children = current_node[1]
+        for key, original_child in original_node[1].items():
+            current_child = current_children.get(key, None)
+            if current_child is None:
+                original_pruned[key] = original[key]
+            elif self.node_hash(original_child) != self.node_hash(current_child):
+                if type(original_child) is tuple and type(current_child) is tuple:
+                    original_pruned[key], current_pruned[key] = self.prune(
+                        original[key], current[key], original_child, current_child)
+                else:
+                    original_pruned[key] = original[key]
+                    current_pruned[key] = current[key]
+        for key in current_children:
+            if key not in original_node[1]:
+                current_pruned[key] = current[key]
+        return (original_pruned, current_pruned)
+
+    def diff(self, original, current, exclude) -> str:
+        if self.exclude != list(exclude):
+            self.set_exclude(exclude)
+        if self.original is not original:
+            self.original = original
+            self.original_tree = self.hash_tree(original)
+
+        current_tree = self.hash_tree(current)
+        if self.node_hash(self.original_tree) == self.node_hash(current_tree):
+            return ""
+        original_pruned, current_pruned = self.prune(
+            original, current, self.original_tree, current_tree)
+        cmd_list = list(original_pruned.keys())
+        cmd_list.extend(
+            cmd for cmd in current_pruned if cmd not in original_pruned)
+        if self.workers < 2 or len(cmd_list) < 2:
+            return diff_command(original_pruned, current_pruned, self.exclude)
+
+        if self.executor is None:
+            # spawn: forking a process that holds live SSH sessions and threads is not safe.
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        future_list = []
+        for cmd in cmd_list:
+            original_dict = {cmd: original_pruned[cmd]} if cmd in original_pruned else {}
+            current_dict = {cmd: current_pruned[cmd]} if cmd in current_pruned else {}
+            future_list.append(self.executor.submit(
+                diff_command, original_dict, current_dict, self.exclude))
+        try:
+            string_list = [future.result() for future in future_list]
+        except concurrent.futures.process.BrokenProcessPool:
+            self.executor = None
+            return diff_command(original_pruned, current_pruned, self.exclude)
+        return "\n".join(string for string in string_list if string != "")
+
 
 class AllDetail:
+    snapshot_file = "all_detail_original.json"
+
     def __init__(self, device):
 
         self.device = device
+        self.original_thread = None
+        self.merkle_diff = MerkleDiff(
+            get_option("diff_workers", os.cpu_count() or 1))
 
     def parse_all_cmd(self):
 
         cmd_list = []
         cmd_error_list = []
 
-        output = self.device.device_genie.parse("all")
+        self.device.unrecorded.active = True
+        try:
+            output = self.device.device_genie.parse("all")
+        finally:
+            self.device.unrecorded.active = False
 
         for cmd in output:
             if "errored" in output[cmd].keys():
@@ -1498,21 +2549,53 @@ class AllDetail:
         if self.device.dir_original_snapshot_import == "default" and self.device.dir_original_snapshot_create != "default":
 
             self.all_detail_original, self.exclude = self.parse_all_cmd()
-            with open("{}/all_detail_original.json".format(self.device.dir_original_snapshot_create), 'w') as f:
-                f.write(json.dumps(self.all_detail_original, indent=4))
+            self.device.write_snapshot(self.snapshot_file, self.all_detail_original)
 
         else:
             try:
-                if os.path.isfile("{}/all_detail_original.json".format(self.device.dir_original_snapshot_import)):
-                    with open("{}/all_detail_original.json".format(self.device.dir_original_snapshot_import), 'r') as f:
+                if os.path.isfile("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file)):
+                    with open("{}/{}".format(self.device.dir_original_snapshot_import, self.snapshot_file), 'r') as f:
                         self.all_detail_original = json.load(f)
                 else:
                     self.all_detail_original, self.exclude = self.parse_all_cmd()
             except:
                 self.all_detail_original, self.exclude = self.parse_all_cmd()
 
+    def learn_original(self):
+        print("The program is learning {}'s all details for the original state...".format(
+            self.device.device_genie.name))
+        now1 = datetime.now()
+        self.original()
+        now2 = datetime.now()
+        print(
+            "The all details for original state has learned in {:.2f} seconds.".format(
+                (now2 - now1).total_seconds()
+            )
+        )
+
+    def learn_original_background(self):
+        try:
+            self.learn_original()
+        except:
+            print("\nThe all details for original state cannot be learned in the background. They will be learned when the mode compare all detail differences is turned on.")
+
+    def start_original(self):
+        """Learn the original all details in a background thread while the common monitoring runs."""
+        self.original_thread = threading.Thread(
+            target=self.learn_original_background, daemon=True)
+        self.original_thread.start()
+
+    def wait_original(self):
+        """Make sure the original all details are learned, learning them now if they are not."""
+        if self.original_thread is not None:
+            self.original_thread.join()
+            self.original_thread = None
+        if not hasattr(self, "all_detail_original"):
+            self.learn_original()
+
     def current(self):
         self.all_detail_current, self.exclude = self.parse_all_cmd()
+        self.all_detail_cycle = self.device.cycle_count
 
         if not self.device.dir_original_snapshot_import == "default":
             all_detail_current_json = json.dumps(
@@ -1522,10 +2605,7 @@ class AllDetail:
         self.diff_all_details = self.__find_diff_all_detail()
 
     def __find_diff_all_detail(self):
-        diff = Diff(self.all_detail_original,
-                    self.all_detail_current, exclude=self.exclude)
-        diff.findDiff()
-        return diff
+        return self.merkle_diff.diff(self.all_detail_original, self.all_detail_current, self.exclude)
 
     def is_changed(self):
         if hasattr(self, "diff"):
@@ -1551,6 +2631,361 @@ class AllDetail:
             return ""
 
 
+plugin_group = "nxos_monitor.plugins"
+
+
+def discover_plugins() -> dict:
+    """Find the plugin monitors without importing them.
+
+    Plugins are the entry points of the installed packages in the plugin_group
+    group and the "module:Class" references in the plugins option, such as
+    "extra:ExtraFeature". Returns {name: entry point}; a plugin is imported the
+    first time it runs, in its own process. The names in disabled_plugins are left out.
+    """
+
+    try:
+        from importlib import metadata
+    except ImportError:
+        print("Plugins need Python 3.8 or later.")
+        return {}
+
+    plugin_dict = {}
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        entry_point_list = entry_points.select(group=plugin_group)
+    else:
+        entry_point_list = entry_points.get(plugin_group, [])
+    for entry_point in entry_point_list:
+        plugin_dict[entry_point.name] = entry_point
+    for value in get_option("plugins", []):
+        name = value.split(":")[-1].split(".")[-1]
+        plugin_dict[name] = metadata.EntryPoint(name, value, plugin_group)
+    for name in get_option("disabled_plugins", []):
+        plugin_dict.pop(name, None)
+    return plugin_dict
+
+
+class PluginDevice:
+    """The device as a plugin sees it in its own process.
+
+    execute() and parse() send the command to the monitor's process, which
+    runs it through Device.execute, and return its output or raise its error.
+    """
+
+    def __init__(self, connection, hostname) -> None:
+        self.connection = connection
+        self.hostname = hostname
+        self.name = hostname
+        # Plugins may call device.device_genie.execute() as the built-in monitors do.
+        self.device_genie = self
+
+    def request(self, kind, cmd):
+        self.connection.send((kind, cmd))
+        status, value = self.connection.recv()
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+    def execute(self, cmd, **kwargs):
+        return self.request("execute", cmd)
+
+    def parse(self, cmd, **kwargs):
+        return self.request("parse", cmd)
+
+
+def plugin_state(plugin) -> dict:
+    """Return the attributes of plugin that can be sent to the monitor's process."""
+
+    state_dict = {}
+    for key, value in vars(plugin).items():
+        if isinstance(value, PluginDevice):
+            continue
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        state_dict[key] = value
+    return state_dict
+
+
+def limit_cpu(cpu_budget):
+    """Have the kernel stop this process with SIGXCPU once it uses cpu_budget more CPU seconds."""
+
+    if resource is None or cpu_budget is None:
+        return None
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    # RLIMIT_CPU counts whole seconds; the monitor checks the exact CPU time of each run.
+    soft = int(process_time() + cpu_budget) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def run_plugin(connection, hostname, name, value, cpu_budget):
+    """Serve the runs of one plugin in its own process until the monitor closes the connection.
+
+    This process first sends ("ready", None). The monitor then sends ("run",
+    method_name, state), state being the attributes the plugin had in the
+    process this one replaces, or None. This process answers ("loaded", settings) once it has imported the plugin class, then
+    ("done", result) or ("error", text), with the plugin's commands in between.
+    """
+
+    from importlib import metadata
+    device = PluginDevice(connection, hostname)
+    plugin = None
+    connection.send(("ready", None))
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return None
+        start = process_time()
+        try:
+            limit_cpu(cpu_budget)
+            if plugin is None:
+                plugin_class = metadata.EntryPoint(name, value, plugin_group).load()
+                cpu_budget = getattr(plugin_class, "cpu_budget", cpu_budget)
+                limit_cpu(cpu_budget)
+                connection.send(("loaded", {
+                    "poll_interval": getattr(plugin_class, "poll_interval", 0),
+                    "commands": list(getattr(plugin_class, "commands", [])),
+                    "feature_dependency": list(getattr(plugin_class, "feature_dependency", [])),
+                    "time_budget": getattr(plugin_class, "time_budget", None),
+                    "cpu_budget": cpu_budget}))
+                plugin = plugin_class(device)
+                if message[2] is not None:
+                    vars(plugin).update(message[2])
+            result_dict = {}
+            getattr(plugin, message[1])()
+            if message[1] == "current":
+                # is_changed() and diff() run here too, so the polling loop only reads their results.
+                result_dict["changed"] = bool(plugin.is_changed())
+                result_dict["diff"] = str(plugin.diff()) if result_dict["changed"] else ""
+            result_dict["state"] = plugin_state(plugin)
+            result_dict["cpu_time"] = process_time() - start
+            connection.send(("done", result_dict))
+        except Exception as e:
+            connection.send(("error", repr(e)))
+
+
+class PluginMonitor:
+    """Run a plugin monitor in its own process, within its time and CPU budgets.
+
+    A plugin is a class like ExtraFeature in extra.py, taking the device and
+    providing original(), current(), is_changed() and diff(). It may declare
+    poll_interval (seconds between its current() runs, 0 for every cycle),
+    commands (prefetched with the other monitors' commands), feature_dependency,
+    time_budget and cpu_budget. All of the plugin's code, its import included,
+    runs in a process of its own under an RLIMIT_CPU limit; the device it gets
+    is a PluginDevice sending each command back to this process, where a worker
+    thread runs it through Device.execute while the run is within time_budget.
+    A run that raises, takes longer than time_budget seconds or uses more than
+    cpu_budget CPU seconds is a failure of this plugin only: the cycle goes on
+    without waiting, and the plugin's circuit breaker skips it after repeated
+    failures. The process of a run past its budget is killed, so it sends no
+    more commands; the next run starts a new one from the state the plugin had
+    after its last finished run. A plugin still running from an earlier cycle
+    is not started again.
+    """
+
+    def __init__(self, device, name, entry_point) -> None:
+        self.device = device
+        self.name = name
+        self.instance_name = "{}_plugin".format(name)
+        self.poll_interval = 0
+        self.command_list = []
+        self.feature_dependency = []
+        self.time_budget = get_option("plugin_time_budget", 60)
+        self.cpu_budget = get_option("plugin_cpu_budget", 30)
+        self.isolated = True
+        self.unsupport = False
+        self.failed = False
+        self.error = None
+        self.last_run = None
+        self.cpu_time = 0
+        self.changed = False
+        self.diff_text = ""
+        self._entry_point = entry_point
+        self._process = None
+        self._connection = None
+        self._state = None
+        self._future = None
+
+    @property
+    def commands(self) -> list:
+        # Nothing to prefetch for a plugin that is not due in this cycle.
+        if self.is_due():
+            return self.command_list
+        return []
+
+    def is_due(self) -> bool:
+        return self.last_run is None or monotonic() - self.last_run >= self.poll_interval
+
+    def load(self, settings):
+        self.poll_interval = settings["poll_interval"]
+        self.command_list = settings["commands"]
+        self.feature_dependency = settings["feature_dependency"]
+        if settings["time_budget"] is not None:
+            self.time_budget = settings["time_budget"]
+        self.cpu_budget = settings["cpu_budget"]
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=run_plugin, name="plugin {}".format(self.name), args=(
+            child_connection, self.device.hostname, self.name, self._entry_point.value, self.cpu_budget), daemon=True)
+        self._process.start()
+        child_connection.close()
+
+    def stop(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join()
+            self._connection.close()
+            self._process = None
+
+    def receive(self, deadline):
+        """Return the next message of the plugin's process, stopping the process past the time budget."""
+
+        try:
+            if deadline is not None and not self._connection.poll(max(deadline - monotonic(), 0)):
+                self.stop()
+                raise RuntimeError("did not finish within its time budget of {} seconds".format(
+                    self.time_budget))
+            return self._connection.recv()
+        except (EOFError, OSError):
+            self._process.join()
+            exitcode = self._process.exitcode
+            self.stop()
+            if exitcode == -getattr(signal, "SIGXCPU", 0):
+                raise RuntimeError("was stopped past its CPU budget of {} seconds".format(
+                    self.cpu_budget))
+            raise RuntimeError("stopped with exit code {}".format(exitcode))
+
+    def serve(self, kind, cmd, deadline):
+        """Run a command of the plugin through Device.execute, within the rest of its time budget."""
+
+        kwargs = {}
+        if deadline is not None:
+            kwargs["timeout"] = max(deadline - monotonic(), 1)
+        try:
+            output = self.device.execute(cmd, **kwargs)
+            if kind == "parse":
+                # The genie parser reads the output cached above; JSON leaves out genie types the plugin's process may not know.
+                output = json.loads(json.dumps(
+                    self.device.device_genie.parse(cmd), default=str))
+            return ("ok", output)
+        except Exception as e:
+            return ("error", str(e))
+
+    def call(self, method_name):
+        """Run method_name of the plugin in its process and serve its commands; returns the CPU seconds it used."""
+
+        state = None
+        if self._process is None or not self._process.is_alive():
+            self.stop()
+            self.start()
+            # The budgets start once Python is up in the new process.
+            self.receive(None)
+            state = self._state
+        start = monotonic()
+        self._connection.send(("run", method_name, state))
+        while True:
+            deadline = None if self.time_budget is None else start + self.time_budget
+            kind, value = self.receive(deadline)
+            if kind == "loaded":
+                self.load(value)
+            elif kind == "error":
+                raise RuntimeError("failed: {}".format(value))
+            elif kind == "done":
+                break
+            else:
+                self._connection.send(self.serve(kind, value, deadline))
+        if method_name == "current":
+            self.diff_text = value["diff"]
+            self.changed = value["changed"]
+        self._state = value["state"]
+        self.cpu_time = value["cpu_time"]
+        return self.cpu_time
+
+    def submit(self, method_name):
+        if self._future is not None and not self._future.done():
+            self.fail(method_name, "is still running from an earlier cycle")
+            return None
+        if method_name == "current" and not self.is_due():
+            return None
+        self.last_run = monotonic()
+        future = concurrent.futures.Future()
+
+        def work():
+            if not future.set_running_or_notify_cancel():
+                return None
+            try:
+                future.set_result(self.call(method_name))
+            except BaseException as e:
+                future.set_exception(e)
+
+        self._future = future
+        threading.Thread(target=work, name="plugin {}".format(
+            self.name), daemon=True).start()
+        return future
+
+    def finish(self, method_name, future):
+        if not future.done():
+            self.fail(method_name, "did not finish within its time budget of {} seconds".format(
+                self.time_budget))
+        elif future.exception() is not None:
+            self.fail(method_name, str(future.exception()))
+        elif self.cpu_budget is not None and future.result() > self.cpu_budget:
+            self.fail(method_name, "used {:.2f} CPU seconds, over its budget of {} seconds".format(
+                future.result(), self.cpu_budget))
+        else:
+            self.failed = False
+            self.error = None
+
+    def fail(self, method_name, reason):
+        self.failed = True
+        self.error = reason
+        print("The plugin {} {}.".format(self.name, reason))
+        # Without its original state, the plugin is left out for the rest of the run.
+        if method_name == "original" and self.instance_name not in self.device.unsupport_list:
+            self.device.unsupport_list.append(self.instance_name)
+
+    def run(self, method_name):
+        future = self.submit(method_name)
+        if future is not None:
+            concurrent.futures.wait([future], self.time_budget)
+            self.finish(method_name, future)
+
+    async def async_run(self, method_name):
+        future = self.submit(method_name)
+        if future is not None:
+            wrapped = asyncio.wrap_future(future)
+            # finish() reads the outcome from future, even when it comes after the time budget.
+            wrapped.add_done_callback(
+                lambda wrapped: wrapped.cancelled() or wrapped.exception())
+            await asyncio.wait([wrapped], timeout=self.time_budget)
+            self.finish(method_name, future)
+
+    def original(self):
+        self.run("original")
+
+    def current(self):
+        self.run("current")
+
+    async def async_original(self):
+        await self.async_run("original")
+
+    async def async_current(self):
+        await self.async_run("current")
+
+    def is_changed(self):
+        return self.changed
+
+    def diff(self):
+        return self.diff_text
+
+
 def askYesNo(question):
     answer = input(question)
     while answer.upper() != "Y" and answer.upper() != "N":
@@ -1569,10 +3004,9 @@ def askDirectory(prompt):
 
 
 def askIPv4address():
-    regex = "^((25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.){3}(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])$"
     while True:
         ipv4 = input("Enter the IPv4 address of the device: ")
-        if(re.search(regex, ipv4)):
+        if(re.search(ipv4_regex, ipv4)):
             break
         else:
             print("Invalid IPv4 address")
@@ -1627,6 +3061,15 @@ def get_testbed(testbed_dir):
     return testbed_dict
 
 
+def get_option(name, default):
+    """Return an optional setting from databaseconfig.py, or default if it is not set."""
+    try:
+        import databaseconfig as cfg
+        return getattr(cfg, name, default)
+    except ImportError:
+        return default
+
+
 def get_imported_data() -> tuple:
 
     print()
@@ -1759,16 +3202,1242 @@ def get_imported_data() -> tuple:
     return (testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_snapshot_import)
 
 
-def runThreadPoolExecutor(instance_monitor_dict, method_name):
+def get_fleet_data() -> tuple:
+    """Build the testbed of the devices in the fleet option of databaseconfig.py.
+
+    Each entry has a hostname and an ip, and may have its own username,
+    password and nxapi_port; the missing credentials are taken from input_dict.
+    """
+
+    import databaseconfig as cfg
+
+    default_dict = getattr(cfg, "input_dict", {})
+    testbed_dict = {"devices": {}}
+    nxapi_dict = {}
+    for entry in cfg.fleet:
+        username = entry.get("username", default_dict.get("username"))
+        password = entry.get("password", default_dict.get("password"))
+        testbed_dict["devices"][entry["hostname"]] = {
+            "type": "Nexus",
+            "os": "nxos",
+            "connections": {"defaults": {
+                "class": "unicon.Unicon"},
+                "vty": {
+                "protocol": "ssh",
+                "ip": entry["ip"]}},
+            "credentials": {
+                "default": {
+                    "password": password,
+                    "username": username}
+            }
+        }
+        if get_option("nxapi", True):
+            nxapi_dict[entry["hostname"]] = NxapiSession(entry["ip"], username, password, entry.get("nxapi_port", get_option(
+                "nxapi_port", 443)), get_option("nxapi_https", True), get_option("nxapi_verify", False), get_option("command_timeout", 120) or 120)
+
+    dir_output = cfg.dir_output
+    if len(dir_output) > 1 and dir_output[-1] == "/":
+        dir_output = dir_output[:-1]
+    lost_safe_tuple = (cfg.lost_mac_safe, cfg.lost_arp_safe,
+                       cfg.lost_routes_safe)
+
+    return (testbed_dict, nxapi_dict, lost_safe_tuple, dir_output)
+
+
+def check_snapshot_dir(directory) -> bool:
+    """Print which snapshot members of directory are present and readable."""
+
+    is_valid = True
+    print("Snapshot directory {}:".format(directory))
+    for class_element in class_list + [AllDetail]:
+        snapshot_file = "{}/{}".format(directory, class_element.snapshot_file)
+        if not os.path.isfile(snapshot_file):
+            print("   {}: missing".format(class_element.snapshot_file))
+            continue
+        try:
+            with open(snapshot_file, 'r') as f:
+                json.load(f)
+            print("   {}: ok".format(class_element.snapshot_file))
+        except (OSError, ValueError):
+            print("   {}: cannot be read as JSON".format(
+                class_element.snapshot_file))
+            is_valid = False
+    return is_valid
+
+
+def check_config() -> int:
+    """Validate databaseconfig.py and the snapshot directories without connecting or importing genie.
+
+    Returns the exit status: 0 if everything needed to start is valid, 1 otherwise.
+    """
+
+    errors = []
+    try:
+        import databaseconfig as cfg
+    except Exception as e:
+        print("Cannot import databaseconfig.py: {}".format(e))
+        return 1
+    print("Imported databaseconfig.py file successfully.")
+
+    input_dict = getattr(cfg, "input_dict", None)
+    if not isinstance(input_dict, dict):
+        errors.append("input_dict is missing or is not a dictionary.")
+    else:
+        for key in ["hostname", "ip", "username", "password"]:
+            if not isinstance(input_dict.get(key, None), str) or len(input_dict[key]) == 0:
+                errors.append(
+                    "input_dict[\"{}\"] is missing or empty.".format(key))
+        if isinstance(input_dict.get("ip", None), str) and not re.search(ipv4_regex, input_dict["ip"]):
+            errors.append(
+                "input_dict[\"ip\"] {} is not a valid IPv4 address.".format(input_dict["ip"]))
+
+    for name in ["lost_mac_safe", "lost_arp_safe", "lost_routes_safe"]:
+        value = getattr(cfg, name, None)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append("{} is missing or is not a number.".format(name))
+
+    fleet = getattr(cfg, "fleet", None)
+    if fleet is not None:
+        if not isinstance(fleet, list) or len(fleet) == 0:
+            errors.append("fleet must be a non-empty list of devices.")
+        else:
+            for entry in fleet:
+                if not isinstance(entry, dict) or not isinstance(entry.get("hostname", None), str) or not isinstance(entry.get("ip", None), str):
+                    errors.append(
+                        "fleet entry {} must have a hostname and an ip.".format(entry))
+                elif not re.search(ipv4_regex, entry["ip"]):
+                    errors.append("fleet entry {} ip {} is not a valid IPv4 address.".format(
+                        entry["hostname"], entry["ip"]))
+
+    max_sessions = getattr(cfg, "max_sessions", 10)
+    if isinstance(max_sessions, bool) or not isinstance(max_sessions, int) or max_sessions < 1:
+        errors.append("max_sessions must be a positive integer.")
+
+    dir_output = getattr(cfg, "dir_output", None)
+    if not isinstance(dir_output, str) or not os.path.isdir(dir_output):
+        errors.append("dir_output {} directory does not exist.".format(dir_output))
+    elif not os.access(dir_output, os.W_OK):
+        errors.append("dir_output {} directory is not writable.".format(dir_output))
+    elif isinstance(input_dict, dict) and isinstance(input_dict.get("hostname", None), str):
+        prefix = "{}_original_snapshot_".format(input_dict["hostname"])
+        for name in sorted(os.listdir(dir_output)):
+            if name.startswith(prefix) and os.path.isdir("{}/{}".format(dir_output, name)):
+                check_snapshot_dir("{}/{}".format(dir_output, name))
+
+    dir_original_snapshot = getattr(cfg, "dir_original_snapshot", None)
+    if dir_original_snapshot is not None:
+        if not os.path.isdir(dir_original_snapshot):
+            errors.append("dir_original_snapshot {} directory does not exist.".format(
+                dir_original_snapshot))
+        elif not check_snapshot_dir(dir_original_snapshot):
+            errors.append("dir_original_snapshot {} has unreadable snapshot files.".format(
+                dir_original_snapshot))
+
+    if len(errors) > 0:
+        print("\nThe configuration has {} error(s):".format(len(errors)))
+        for error in errors:
+            print("   {}".format(error))
+        return 1
+
+    print("\nThe configuration is valid.")
+    return 0
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Monitor the operational state of a Nexus device against its original snapshot.")
+    parser.add_argument("--check", action="store_true",
+                        help="validate databaseconfig.py and the snapshot directories, then exit")
+    parser.add_argument("--config", metavar="PATH",
+                        help="use PATH instead of databaseconfig.py")
+    parser.add_argument("--daemon", action="store_true",
+                        help="run without prompts and take commands on the control socket")
+    parser.add_argument("--control", nargs="+", metavar="COMMAND",
+                        help="send a command (status, baseline, detail on|off, threshold NAME VALUE, cycle, rebaseline, promote, exit) to a running monitor, then exit")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="path of the control socket")
+    parser.add_argument("--fleet", action="store_true",
+                        help="monitor every device of the fleet option in databaseconfig.py from one process")
+    return parser.parse_args(argv)
+
+
+def load_config(config_file):
+    """Load config_file as the databaseconfig module, so every setting is read from it."""
+
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        "databaseconfig", config_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules["databaseconfig"] = module
+
+
+def get_control_socket():
+    socket_path = get_option("control_socket", None)
+    if socket_path is None:
+        socket_path = "{}/{}.sock".format(get_option("dir_output", "."), get_option(
+            "input_dict", {}).get("hostname", "nxos-genie-monitor"))
+    return socket_path
+
+
+def send_control(socket_path, command_list) -> int:
+    """Send one command to the control socket of a running monitor and print its answer."""
+
+    import socket
+    request = {"command": command_list[0]}
+    if command_list[0] == "threshold" and len(command_list) == 3:
+        request["name"] = command_list[1]
+        request["value"] = command_list[2]
+    elif len(command_list) == 2:
+        request["value"] = command_list[1]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            client.sendall((json.dumps(request) + "\n").encode())
+            response = client.makefile("r").readline()
+    except OSError as e:
+        print("Cannot reach the control socket {}: {}".format(socket_path, e))
+        return 1
+    print(json.dumps(json_loads(response), indent=4))
+    return 0 if json_loads(response).get("ok") else 1
+
+
+class ControlServer:
+    """Take commands for a running monitor on a Unix socket, one JSON object per line.
+
+    A request looks like {"command": "detail", "value": "on"} and is answered
+    with one JSON line. The commands only change the device's settings and
+    flags, so the polling loop keeps running and applies them in its next cycle;
+    "cycle" starts that cycle right away.
+    """
+
+    threshold_list = ["lost_mac_safe", "lost_arp_safe", "lost_routes_safe"]
+
+    def __init__(self, device, socket_path) -> None:
+        self.device = device
+        self.socket_path = socket_path
+        self.instance_monitor_dict = {}
+        self.server = None
+
+    def start(self):
+        import socketserver
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            print("The control socket is not supported on this platform.")
+            return None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        control_server = self
+
+        class ControlHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = control_server.handle(json_loads(line))
+                    except Exception as e:
+                        response = {"ok": False, "error": str(e)}
+                    self.wfile.write((json.dumps(response) + "\n").encode())
+
+        self.server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, ControlHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print("The program takes commands on {}.".format(self.socket_path))
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle(self, request) -> dict:
+        command = request.get("command")
+        value = request.get("value")
+        if command == "status":
+            return {"ok": True, "hostname": self.device.hostname,
+                    "connected": self.device.device_genie.is_connected(),
+                    "detail": self.device.is_detail,
+                    "cycle_count": self.device.cycle_count,
+                    "last_cycle": self.device.last_cycle,
+                    "snapshot": self.device.dir_original_snapshot_create if self.device.dir_original_snapshot_import == "default" else self.device.dir_original_snapshot_import,
+                    "baseline_version": self.device.baseline_version,
+                    "thresholds": {name: getattr(self.device, name) for name in self.threshold_list},
+                    "unsupported": self.device.unsupport_list,
+                    "feature_disabled": self.device.feature_disabled_list,
+                    "breakers": {key: str(breaker) for key, breaker in self.device.breaker_dict.items()}}
+        elif command == "detail":
+            if str(value).lower() not in ("on", "off", "true", "false"):
+                return {"ok": False, "error": "detail takes on or off"}
+            self.device.is_detail = str(value).lower() in ("on", "true")
+            return {"ok": True, "detail": self.device.is_detail}
+        elif command == "threshold":
+            name = request.get("name")
+            if name not in self.threshold_list:
+                return {"ok": False, "error": "threshold takes one of {}".format(", ".join(self.threshold_list))}
+            setattr(self.device, name, float(value))
+            return {"ok": True, name: getattr(self.device, name)}
+        elif command == "baseline":
+            return {"ok": True, "diff": {key: instance.diff() for key, instance in self.instance_monitor_dict.items()
+                                         if key not in self.device.unsupport_list and instance.is_changed()},
+                    "baselines": self.device.baseline_diff_dict}
+        elif command == "cycle":
+            self.device.cycle_event.set()
+            return {"ok": True}
+        elif command == "rebaseline":
+            self.device.rebaseline_requested = True
+            self.device.cycle_event.set()
+            return {"ok": True}
+        elif command == "promote":
+            self.device.promote_requested = True
+            self.device.cycle_event.set()
+            return {"ok": True}
+        elif command == "exit":
+            self.device.exit_requested = True
+            self.device.cycle_event.set()
+            return {"ok": True}
+        return {"ok": False, "error": "unknown command {}".format(command)}
+
+
+class ChangeReporter:
+    """Report only what changed since the last report, with a heartbeat in between.
+
+    Every entry of a cycle's report has a fingerprint. An entry is written when it
+    is new or its fingerprint changed, and a line is written when an entry
+    disappears. A cycle with nothing new writes nothing, except a heartbeat line
+    every heartbeat_interval seconds.
+    """
+
+    def __init__(self, heartbeat_interval=300) -> None:
+        self.heartbeat_interval = heartbeat_interval
+        self.fingerprint_dict = {}
+        self.last_report = monotonic()
+
+    def report(self, hostname, entry_dict) -> str:
+        string = ""
+        for key, (fingerprint, text) in entry_dict.items():
+            if self.fingerprint_dict.get(key, None) != hash(fingerprint):
+                string = string + text
+        for key in self.fingerprint_dict:
+            if key not in entry_dict:
+                string = string + "{} is cleared.\n".format(key)
+        self.fingerprint_dict = {key: hash(fingerprint)
+                                 for key, (fingerprint, text) in entry_dict.items()}
+
+        header = "\n{} {} {}\n".format(
+            "-"*40, datetime.now().strftime("%Y-%b-%d %X"), "-"*40)
+        if len(string) > 0:
+            self.last_report = monotonic()
+            return header + string + "\n{}".format("-"*102)
+        if self.heartbeat_interval is not None and monotonic() - self.last_report >= self.heartbeat_interval:
+            self.last_report = monotonic()
+            if len(entry_dict) > 0:
+                return "{} {} is still monitored, {} open item(s) unchanged.".format(datetime.now().strftime("%Y-%b-%d %X"), hostname, len(entry_dict))
+            return "{} {} is still monitored and does not change.".format(datetime.now().strftime("%Y-%b-%d %X"), hostname)
+        return ""
+
+
+class JsonLinesSink:
+    """Write one JSON record per monitor each time its difference changes, to a JSON-lines file.
+
+    The file is rotated when it reaches max_bytes or is max_age seconds old, and
+    the rotated file is compressed in the background with gzip, or with zstd if
+    compression is "zstd" and the zstandard module is installed.
+    """
+
+    def __init__(self, file_name, max_bytes=64 * 1024 * 1024, max_age=86400, compression="gzip") -> None:
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = compression
+        self.opened = monotonic()
+        self.record_dict = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def write(self, hostname, instance_monitor_dict, changed_list):
+        """Write a record for every monitor in changed_list whose difference is not the one last written."""
+
+        line_list = []
+        now = datetime.now().isoformat(timespec="seconds")
+        for instance_name, instance in instance_monitor_dict.items():
+            if instance_name in changed_list and callable(getattr(instance, "diff_record", None)):
+                record = instance.diff_record()
+            elif instance_name in self.record_dict:
+                # The monitor no longer differs from the original state.
+                record = {"counts": {}, "percentages": {},
+                          "items": {}, "cleared": True}
+            else:
+                continue
+            fingerprint = json.dumps(record, sort_keys=True, default=str)
+            if self.record_dict.get(instance_name, None) == fingerprint:
+                continue
+            if record.get("cleared", False):
+                del self.record_dict[instance_name]
+            else:
+                self.record_dict[instance_name] = fingerprint
+            line_list.append(json.dumps(dict({"time": now, "device": hostname, "monitor": instance_name}, **record),
+                                        default=str))
+
+        if len(line_list) == 0:
+            return None
+        if os.path.isfile(self.file_name) and (os.path.getsize(self.file_name) >= self.max_bytes or monotonic() - self.opened >= self.max_age):
+            self.rotate()
+        elif not os.path.isfile(self.file_name):
+            self.opened = monotonic()
+        with open(self.file_name, "a") as f:
+            f.write("\n".join(line_list) + "\n")
+
+    def rotate(self):
+        rotated_file = "{}.{}".format(
+            self.file_name, datetime.now().strftime("%Y%m%d-%H%M%S"))
+        os.replace(self.file_name, rotated_file)
+        self.opened = monotonic()
+        self.executor.submit(self.compress, rotated_file, self.compression)
+
+    @staticmethod
+    def compress(file_name, compression):
+        if compression == "zstd":
+            try:
+                import zstandard
+                with open(file_name, "rb") as f_in, open("{}.zst".format(file_name), "wb") as f_out:
+                    zstandard.ZstdCompressor().copy_stream(f_in, f_out)
+                os.remove(file_name)
+                return None
+            except ImportError:
+                compression = "gzip"
+        if compression == "gzip":
+            import gzip
+            import shutil
+            with open(file_name, "rb") as f_in, gzip.open("{}.gz".format(file_name), "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(file_name)
+
+
+class AlertDestination:
+    """Send grouped alerts to one webhook or SMTP destination from its own thread.
+
+    At most rate_limit messages are sent per minute; alerts arriving while the
+    destination waits are merged into its next message. A failed send is retried
+    retries times with exponential backoff.
+    """
+
+    def __init__(self, destination_dict, rate_limit=6, retries=3, backoff=5) -> None:
+        self.destination_dict = destination_dict
+        self.name = destination_dict.get("url", destination_dict.get("host", "alert"))
+        self.rate_limit = destination_dict.get("rate_limit", rate_limit)
+        self.retries = destination_dict.get("retries", retries)
+        self.backoff = backoff
+        self.condition = threading.Condition()
+        self.pending_list = []
+        self.sent_time_list = deque()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def put(self, alert_list):
+        with self.condition:
+            self.pending_list.extend(alert_list)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.pending_list) == 0:
+                    self.condition.wait()
+            while len(self.sent_time_list) > 0 and monotonic() - self.sent_time_list[0] >= 60:
+                self.sent_time_list.popleft()
+            if len(self.sent_time_list) >= self.rate_limit:
+                sleep(60 - (monotonic() - self.sent_time_list[0]))
+                continue
+            with self.condition:
+                alert_list = self.pending_list
+                self.pending_list = []
+            self.sent_time_list.append(monotonic())
+            for attempt in range(self.retries + 1):
+                try:
+                    self.send(alert_list)
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        print("Cannot send {} alert(s) to {}: {}".format(
+                            len(alert_list), self.name, e))
+                    else:
+                        sleep(self.backoff * 2 ** attempt)
+
+    def send(self, alert_list):
+        device_list = sorted(set(alert["device"] for alert in alert_list))
+        subject = "nxos-genie-monitor: {} change(s) on {}".format(
+            len(alert_list), ", ".join(device_list))
+        if self.destination_dict.get("type", "webhook") == "smtp":
+            import smtplib
+            from email.message import EmailMessage
+            message = EmailMessage()
+            message["Subject"] = subject
+            message["From"] = self.destination_dict["from"]
+            message["To"] = ", ".join(self.destination_dict["to"])
+            message.set_content("\n".join("{} {} {}\n{}".format(alert["time"], alert["device"], alert["monitor"], alert["text"])
+                                          for alert in alert_list))
+            with smtplib.SMTP(self.destination_dict["host"], self.destination_dict.get("port", 25), timeout=30) as smtp:
+                if self.destination_dict.get("starttls", False):
+                    smtp.starttls()
+                if "username" in self.destination_dict:
+                    smtp.login(
+                        self.destination_dict["username"], self.destination_dict["password"])
+                smtp.send_message(message)
+        else:
+            import urllib.request
+            request = urllib.request.Request(self.destination_dict["url"], data=json.dumps({"subject": subject, "alerts": alert_list}, default=str).encode(),
+                                             headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+
+
+class AlertDispatcher:
+    """Queue alerts about changed monitors and hand them in groups to the destinations.
+
+    submit only compares fingerprints and queues, so polling never waits for a
+    destination. The alerts queued within window seconds of the first one, from
+    any monitor or device, go out as one message per destination.
+    """
+
+    def __init__(self, destination_list, window=30, rate_limit=6, retries=3) -> None:
+        self.window = window
+        self.queue = queue.Queue()
+        self.fingerprint_dict = {}
+        self.destination_list = [AlertDestination(destination_dict, rate_limit, retries)
+                                 for destination_dict in destination_list]
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, hostname, diff_dict, record_dict=None):
+        """Queue an alert for every monitor whose diff in diff_dict changed, and for every monitor that cleared."""
+
+        now = datetime.now().isoformat(timespec="seconds")
+        record_dict = record_dict or {}
+        for instance_name, text in diff_dict.items():
+            if self.fingerprint_dict.get((hostname, instance_name), None) != hash(text):
+                self.fingerprint_dict[(hostname, instance_name)] = hash(text)
+                self.queue.put({"time": now, "device": hostname, "monitor": instance_name, "cleared": False,
+                                "text": text, "record": record_dict.get(instance_name, {})})
+        for key in [key for key in self.fingerprint_dict if key[0] == hostname and key[1] not in diff_dict]:
+            del self.fingerprint_dict[key]
+            self.queue.put({"time": now, "device": hostname, "monitor": key[1], "cleared": True,
+                            "text": "{} does not differ from the original state anymore.\n".format(key[1]), "record": {}})
+
+    def run(self):
+        while True:
+            alert_list = [self.queue.get()]
+            deadline = monotonic() + self.window
+            while True:
+                try:
+                    alert_list.append(self.queue.get(
+                        timeout=max(deadline - monotonic(), 0)))
+                except queue.Empty:
+                    break
+            for destination in self.destination_list:
+                destination.put(alert_list)
+
+
+class StateServer:
+    """Serve the state the monitors computed in the last cycle as JSON over HTTP.
 
-    executor_dict = dict()
-    with concurrent.futures.ThreadPoolExecutor() as executor:
+    GET /monitors lists the monitors with whether they changed and when they
+    last ran; GET /monitors/<name> adds their original and current state and
+    their diff. The JSON is built once per cycle in publish, so any number of
+    clients read it without running a command on the device.
+    """
+
+    def __init__(self, device, address="127.0.0.1", port=8080) -> None:
+        self.device = device
+        self.address = address
+        self.port = port
+        self.server = None
+        self.lock = threading.Lock()
+        self.updated_dict = {}
+        self.published_dict = {"/monitors": json.dumps(
+            {"hostname": device.hostname, "monitors": {}}).encode()}
+
+    def publish(self, instance_monitor_dict, skipped_list):
+        """Publish the state of the monitors; the ones in skipped_list keep their last run time."""
+
+        now = datetime.now().isoformat(timespec="seconds")
+        summary_dict = {}
+        published_dict = {}
         for instance_name, instance in instance_monitor_dict.items():
-            if hasattr(instance, method_name):
-                if (callable(getattr(instance, method_name))):
-                    method = getattr(instance, method_name)
-                    executor_dict[instance_name +
-                                  "executor"] = executor.submit(method)
+            if instance_name in self.device.unsupport_list:
+                continue
+            if instance_name not in skipped_list:
+                self.updated_dict[instance_name] = now
+            is_changed = instance.is_changed()
+            monitor_dict = {"name": instance_name,
+                            "changed": is_changed,
+                            "updated": self.updated_dict.get(instance_name, None)}
+            summary_dict[instance_name] = dict(monitor_dict)
+            monitor_dict["diff"] = instance.diff() if is_changed else ""
+            monitor_dict["state"] = {key: value for key, value in vars(instance).items()
+                                     if key != "device" and not key.startswith("_")}
+            published_dict["/monitors/{}".format(instance_name)] = json.dumps(
+                monitor_dict, default=str).encode()
+        published_dict["/monitors"] = json.dumps({"hostname": self.device.hostname,
+                                                  "cycle_count": self.device.cycle_count,
+                                                  "last_cycle": self.device.last_cycle,
+                                                  "monitors": summary_dict}).encode()
+        with self.lock:
+            self.published_dict = published_dict
+
+    def start(self):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        state_server = self
+
+        class StateHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.rstrip("/") or "/monitors"
+                with state_server.lock:
+                    body = state_server.published_dict.get(path, None)
+                if body is None:
+                    self.send_error(404)
+                    return None
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(
+            (self.address, self.port), StateHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print("The program serves the monitor state on http://{}:{}/monitors.".format(
+            self.address, self.port))
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class ConnectionManager:
+    """Keep the connection to a device alive and reconnect it quickly.
+
+    A keepalive thread runs a short command on the session when it has been idle
+    for keepalive_interval seconds, so a dead session is found before a cycle
+    uses it. Reconnecting retries with a jittered exponential backoff starting
+    at backoff seconds up to max_backoff, and alternates between the vty
+    connection and the alternate transport of the device if there is one.
+    """
+
+    def __init__(self, device, keepalive_interval=30, backoff=1, max_backoff=60) -> None:
+        self.device = device
+        self.keepalive_interval = keepalive_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.via = device.connection_list[0]
+        self.dead = threading.Event()
+        self.keepalive_thread = None
+
+    def start_keepalive(self):
+        if self.keepalive_interval is None or self.keepalive_interval <= 0:
+            return None
+        self.keepalive_thread = threading.Thread(
+            target=self.keepalive, daemon=True)
+        self.keepalive_thread.start()
+
+    def keepalive(self):
+        while True:
+            sleep(self.keepalive_interval / 3)
+            if self.dead.is_set() or monotonic() - self.device.last_command < self.keepalive_interval:
+                continue
+            # A busy session is alive; only probe it when no monitor is using it.
+            if not self.device.session_lock.acquire(blocking=False):
+                continue
+            try:
+                self.device.last_command = monotonic()
+                if not self.device.device_genie.is_connected():
+                    self.dead.set()
+                else:
+                    type(self.device.device_genie).__getattr__(self.device.device_genie, "execute")(
+                        "show clock", timeout=min(self.keepalive_interval, 30))
+            except:
+                self.dead.set()
+            finally:
+                self.device.session_lock.release()
+
+    def ensure(self):
+        """Reconnect before a cycle if the session is not connected or the keepalive found it dead."""
+
+        if self.dead.is_set() or not self.device.device_genie.is_connected():
+            self.reconnect()
+
+    def reconnect(self):
+        attempt = 0
+        while True:
+            # Exception, not a bare except, so Ctrl-C and the SystemExit of SIGTERM stop the retries.
+            try:
+                try:
+                    self.device.device_genie.disconnect()
+                except Exception:
+                    pass
+                self.device.make_connection(self.via)
+                self.dead.clear()
+                print("{} is connected via {}.".format(
+                    self.device.device_genie.name, self.via))
+                return None
+            except Exception:
+                delay = min(self.backoff * 2 ** attempt,
+                            self.max_backoff) * random.uniform(0.5, 1)
+                attempt = attempt + 1
+                self.via = self.device.connection_list[attempt % len(
+                    self.device.connection_list)]
+                print("Cannot connect to {}. The program will try again via {} in {:.1f} seconds.".format(
+                    self.device.device_genie.name, self.via, delay))
+                sleep(delay)
+
+
+class CircuitBreaker:
+    """Stop running a monitor that keeps failing, and try it again later.
+
+    After threshold consecutive failures the breaker opens and the monitor is
+    skipped for backoff seconds, doubled each time it opens again up to
+    max_backoff. Then one run is let through half-open: a success closes the
+    breaker, a failure opens it again.
+    """
+
+    def __init__(self, threshold=3, backoff=60, max_backoff=3600) -> None:
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self.open_until = 0
+
+    def allow(self) -> bool:
+        if self.state == "open" and monotonic() >= self.open_until:
+            self.state = "half-open"
+        return self.state != "open"
+
+    def record(self, success):
+        if success:
+            self.state = "closed"
+            self.failures = 0
+            self.opened = 0
+            return None
+        self.failures = self.failures + 1
+        if self.state == "half-open" or self.failures >= self.threshold:
+            self.state = "open"
+            self.open_until = monotonic() + min(self.backoff * 2 ** self.opened, self.max_backoff)
+            self.opened = self.opened + 1
+
+    def __str__(self) -> str:
+        if self.state == "open":
+            return "open after {} failures, next try in {:.0f} seconds".format(
+                self.failures, max(self.open_until - monotonic(), 0))
+        return "{} after {} failures".format(self.state, self.failures)
+
+
+class NxapiSession:
+    """Run show commands through the NX-API JSON-RPC interface of a device on an asyncio event loop.
+
+    The commands of a batch go in one HTTP request written with asyncio
+    streams, so one event loop waits on many devices without a thread or an
+    SSH session each. A "| json" command returns its structured body as JSON
+    text and the others their text output, as on the CLI. Requires
+    "feature nxapi" on the device.
+    """
+
+    def __init__(self, host, username, password, port=443, use_ssl=True, verify=False, timeout=60) -> None:
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.verify = verify
+        self.timeout = timeout
+        # Cleared while NX-API cannot be reached, so the failure is reported once.
+        self.reachable = True
+        self.authorization = base64.b64encode(
+            "{}:{}".format(username, password).encode()).decode()
+
+    @staticmethod
+    def request_body(cmd_list) -> bytes:
+        request_list = []
+        for i, cmd in enumerate(cmd_list):
+            if cmd.endswith(" | json"):
+                request_list.append({"jsonrpc": "2.0", "method": "cli", "params": {
+                                    "cmd": cmd[:-len(" | json")], "version": 1}, "id": i + 1})
+            else:
+                request_list.append({"jsonrpc": "2.0", "method": "cli_ascii", "params": {
+                                    "cmd": cmd, "version": 1}, "id": i + 1})
+        return json.dumps(request_list).encode()
+
+    @staticmethod
+    def parse_response(cmd_list, data) -> dict:
+        """Return {command: output} for the commands of cmd_list that NX-API answered; a rejected command is left out."""
+
+        response_list = json_loads(data)
+        if isinstance(response_list, dict):
+            response_list = [response_list]
+        output_dict = {}
+        for response in response_list:
+            index = int(response.get("id", 0)) - 1
+            if not 0 <= index < len(cmd_list) or "result" not in response:
+                continue
+            # A command without output has a null result.
+            result = response["result"] or {}
+            if cmd_list[index].endswith(" | json"):
+                output_dict[cmd_list[index]] = json.dumps(
+                    result.get("body", {}))
+            else:
+                output_dict[cmd_list[index]] = result.get("msg", "")
+        return output_dict
+
+    async def post(self, body) -> bytes:
+        ssl_context = None
+        if self.use_ssl:
+            ssl_context = ssl.create_default_context()
+            if not self.verify:
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=ssl_context)
+        try:
+            writer.write("POST /ins HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json-rpc\r\nContent-Length: {}\r\nAuthorization: Basic {}\r\nConnection: close\r\n\r\n".format(
+                self.host, len(body), self.authorization).encode() + body)
+            await writer.drain()
+            status_line = (await reader.readline()).decode("latin-1").split()
+            if len(status_line) < 2 or not status_line[1].isdigit():
+                raise ValueError("NX-API sent no HTTP status line")
+            header_dict = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1")
+                if line.strip() == "":
+                    break
+                name, sep, value = line.partition(":")
+                header_dict[name.strip().lower()] = value.strip()
+            if header_dict.get("transfer-encoding", "").lower() == "chunked":
+                data = b""
+                while True:
+                    size = int((await reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        break
+                    data = data + await reader.readexactly(size)
+                    await reader.readline()
+            elif "content-length" in header_dict:
+                data = await reader.readexactly(int(header_dict["content-length"]))
+            else:
+                data = await reader.read()
+        finally:
+            writer.close()
+        # NX-API answers a batch with a rejected command with 500 and the errors in the body.
+        if status_line[1] not in ("200", "500"):
+            raise OSError("NX-API answered HTTP {}".format(status_line[1]))
+        return data
+
+    async def run(self, cmd_list) -> dict:
+        data = await asyncio.wait_for(self.post(self.request_body(cmd_list)), self.timeout)
+        return self.parse_response(cmd_list, data)
+
+
+class AsyncCollector:
+    """Run the monitor methods of a cycle on one asyncio event loop.
+
+    Unicon sessions are blocking, so a monitor that does not provide a coroutine
+    version of the method (e.g. async_current for current) is adapted through a
+    thread pool of max_sessions threads. Monitors of the same device share its
+    session_pool_size sessions. run() takes (device, monitors) pairs: collect()
+    passes the one device of a run and collect_fleet() every device of the fleet
+    option. The time each monitor took is kept in elapsed_dict.
+
+    Before its monitors, each device's declared commands are prefetched in
+    batches, within the same deadline. A device with an NX-API session fetches
+    them on the event loop itself, so the threads are only taken by the parsing
+    and by the commands it could not answer. With deadlines, a monitor running longer
+    than monitor_timeout seconds, or still running or waiting for the prefetch
+    when the whole run reaches cycle_timeout seconds, is given up on and listed
+    in stale_list, so the rest of the cycle reports on time. A monitor or a
+    prefetch whose blocking call is still stuck on the device is not started
+    again until that call returns.
+    """
+
+    def __init__(self, max_sessions=10, monitor_timeout=None, cycle_timeout=None) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_sessions)
+        self.monitor_timeout = monitor_timeout
+        self.cycle_timeout = cycle_timeout
+        self.inflight = set()
+        self.pending_dict = {}
+        self.prefetch_dict = {}
+        self.elapsed_dict = {}
+        self.stale_list = []
+        self.failed_list = []
+
+    async def run_instance(self, device, instance_name, instance, method_name, lock, deadline):
+        key = (device.hostname, instance_name)
+        if key in self.pending_dict and not self.pending_dict[key].done():
+            self.stale_list.append(key)
+            return None
+        monitor_timeout = self.monitor_timeout if deadline else None
+        if getattr(instance, "isolated", False):
+            # A plugin only waits for its own worker, whose commands take a session themselves.
+            lock = asyncio.Semaphore(1)
+        try:
+            async with lock:
+                start = monotonic()
+                async_method = getattr(
+                    instance, "async_{}".format(method_name), None)
+                if async_method is not None and asyncio.iscoroutinefunction(async_method):
+                    await asyncio.wait_for(async_method(), monitor_timeout)
+                else:
+                    future = self.executor.submit(
+                        getattr(instance, method_name))
+                    self.inflight.add(future)
+                    future.add_done_callback(self.inflight.discard)
+                    self.pending_dict[key] = future
+                    await asyncio.wait_for(asyncio.wrap_future(future, loop=self.loop), monitor_timeout)
+                self.elapsed_dict[key] = monotonic() - start
+        except asyncio.TimeoutError:
+            self.stale_list.append(key)
+        except asyncio.CancelledError:
+            # The cycle watchdog gave up on the monitors that have not finished.
+            self.stale_list.append(key)
+            raise
+        except ConnectionError:
+            raise
+        except Exception:
+            self.failed_list.append(key)
+            raise
+
+    async def prefetch(self, device, instance_monitor_dict):
+        try:
+            if getattr(device, "nxapi", None) is not None:
+                await device.async_prefetch(instance_monitor_dict)
+                return None
+            future = self.prefetch_dict.get(device.hostname, None)
+            if future is not None and not future.done():
+                return None
+            future = self.executor.submit(
+                device.prefetch, instance_monitor_dict)
+            self.inflight.add(future)
+            future.add_done_callback(self.inflight.discard)
+            self.prefetch_dict[device.hostname] = future
+            await asyncio.wrap_future(future, loop=self.loop)
+        except asyncio.CancelledError:
+            # The deadline passed before the monitors could start.
+            self.stale_list.extend((device.hostname, instance_name) for instance_name in instance_monitor_dict
+                                   if instance_name not in device.unsupport_list)
+            raise
+
+    async def run_device(self, device, instance_monitor_dict, method_name, deadline):
+        if callable(getattr(device, "prefetch", None)):
+            await self.prefetch(device, instance_monitor_dict)
+        # With a pool of sessions, that many monitors of the device run at the same time.
+        lock = asyncio.Semaphore(getattr(device, "session_pool_size", 1))
+        coroutine_list = []
+        for instance_name, instance in instance_monitor_dict.items():
+            if instance_name in device.unsupport_list:
+                continue
+            if callable(getattr(instance, method_name, None)):
+                coroutine_list.append(
+                    self.run_instance(device, instance_name, instance, method_name, lock, deadline))
+        await asyncio.gather(*coroutine_list)
+
+    def run(self, device_instance_list, method_name, deadline=True, timeout=None) -> list:
+        """Run method_name on every monitor of every (device, instance_monitor_dict) pair.
+
+        timeout, when given, replaces cycle_timeout, e.g. with what is left of a
+        cycle that runs in several phases. Returns one entry per device: None on
+        success or the exception raised by that device's monitors, so one
+        unreachable device does not stop the others.
+        """
+
+        self.stale_list = []
+        self.failed_list = []
+        task_list = [self.loop.create_task(self.run_device(device, instance_monitor_dict, method_name, deadline))
+                     for device, instance_monitor_dict in device_instance_list]
+        cycle_timeout = self.cycle_timeout if deadline else None
+        if timeout is not None:
+            cycle_timeout = max(timeout, 0)
+        try:
+            return self.loop.run_until_complete(asyncio.wait_for(asyncio.gather(*task_list, return_exceptions=True), cycle_timeout))
+        except asyncio.TimeoutError:
+            return [None for task in task_list]
+        except BaseException as e:
+            # Ctrl-C: drop the queued monitors and let the ones already on a session finish.
+            # SIGTERM (SystemExit) does not wait for them, so the service stops within its stop timeout.
+            for task in task_list:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(
+                *task_list, return_exceptions=True))
+            if not isinstance(e, SystemExit):
+                concurrent.futures.wait(
+                    list(self.inflight), timeout=self.monitor_timeout)
+            raise
+
+
+def collect(collector, device, instance_monitor_dict, method_name, deadline=True):
+    """Run method_name on the monitors of device, FeatureMonitor first.
+
+    The monitors whose features are disabled on the device are skipped. A monitor
+    skipped for the original state learns it in the first cycle its feature is
+    enabled, and is compared from the next cycle. In the cycles, a monitor whose
+    circuit breaker is open is skipped too and keeps its last result. With a
+    deadline, all the phases of the cycle share one cycle_timeout.
+    """
+
+    exception_dict = collect_fleet(
+        collector, [(device, instance_monitor_dict)], method_name, deadline)
+    for exception in exception_dict.values():
+        raise exception
+
+
+def collect_fleet(collector, device_instance_list, method_name, deadline=True) -> dict:
+    """Run method_name on the monitors of every (device, instance_monitor_dict) pair in the phases of collect().
+
+    Each phase runs the monitors of all the devices together on the collector's
+    event loop. Returns {hostname: exception} for the devices whose monitors
+    raised; those devices skip the remaining phases of this call, and the other
+    devices are not held up by them.
+    """
+
+    stale_list = []
+    exception_dict = {}
+    cycle_end = None
+    if deadline and collector.cycle_timeout is not None:
+        cycle_end = monotonic() + collector.cycle_timeout
+
+    def run_monitors(phase_list, method_name, deadline):
+        if method_name == "current":
+            phase_list = [(device, {key: value for key, value in monitor_dict.items() if device.get_breaker(key).allow()})
+                          for device, monitor_dict in phase_list]
+            # The monitors' exception handlers set failed when a run of this cycle fails.
+            for device, monitor_dict in phase_list:
+                for value in monitor_dict.values():
+                    value.failed = False
+        if cycle_end is not None and monotonic() >= cycle_end:
+            # An earlier phase used up the cycle, so these monitors keep their last result.
+            collector.stale_list = [(device.hostname, key) for device, monitor_dict in phase_list
+                                    for key in monitor_dict if key not in device.unsupport_list]
+            collector.failed_list = []
+        else:
+            result_list = collector.run(phase_list, method_name, deadline,
+                                        None if cycle_end is None else cycle_end - monotonic())
+            for (device, monitor_dict), exception in zip(phase_list, result_list):
+                if exception is not None:
+                    exception_dict.setdefault(device.hostname, exception)
+        stale_list.extend(collector.stale_list)
+        if method_name == "current":
+            for device, monitor_dict in phase_list:
+                for key, value in monitor_dict.items():
+                    if key not in device.unsupport_list:
+                        # Only an exception or a timeout is a failure; an empty table is a valid sample.
+                        device.get_breaker(key).record(not value.failed and (device.hostname, key) not in collector.failed_list and
+                                                       (device.hostname, key) not in collector.stale_list)
+
+    feature_list = []
+    for device, instance_monitor_dict in device_instance_list:
+        device.new_cycle()
+        feature_list.append((device, {key: value for key, value in instance_monitor_dict.items()
+                                      if key == "FeatureMonitor_instance"}))
+    run_monitors(feature_list, method_name, deadline)
+
+    active_list = []
+    enabled_list = []
+    for device, instance_monitor_dict in device_instance_list:
+        if device.hostname in exception_dict:
+            continue
+        monitor_dict = {key: value for key, value in instance_monitor_dict.items()
+                        if key != "FeatureMonitor_instance"}
+        device.gate_features(monitor_dict)
+        active_dict = {key: value for key, value in monitor_dict.items()
+                       if key not in device.feature_disabled_list}
+        if method_name == "original":
+            device.deferred_list = [
+                key for key in monitor_dict if key not in active_dict]
+        else:
+            enabled_dict = {key: value for key, value in active_dict.items()
+                            if key in device.deferred_list}
+            if len(enabled_dict) > 0:
+                enabled_list.append((device, enabled_dict))
+                active_dict = {key: value for key, value in active_dict.items()
+                               if key not in enabled_dict}
+        active_list.append((device, active_dict))
+
+    if len(enabled_list) > 0:
+        run_monitors(enabled_list, "original", False)
+        for device, enabled_dict in enabled_list:
+            # A monitor that did not learn its original state before the deadline tries again next cycle.
+            device.deferred_list = [key for key in device.deferred_list
+                                    if key not in enabled_dict or (device.hostname, key) in collector.stale_list]
+            device.wait_snapshots()
+    run_monitors([(device, active_dict) for device, active_dict in active_list
+                  if device.hostname not in exception_dict], method_name, deadline)
+    collector.stale_list = stale_list
+    return exception_dict
+
+
+class DeviceView:
+    """The device as seen by the monitors of a baseline.
+
+    It has its own dir_original_snapshot_import and unsupport_list and reads
+    everything else from the device, so a threshold changed on the running
+    device, e.g. through the control socket, also applies to the baselines.
+    """
+
+    def __init__(self, device, dir_original_snapshot_import) -> None:
+        self.device = device
+        self.dir_original_snapshot_import = dir_original_snapshot_import
+        self.unsupport_list = []
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+
+def load_baselines(device, instance_monitor_dict, baseline_option) -> dict:
+    """Load the named baselines in baseline_option ({name: snapshot directory}) as views of the monitors.
+
+    A view is an empty copy of a monitor on a DeviceView importing that
+    baseline's snapshot directory, so it loads its original state without
+    running commands. Returns {name: {instance name: view}}. Identical
+    original states, in the baselines or in the run's own original, are kept in
+    memory once.
+    """
+
+    shared_dict = {}
+
+    def share(value):
+        return shared_dict.setdefault(json.dumps(value, sort_keys=True, default=str), value)
+
+    for key, instance in instance_monitor_dict.items():
+        state_name = getattr(instance, "state_name", None)
+        if state_name is not None and hasattr(instance, "{}_original".format(state_name)):
+            setattr(instance, "{}_original".format(state_name), share(
+                getattr(instance, "{}_original".format(state_name))))
+
+    baseline_dict = {}
+    for name, directory in baseline_option.items():
+        if not os.path.isdir(directory):
+            print("The baseline {} directory {} does not exist.".format(name, directory))
+            continue
+        device_view = DeviceView(device, directory)
+        view_dict = {}
+        for key, instance in instance_monitor_dict.items():
+            state_name = getattr(instance, "state_name", None)
+            if state_name is None or key in device.unsupport_list:
+                continue
+            view = copy.copy(instance)
+            vars(view).clear()
+            view.device = device_view
+            view.unsupport = False
+            view.original()
+            if key in device_view.unsupport_list or not hasattr(view, "{}_original".format(state_name)):
+                continue
+            setattr(view, "{}_original".format(state_name), share(
+                getattr(view, "{}_original".format(state_name))))
+            view_dict[key] = view
+        baseline_dict[name] = view_dict
+        print("Loaded the baseline {} from {} for {} monitors.".format(
+            name, directory, len(view_dict)))
+    return baseline_dict
+
+
+def compare_baselines(device, instance_monitor_dict, baseline_dict) -> dict:
+    """Compare the state collected by the monitors in this cycle with every named baseline.
+
+    Returns {name: {instance name: diff}} for the monitors that differ from each baseline.
+    """
+
+    baseline_diff_dict = {}
+    for name, view_dict in baseline_dict.items():
+        baseline_diff_dict[name] = {}
+        for key, view in view_dict.items():
+            instance = instance_monitor_dict[key]
+            current_name = "{}_current".format(instance.state_name)
+            if key in device.feature_disabled_list or instance.unsupport or not hasattr(instance, current_name):
+                continue
+            setattr(view, current_name, getattr(instance, current_name))
+            view.compare()
+            if view.is_changed():
+                baseline_diff_dict[name][key] = view.diff()
+    return baseline_diff_dict
+
+
+def promote_baseline(device, instance_monitor_dict, alldetail_instance, directory, stale_list=None) -> list:
+    """Make the state collected in the last cycle the original state and write it as the snapshot in directory.
+
+    No command is sent to the device. Monitors without a good current state keep
+    their original state, which is written to directory too so it holds a
+    complete snapshot: paused monitors, and the ones whose last run failed, missed
+    its deadline (in stale_list) or was skipped by their circuit breaker. The all
+    details are promoted only if they were collected in the last cycle. Returns
+    the names of the promoted monitors, with AllDetail when its state is promoted.
+    """
+
+    if stale_list is None:
+        stale_list = []
+
+    if device.dir_original_snapshot_import == "default":
+        previous_directory = device.dir_original_snapshot_create
+    else:
+        previous_directory = device.dir_original_snapshot_import
+    device.dir_original_snapshot_import = "default"
+    device.dir_original_snapshot_create = directory
+    device.baseline_version += 1
+
+    promoted_list = []
+    for key, instance in instance_monitor_dict.items():
+        state_name = getattr(instance, "state_name", None)
+        if state_name is None or key in device.unsupport_list:
+            continue
+        original_name = "{}_original".format(state_name)
+        current_name = "{}_current".format(state_name)
+        is_failed = getattr(instance, "unsupport", False) or (device.hostname, key) in stale_list or (
+            key in device.breaker_dict and device.breaker_dict[key].failures > 0)
+        if key not in device.feature_disabled_list and not is_failed and hasattr(instance, current_name):
+            setattr(instance, original_name, getattr(instance, current_name))
+            instance.compare()
+            promoted_list.append(key)
+        if not hasattr(instance, original_name):
+            continue
+        data = getattr(instance, original_name)
+        if getattr(instance, "snapshot_key", None) is not None:
+            data = {instance.snapshot_key: data}
+        device.write_snapshot(instance.snapshot_file, data)
+
+    # device.cycle_count is counted before the all details of a cycle are collected.
+    if hasattr(alldetail_instance, "all_detail_current") and getattr(alldetail_instance, "all_detail_cycle", None) == device.cycle_count:
+        alldetail_instance.all_detail_original = alldetail_instance.all_detail_current
+        promoted_list.append("AllDetail")
+    if hasattr(alldetail_instance, "all_detail_original"):
+        device.write_snapshot(alldetail_instance.snapshot_file,
+                              alldetail_instance.all_detail_original)
+
+    device.write_snapshot("snapshot_info.json", {"version": device.baseline_version,
+                                                 "created": datetime.now().isoformat(timespec="seconds"),
+                                                 "promoted_from": previous_directory,
+                                                 "cycle": device.cycle_count,
+                                                 "promoted": promoted_list})
+    device.wait_snapshots()
+    return promoted_list
+
+
+def prune_snapshots(dir_output, hostname, retention, keep_list):
+    """Remove all but the newest retention original snapshot directories of hostname in dir_output.
+
+    The directories in keep_list, such as the ones in use, are never removed.
+    """
+
+    prefix = "{}_original_snapshot_".format(hostname)
+    keep_set = set(os.path.realpath(directory) for directory in keep_list)
+    directory_list = sorted(name for name in os.listdir(dir_output)
+                            if name.startswith(prefix) and os.path.isdir("{}/{}".format(dir_output, name)))
+    for name in directory_list[:max(len(directory_list) - retention, 0)]:
+        directory = "{}/{}".format(dir_output, name)
+        if os.path.realpath(directory) in keep_set:
+            continue
+        try:
+            shutil.rmtree(directory)
+            print("Removed the old original snapshot {}.".format(directory))
+        except OSError as e:
+            print("Cannot remove the old original snapshot {}: {}".format(directory, e))
 
 
 def prepend_line(file_name, line):
@@ -1793,13 +4462,13 @@ def prepend_line(file_name, line):
         os.rename(dummy_file, file_name)
 
 
-def main():
+def main(daemon=False, control_socket=None):
     testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_snapshot_import = get_imported_data()
     monitor(testbed_dict, hostname, lost_safe_tuple,
-            dir_output, dir_original_snapshot_import)
+            dir_output, dir_original_snapshot_import, daemon, control_socket)
 
 
-def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_snapshot_import):
+def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_snapshot_import, daemon=False, control_socket=None):
 
     device = Device(testbed_dict, hostname, lost_safe_tuple)
 
@@ -1817,6 +4486,9 @@ def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_sn
     else:
         print("{} is not connected.".format(device.device_genie.name))
 
+    if get_option("capability_cache", True):
+        device.load_capability("{}/capability_cache.json".format(dir_output))
+
     currentDateTime = datetime.now().strftime("%Y%m%d-%H%M%S")
     all_diff_output_file = "{}/{}_all_diff_output_{}.txt".format(
         dir_output, device.device_genie.name, currentDateTime)
@@ -1832,17 +4504,19 @@ def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_sn
     # print(class_list)
     instance_monitor_dict = dict()
 
-    if dir_original_snapshot_import == "default":
-
+    def create_snapshot_dir(currentDateTime):
         while True:
             dir_original_snapshot_create = "{}/{}_original_snapshot_{}".format(
                 dir_output, device.device_genie.name, currentDateTime)
             if not os.path.exists(dir_original_snapshot_create):
                 os.makedirs(dir_original_snapshot_create)
-                break
+                return dir_original_snapshot_create
             currentDateTime = datetime.now().strftime("%Y%m%d-%H%M%S")
 
-        device.dir_original_snapshot_create = dir_original_snapshot_create
+    if dir_original_snapshot_import == "default":
+
+        device.dir_original_snapshot_create = create_snapshot_dir(
+            currentDateTime)
 
         for class_element in class_list:
             instance = class_element(device)
@@ -1859,40 +4533,43 @@ def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_sn
             instance_monitor_dict[key] = instance
             # print(instance)
         alldetail_instance = AllDetail(device)
+    for name, entry_point in discover_plugins().items():
+        instance = PluginMonitor(device, name, entry_point)
+        instance_monitor_dict[instance.instance_name] = instance
     # print(list(instance_monitor_dict.keys()))
 
-    have_original = False
-    is_detail = False
-
-    try:
-        if not have_original:
-            print("The program is learning {}'s common information for the original state...".format(
-                device.device_genie.name))
-            now1 = datetime.now()
-            # runThreadPoolExecutor(instance_monitor_dict, "original")
-
-            for instance in instance_monitor_dict.values():
-                instance.original()
-            now2 = datetime.now()
+    collector = AsyncCollector(get_option("max_sessions", 10), get_option(
+        "monitor_timeout", 300), get_option("cycle_timeout", 600))
 
-            print(
-                "The common information for original state has learned in {:.2f} seconds.".format(
-                    (now2 - now1).total_seconds()
-                )
-            )
+    def learn_baseline(alldetail_instance):
+        print("The program is learning {}'s common information for the original state...".format(
+            device.device_genie.name))
+        now1 = datetime.now()
+        collect(collector, device, instance_monitor_dict,
+                "original", deadline=False)
+        now2 = datetime.now()
 
-            print("The program is learning {}'s all details for the original state...".format(
-                device.device_genie.name))
-            now1 = datetime.now()
-            alldetail_instance.original()
-            now2 = datetime.now()
-            print(
-                "The all details for original state has learned in {:.2f} seconds.".format(
-                    (now2 - now1).total_seconds()
-                )
+        print(
+            "The common information for original state has learned in {:.2f} seconds.".format(
+                (now2 - now1).total_seconds()
             )
+        )
+        for instance_name in instance_monitor_dict:
+            if (device.hostname, instance_name) in collector.elapsed_dict:
+                print("   {}: {:.2f} seconds".format(
+                    instance_name, collector.elapsed_dict[(device.hostname, instance_name)]))
+        device.wait_snapshots()
+        device.save_capability(instance_monitor_dict)
+
+        # The all details are only needed once the mode compare all detail differences is turned on.
+        alldetail_baseline = get_option("alldetail_baseline", "lazy")
+        if alldetail_baseline == "startup":
+            alldetail_instance.learn_original()
+        elif alldetail_baseline == "background":
+            alldetail_instance.start_original()
 
-            have_original = True
+    try:
+        learn_baseline(alldetail_instance)
 
     except KeyboardInterrupt:
         print("\nThe program has exited before learning's original state.\n".format(
@@ -1911,18 +4588,85 @@ def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_sn
 
     print("Monitor these features:")
     for key in instance_monitor_dict.keys():
-        if key not in device.unsupport_list:
+        if key in device.feature_disabled_list:
+            print("   {} (waiting for feature {} to be enabled)".format(
+                key, ", ".join(instance_monitor_dict[key].feature_dependency)))
+        elif key not in device.unsupport_list:
             print("   {}".format(key))
 
+    connection_manager = ConnectionManager(device, get_option("keepalive_interval", 30), get_option(
+        "reconnect_backoff", 1), get_option("reconnect_max_backoff", 60))
+    connection_manager.start_keepalive()
+
+    if daemon or control_socket is not None or get_option("control_socket", None) is not None:
+        control_server = ControlServer(
+            device, control_socket or get_control_socket())
+        control_server.instance_monitor_dict = instance_monitor_dict
+        control_server.start()
+        cleanup_list.append(control_server.stop)
+    state_server = None
+    if get_option("http_port", None) is not None:
+        state_server = StateServer(device, get_option(
+            "http_address", "127.0.0.1"), get_option("http_port", None))
+        state_server.start()
+        cleanup_list.append(state_server.stop)
+    poll_interval = get_option("poll_interval", 0)
+    report_mode = get_option("report_mode", "delta")
+    baseline_dict = load_baselines(
+        device, instance_monitor_dict, get_option("baselines", {}))
+    previous_record_dict = {}
+    alert_dispatcher = None
+    if len(get_option("alert_destinations", [])) > 0:
+        alert_dispatcher = AlertDispatcher(get_option("alert_destinations", []), get_option(
+            "alert_window", 30), get_option("alert_rate_limit", 6), get_option("alert_retries", 3))
+    json_sink = None
+    if get_option("json_output", False):
+        json_sink = JsonLinesSink("{}/{}_diff.jsonl".format(dir_output, device.device_genie.name), get_option(
+            "json_max_bytes", 64 * 1024 * 1024), get_option("json_max_age", 86400), get_option("json_compression", "gzip"))
+    change_reporter = ChangeReporter(get_option("heartbeat_interval", 300))
+    rebaseline_interval = get_option("rebaseline_interval", None)
+    last_promotion = monotonic()
+
+    def prune_baselines():
+        retention = get_option("baseline_retention", None)
+        if retention is not None:
+            prune_snapshots(dir_output, device.device_genie.name, retention, [
+                device.dir_original_snapshot_create, device.dir_original_snapshot_import] + list(get_option("baselines", {}).values()))
+
     while True:
         print(device.unsupport_list)
         try:
-            if not device.device_genie.is_connected():
-                device.make_connection()
+            if device.exit_requested:
+                print("\nThe program has exited.\n")
+                sys.exit()
 
-            for instance_name, instance in instance_monitor_dict.items():
-                if instance_name not in device.unsupport_list:
-                    instance.current()
+            connection_manager.ensure()
+
+            if device.rebaseline_requested:
+                device.rebaseline_requested = False
+                device.dir_original_snapshot_import = "default"
+                device.dir_original_snapshot_create = create_snapshot_dir(
+                    datetime.now().strftime("%Y%m%d-%H%M%S"))
+                alldetail_instance = AllDetail(device)
+                # A monitor left out for an empty or unreadable original state gets another chance.
+                device.reset_unsupport_list()
+                learn_baseline(alldetail_instance)
+                previous_record_dict = {}
+                last_promotion = monotonic()
+                prune_baselines()
+
+            # A rolling re-baseline promotes what the last cycle collected, without sending commands.
+            if device.promote_requested or (rebaseline_interval is not None and device.cycle_count > 0 and monotonic() - last_promotion >= rebaseline_interval):
+                device.promote_requested = False
+                last_promotion = monotonic()
+                promoted_list = promote_baseline(device, instance_monitor_dict, alldetail_instance, create_snapshot_dir(
+                    datetime.now().strftime("%Y%m%d-%H%M%S")), collector.stale_list)
+                print("The original state version {} of {} monitors is promoted to {}.".format(
+                    device.baseline_version, len(promoted_list), device.dir_original_snapshot_create))
+                previous_record_dict = {}
+                prune_baselines()
+
+            collect(collector, device, instance_monitor_dict, "current")
 
             # if not instance_monitor_dict:
             if len(instance_monitor_dict) == len(set(device.unsupport_list)):
@@ -1930,29 +4674,105 @@ def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_sn
                     device.device_genie.name))
                 sys.exit()
 
-            string = ""
-            string = string + "\n{} {} {}\n".format("-"*40,
-                                                    datetime.now().strftime("%Y-%b-%d %X"), "-"*40)
-
-            is_changed = False
-            for key, value in instance_monitor_dict.items():
-                if value.is_changed():
-                    is_changed = True
-                    break
+            # Each entry of the report is (fingerprint, text); the fingerprint leaves out what changes every cycle.
+            status_dict = {}
+            for host, instance_name in collector.stale_list:
+                status_dict["{} deadline".format(instance_name)] = ("stale", "{} did not finish within its deadline. Its last result is reported.\n".format(
+                    instance_name))
 
-            if is_changed:
-                for key, value in instance_monitor_dict.items():
-                    if value.is_changed():
-                        string = string + value.diff()
-            else:
-                string = string + "{} does not change.\n".format(
-                    device.device_genie.name)
-            string = string + "\n{}".format("-"*102)
+            for key, breaker in device.breaker_dict.items():
+                if breaker.failures > 0 and key not in device.unsupport_list:
+                    status_dict["{} breaker".format(key)] = ("{} {}".format(breaker.state, breaker.failures), "{} circuit breaker is {}.\n".format(
+                        key, breaker))
 
-            print(string)
-            prepend_line(common_diff_output_file, string)
+            for key in device.feature_disabled_list:
+                if key not in device.unsupport_list:
+                    status_dict["{} paused".format(key)] = ("paused", "{} is paused because feature {} is disabled.\n".format(
+                        key, ", ".join(instance_monitor_dict[key].feature_dependency)))
 
-            if is_detail:
+            diff_dict = {}
+            for key, value in instance_monitor_dict.items():
+                if key not in device.feature_disabled_list and value.is_changed():
+                    diff = value.diff()
+                    diff_dict[key] = (diff, diff)
+
+            device.baseline_diff_dict = compare_baselines(
+                device, instance_monitor_dict, baseline_dict)
+            baseline_entry_dict = {}
+            for name, baseline_diff in device.baseline_diff_dict.items():
+                for key, text in baseline_diff.items():
+                    baseline_entry_dict["{} baseline {}".format(key, name)] = (
+                        text, "Compared with the baseline {}: {}".format(name, text.lstrip("\n")))
+
+            # The delta since the last cycle comes from each monitor's previous diff_record().
+            # A monitor within its safe thresholds has no record, so its noise is not reported.
+            delta_dict = {}
+            for key, value in instance_monitor_dict.items():
+                if key in device.feature_disabled_list or key in device.unsupport_list or not callable(getattr(value, "diff_record", None)):
+                    continue
+                record = value.diff_record() if key in diff_dict else {}
+                delta = record_delta(previous_record_dict.get(key, {}), record)
+                previous_record_dict[key] = record
+                if len(delta) > 0:
+                    delta_dict[key] = delta_text(key, delta)
+
+            if report_mode == "change":
+                string = change_reporter.report(
+                    device.device_genie.name, dict(status_dict, **diff_dict, **baseline_entry_dict))
+            elif report_mode == "delta":
+                string = ""
+                string = string + "\n{} {} {}\n".format("-"*40,
+                                                        datetime.now().strftime("%Y-%b-%d %X"), "-"*40)
+                for fingerprint, text in status_dict.values():
+                    string = string + text
+                if len(delta_dict) > 0:
+                    for text in delta_dict.values():
+                        string = string + text
+                else:
+                    string = string + "{} does not change since the last cycle.\n".format(
+                        device.device_genie.name)
+                if len(diff_dict) > 0:
+                    string = string + "Still different from the original state: {}.\n".format(
+                        ", ".join(diff_dict))
+                for name, baseline_diff in device.baseline_diff_dict.items():
+                    if len(baseline_diff) > 0:
+                        string = string + "Still different from the baseline {}: {}.\n".format(
+                            name, ", ".join(baseline_diff))
+                string = string + "\n{}".format("-"*102)
+            else:
+                string = ""
+                string = string + "\n{} {} {}\n".format("-"*40,
+                                                        datetime.now().strftime("%Y-%b-%d %X"), "-"*40)
+                for fingerprint, text in status_dict.values():
+                    string = string + text
+                if len(diff_dict) > 0:
+                    for fingerprint, text in diff_dict.values():
+                        string = string + text
+                else:
+                    string = string + "{} does not change.\n".format(
+                        device.device_genie.name)
+                for fingerprint, text in baseline_entry_dict.values():
+                    string = string + text
+                string = string + "\n{}".format("-"*102)
+
+            if len(string) > 0:
+                print(string)
+                prepend_line(common_diff_output_file, string)
+            if json_sink is not None:
+                json_sink.write(device.device_genie.name,
+                                instance_monitor_dict, list(diff_dict))
+            if alert_dispatcher is not None:
+                alert_dispatcher.submit(device.device_genie.name, {key: text for key, (fingerprint, text) in dict(diff_dict, **baseline_entry_dict).items()}, {
+                                        key: instance_monitor_dict[key].diff_record() for key in diff_dict if callable(getattr(instance_monitor_dict[key], "diff_record", None))})
+            device.save_capability()
+            device.cycle_count = device.cycle_count + 1
+            device.last_cycle = datetime.now().isoformat(timespec="seconds")
+            if state_server is not None:
+                state_server.publish(instance_monitor_dict, [instance_name for host, instance_name in collector.stale_list] + [
+                    key for key, breaker in device.breaker_dict.items() if breaker.state == "open"] + device.feature_disabled_list)
+
+            if device.is_detail:
+                alldetail_instance.wait_original()
                 print("\nThe program is parsing all commands...")
                 alldetail_instance.current()
                 string = alldetail_instance.diff()
@@ -1963,7 +4783,15 @@ def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_sn
                 print("{}\n".format("-"*102))
                 prepend_line(all_diff_output_file, string)
 
+            if poll_interval > 0:
+                device.cycle_event.wait(poll_interval)
+            device.cycle_event.clear()
+
         except KeyboardInterrupt:
+            if daemon:
+                print("\nThe program has exited.\n")
+                sys.exit()
+
             print("\nYou have paused the program.\n")
 
             exit = askYesNo("\nDo you want to exit the program? (Y or N)? ")
@@ -1971,42 +4799,168 @@ def monitor(testbed_dict, hostname, lost_safe_tuple, dir_output, dir_original_sn
                 print("\nThe program has exited.\n")
                 sys.exit()
 
-            if is_detail:
+            if device.is_detail:
                 off_detail_input = askYesNo(
                     "\nDo you want to turn off the mode compare all detail differences (Y or N)? ")
                 if off_detail_input.upper() == "Y":
-                    is_detail = False
+                    device.is_detail = False
                 else:
-                    is_detail = True
+                    device.is_detail = True
             else:
                 on_detail_input = askYesNo(
                     "\nDo you want to turn on the mode compare all detail differences (Y or N)? ")
                 if on_detail_input.upper() == "Y":
-                    is_detail = True
+                    device.is_detail = True
                 else:
-                    is_detail = False
+                    device.is_detail = False
 
         except ConnectionError:
             print(
-                "\nThe connection is disconnected. The program will try to re-connect after 30 seconds.\n")
-            sleep(30)
+                "\nThe connection is disconnected. The program is trying to re-connect.\n")
+            connection_manager.dead.set()
+
+
+def main_fleet():
+    testbed_dict, nxapi_dict, lost_safe_tuple, dir_output = get_fleet_data()
+    monitor_fleet(testbed_dict, nxapi_dict, lost_safe_tuple, dir_output)
+
+
+def monitor_fleet(testbed_dict, nxapi_dict, lost_safe_tuple, dir_output):
+    """Monitor the common information of every device of testbed_dict from one event loop.
+
+    The devices share the collector's max_sessions threads. A device with an
+    NxapiSession in nxapi_dict has its declared commands fetched through
+    NX-API, and opens its SSH session only for the commands NX-API did not
+    answer. An unreachable device is reported and tried again in the next
+    cycle without holding up the others. The all-detail mode, the control
+    socket and the plugins are only available for a single device.
+    """
+
+    currentDateTime = datetime.now().strftime("%Y%m%d-%H%M%S")
+    device_instance_list = []
+    common_diff_output_dict = {}
+    for hostname in testbed_dict["devices"]:
+        device = Device(testbed_dict, hostname, lost_safe_tuple)
+        device.connect_on_demand = True
+        device.nxapi = nxapi_dict.get(hostname, None)
+        device.dir_original_snapshot_create = "{}/{}_original_snapshot_{}".format(
+            dir_output, hostname, currentDateTime)
+        os.makedirs(device.dir_original_snapshot_create, exist_ok=True)
+        common_diff_output_dict[hostname] = "{}/{}_common_diff_output_{}.txt".format(
+            dir_output, hostname, currentDateTime)
+        instance_monitor_dict = dict()
+        for class_element in class_list:
+            instance = class_element(device)
+            instance_monitor_dict["{}_instance".format(
+                type(instance).__name__)] = instance
+        device_instance_list.append((device, instance_monitor_dict))
+
+    collector = AsyncCollector(get_option("max_sessions", 10), get_option(
+        "monitor_timeout", 300), get_option("cycle_timeout", 600))
+    poll_interval = get_option("poll_interval", 0)
+    # The devices that could not learn their original state learn it again in the next cycles.
+    original_list = list(device_instance_list)
+
+    while True:
+        try:
+            if len(original_list) > 0:
+                print("The program is learning the original state of {} devices...".format(
+                    len(original_list)))
+                exception_dict = collect_fleet(
+                    collector, original_list, "original")
+                stale_host_list = [host for host,
+                                   instance_name in collector.stale_list]
+                for device, instance_monitor_dict in original_list:
+                    device.wait_snapshots()
+                    if device.hostname in exception_dict:
+                        print("Cannot learn the original state of {}: {!r}".format(
+                            device.hostname, exception_dict[device.hostname]))
+                    elif device.hostname in stale_host_list:
+                        print("{} did not learn its original state within the deadline.".format(
+                            device.hostname))
+                original_list = [(device, instance_monitor_dict) for device, instance_monitor_dict in original_list
+                                 if device.hostname in exception_dict or device.hostname in stale_host_list]
+
+            start = monotonic()
+            learned_list = [(device, instance_monitor_dict) for device, instance_monitor_dict in device_instance_list
+                            if (device, instance_monitor_dict) not in original_list]
+            exception_dict = collect_fleet(collector, learned_list, "current")
+
+            changed_count = 0
+            for device, instance_monitor_dict in learned_list:
+                string = "\n{} {} {} {}\n".format("-"*40, device.hostname,
+                                                 datetime.now().strftime("%Y-%b-%d %X"), "-"*40)
+                if device.hostname in exception_dict:
+                    string = string + "Cannot collect {}: {!r}\n".format(
+                        device.hostname, exception_dict[device.hostname])
+                else:
+                    for host, instance_name in collector.stale_list:
+                        if host == device.hostname:
+                            string = string + "{} did not finish within its deadline. Its last result is reported.\n".format(
+                                instance_name)
+                    is_changed = False
+                    for key, value in instance_monitor_dict.items():
+                        if key not in device.feature_disabled_list and key not in device.unsupport_list and value.is_changed():
+                            string = string + value.diff()
+                            is_changed = True
+                    if is_changed:
+                        changed_count = changed_count + 1
+                        print(string)
+                    else:
+                        string = string + "{} does not change.\n".format(
+                            device.hostname)
+                prepend_line(common_diff_output_dict[device.hostname], string)
+                device.cycle_count = device.cycle_count + 1
+                device.last_cycle = datetime.now().isoformat(timespec="seconds")
+
+            print("{} {} devices collected in {:.1f} seconds: {} changed, {} unreachable, {} without an original state.".format(
+                datetime.now().strftime("%Y-%b-%d %X"), len(learned_list), monotonic() - start, changed_count, len(exception_dict), len(original_list)))
+
+            if poll_interval > 0:
+                sleep(poll_interval)
+
+        except KeyboardInterrupt:
+            print("\nThe program has exited.\n")
+            sys.exit()
 
 
 if __name__ == '__main__':
-    try:
+    args = parse_arguments()
+    if args.config is not None:
+        try:
+            load_config(args.config)
+        except Exception as e:
+            print("Cannot import {}: {}".format(args.config, e))
+            sys.exit(1)
+    if args.control is not None:
+        sys.exit(send_control(args.socket or get_control_socket(), args.control))
+    if args.check:
+        sys.exit(check_config())
+    if args.daemon:
+        # Nobody answers prompts in daemon mode, so a broken configuration stops here.
+        if check_config() != 0:
+            sys.exit(1)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
 
-        # Uncomment six lines below to import and decorate classes from extra.py
-        # import inspect
-        # import extra
-        # extra_class_list = [m[1] for m in inspect.getmembers(
-        #     extra, inspect.isclass) if m[1].__module__ == extra.__name__]
-        # for extraClass in extra_class_list:
-        #     extraClass = decorator_instance(extraClass)
+    try:
 
-        main()
+        # Classes like the ones in extra.py are loaded as plugins, see plugins in databaseconfig.py.
 
-    except SystemExit:
-        sys.exit()
+        if args.fleet:
+            main_fleet()
+        else:
+            main(args.daemon, args.socket)
+
+    except SystemExit as e:
+        if args.daemon:
+            # Worker threads still stuck on the device would hold the interpreter until their commands
+            # time out, past the service manager's stop timeout; clean up and leave without joining them.
+            status = exit_status(e.code)
+            run_cleanups()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+        raise
     except:
         print("\nSomethings went wrong.")
         print("Unexpected error:", sys.exc_info()[0])
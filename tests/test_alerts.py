@@ -0,0 +1,122 @@
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from nxos_monitor_oop import AlertDestination, AlertDispatcher
+
+
+class WebhookStandIn(HTTPServer):
+    """A local webhook receiver; the first fail_count requests are answered with 500."""
+
+    def __init__(self, fail_count=0):
+        self.fail_count = fail_count
+        self.body_list = []
+        self.request_count = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(handler):
+                body = handler.rfile.read(int(handler.headers["Content-Length"]))
+                self.request_count = self.request_count + 1
+                if self.request_count <= self.fail_count:
+                    handler.send_response(500)
+                else:
+                    self.body_list.append(json.loads(body))
+                    handler.send_response(200)
+                handler.end_headers()
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/alerts".format(self.server_address[1])
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """A local SMTP server keeping the DATA of every message."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.message_list = []
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(handler):
+                handler.wfile.write(b"220 stand-in\r\n")
+                while True:
+                    line = handler.rfile.readline()
+                    if not line:
+                        return None
+                    command = line.decode().strip().upper()
+                    if command == "DATA":
+                        handler.wfile.write(b"354 go ahead\r\n")
+                        data_list = []
+                        while True:
+                            data_line = handler.rfile.readline()
+                            if data_line in (b".\r\n", b""):
+                                break
+                            data_list.append(data_line.decode())
+                        self.message_list.append("".join(data_list))
+                        handler.wfile.write(b"250 queued\r\n")
+                    elif command == "QUIT":
+                        handler.wfile.write(b"221 bye\r\n")
+                        return None
+                    else:
+                        handler.wfile.write(b"250 ok\r\n")
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_alerts_are_grouped_and_sent_to_every_destination():
+    webhook = WebhookStandIn()
+    smtp = SmtpStandIn()
+    try:
+        dispatcher = AlertDispatcher([{"type": "webhook", "url": webhook.url},
+                                      {"type": "smtp", "host": "127.0.0.1", "port": smtp.server_address[1],
+                                       "from": "monitor@example.com", "to": ["noc@example.com"]}], window=0.2)
+        dispatcher.submit("sw1", {"ArpMonitor_instance": "5 ARP entries lost.\n"},
+                          {"ArpMonitor_instance": {"counts": {"lost": 5}}})
+        dispatcher.submit("sw2", {"VlanMonitor_instance": "1 VLAN down.\n"})
+        assert wait_for(lambda: len(webhook.body_list) == 1 and len(smtp.message_list) == 1)
+        alert_list = webhook.body_list[0]["alerts"]
+        assert [(alert["device"], alert["monitor"], alert["cleared"]) for alert in alert_list] == [
+            ("sw1", "ArpMonitor_instance", False), ("sw2", "VlanMonitor_instance", False)]
+        assert alert_list[0]["record"] == {"counts": {"lost": 5}}
+        assert webhook.body_list[0]["subject"] == "nxos-genie-monitor: 2 change(s) on sw1, sw2"
+        assert "5 ARP entries lost." in smtp.message_list[0]
+        assert "1 VLAN down." in smtp.message_list[0]
+
+        # The same difference is not sent again; a cleared one is.
+        dispatcher.submit("sw1", {"ArpMonitor_instance": "5 ARP entries lost.\n"})
+        dispatcher.submit("sw2", {})
+        assert wait_for(lambda: len(webhook.body_list) == 2)
+        assert [(alert["device"], alert["monitor"], alert["cleared"]) for alert in webhook.body_list[1]["alerts"]] == [
+            ("sw2", "VlanMonitor_instance", True)]
+    finally:
+        webhook.shutdown()
+        smtp.shutdown()
+
+
+def test_a_failed_send_is_retried():
+    webhook = WebhookStandIn(fail_count=2)
+    try:
+        destination = AlertDestination({"type": "webhook", "url": webhook.url}, retries=3, backoff=0.01)
+        destination.put([{"time": "now", "device": "sw1", "monitor": "ArpMonitor_instance", "cleared": False,
+                          "text": "5 ARP entries lost.\n", "record": {}}])
+        assert wait_for(lambda: len(webhook.body_list) == 1)
+        assert webhook.request_count == 3
+    finally:
+        webhook.shutdown()
@@ -0,0 +1,43 @@
+import json
+from types import SimpleNamespace
+
+from nxos_monitor_oop import ArpMonitor, FdbMonitor, compare_baselines, load_baselines
+
+
+def write_snapshot(directory, member_dict):
+    directory.mkdir()
+    for file_name, data in member_dict.items():
+        (directory / file_name).write_text(json.dumps(data))
+    return str(directory)
+
+
+def test_baselines_share_the_thresholds_of_the_running_device(tmp_path):
+    device = SimpleNamespace(hostname="sw1", unsupport_list=[], feature_disabled_list=[], lost_arp_safe=30, lost_mac_safe=30,
+                             dir_original_snapshot_import="default", dir_original_snapshot_create=str(tmp_path / "current"))
+    instance_monitor_dict = {"ArpMonitor_instance": ArpMonitor(device), "FdbMonitor_instance": FdbMonitor(device)}
+    instance_monitor_dict["ArpMonitor_instance"].arp_entries_original = 100
+    instance_monitor_dict["FdbMonitor_instance"].total_mac_addresses_original = 100
+    baseline_option = {
+        "pre-change": write_snapshot(tmp_path / "pre-change", {"arp.json": {"total_arp_entries_original": 100},
+                                                               "fdb.json": {"total_mac_addresses_original": 50}}),
+        "arp-only": write_snapshot(tmp_path / "arp-only", {"arp.json": {"total_arp_entries_original": 125}}),
+        "missing": str(tmp_path / "missing"),
+    }
+    baseline_dict = load_baselines(device, instance_monitor_dict, baseline_option)
+
+    assert sorted(baseline_dict) == ["arp-only", "pre-change"]
+    assert sorted(baseline_dict["pre-change"]) == ["ArpMonitor_instance", "FdbMonitor_instance"]
+    assert sorted(baseline_dict["arp-only"]) == ["ArpMonitor_instance"]
+    # A member missing from a baseline leaves the running device's monitors alone.
+    assert device.unsupport_list == []
+
+    instance_monitor_dict["ArpMonitor_instance"].arp_entries_current = 80
+    instance_monitor_dict["FdbMonitor_instance"].total_mac_addresses_current = 50
+    for instance in instance_monitor_dict.values():
+        instance.compare()
+    assert compare_baselines(device, instance_monitor_dict, baseline_dict) == {"pre-change": {}, "arp-only": {
+        "ArpMonitor_instance": baseline_dict["arp-only"]["ArpMonitor_instance"].diff()}}
+
+    # A threshold changed on the running device, e.g. through the control socket, applies to the baselines.
+    device.lost_arp_safe = 10
+    assert sorted(compare_baselines(device, instance_monitor_dict, baseline_dict)["pre-change"]) == ["ArpMonitor_instance"]
@@ -0,0 +1,59 @@
+from nxos_monitor_oop import Device
+
+
+def new_device(output):
+    device = Device.__new__(Device)
+    device.hostname = "sw1"
+    device.batch_size = 8
+    device.batch_timeout = 10
+    device.line_list = []
+
+    def execute_uncached(line, **kwargs):
+        device.line_list.append(line)
+        if isinstance(output, Exception):
+            raise output
+        return output
+    device.execute_uncached = execute_uncached
+    return device
+
+
+def test_execute_batch_splits_the_output_at_the_markers():
+    line = ("echo ### nxos-genie-monitor batch start ### ; show a ; echo ### nxos-genie-monitor batch 0 ### ; "
+            "show b ; echo ### nxos-genie-monitor batch 1 ###")
+    # The device echoes the command line before its output.
+    output = ("{}\n### nxos-genie-monitor batch start ###\n"
+              "a line 1\na line 2\n### nxos-genie-monitor batch 0 ###\n"
+              "b line\n### nxos-genie-monitor batch 1 ###\n").format(line)
+    device = new_device(output)
+    assert device.execute_batch(["show a", "show b"]) == {
+        "show a": "a line 1\na line 2\n", "show b": "b line\n"}
+    assert device.line_list == [line]
+    assert device.batch_size == 8
+
+
+def test_execute_batch_keeps_a_json_output_decodable():
+    output = ("echo ### nxos-genie-monitor batch start ### ; show vlan | json ; echo ### nxos-genie-monitor batch 0 ###\n"
+              "### nxos-genie-monitor batch start ###\n"
+              "{\"TABLE_vlanbrief\": {}}\n### nxos-genie-monitor batch 0 ###\n")
+    device = new_device(output)
+    assert device.execute_batch(["show vlan | json"]) == {
+        "show vlan | json": "{\"TABLE_vlanbrief\": {}}\n"}
+
+
+def test_execute_batch_stops_batching_when_a_marker_is_missing():
+    device = new_device(
+        "### nxos-genie-monitor batch start ###\na line\n### nxos-genie-monitor batch 0 ###\nb line\n")
+    assert device.execute_batch(["show a", "show b"]) == {}
+    assert device.batch_size == 1
+
+
+def test_execute_batch_stops_batching_when_the_line_is_rejected():
+    device = new_device(RuntimeError("% Invalid command at '^' marker."))
+    assert device.execute_batch(["show a", "show b"]) == {}
+    assert device.batch_size == 1
+
+
+def test_execute_batch_keeps_batching_after_a_timeout():
+    device = new_device(TimeoutError("timed out"))
+    assert device.execute_batch(["show a", "show b"]) == {}
+    assert device.batch_size == 8
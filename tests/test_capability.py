@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+
+from nxos_monitor_oop import Device
+
+
+def new_device(hostname, capability_file):
+    device = Device.__new__(Device)
+    device.hostname = hostname
+    device.capability_file = str(capability_file)
+    device.capability_key = "{} Nexus N9K 9.3(8)".format(hostname)
+    device.capability_dict = {"commands": {}, "monitors": {}}
+    device.capability_lock = threading.Lock()
+    device.capability_dirty = False
+    device.feature_enabled_list = None
+    return device
+
+
+def test_save_capability_writes_only_what_changed(tmp_path):
+    capability_file = tmp_path / "capability_cache.json"
+    device = new_device("sw1", capability_file)
+    device.record_command("show vlan", True, 1.0)
+    device.save_capability()
+    assert json.loads(capability_file.read_text())["sw1 Nexus N9K 9.3(8)"]["commands"]["show vlan"]["supported"]
+
+    # A new runtime alone does not rewrite the file.
+    os.utime(capability_file, (0, 0))
+    device.record_command("show vlan", True, 2.0)
+    device.save_capability()
+    assert os.stat(capability_file).st_mtime == 0
+
+    device.record_command("show vlan", False)
+    device.save_capability()
+    assert os.stat(capability_file).st_mtime != 0
+    assert not json.loads(capability_file.read_text())["sw1 Nexus N9K 9.3(8)"]["commands"]["show vlan"]["supported"]
+
+    os.utime(capability_file, (0, 0))
+    device.set_features(["ospf"])
+    device.save_capability()
+    assert json.loads(capability_file.read_text())["sw1 Nexus N9K 9.3(8)"]["features"] == ["ospf"]
+
+
+def test_save_capability_keeps_the_entries_of_other_devices(tmp_path):
+    capability_file = tmp_path / "capability_cache.json"
+    device_list = [new_device("sw{}".format(i), capability_file) for i in range(8)]
+
+    def save(device):
+        for i in range(20):
+            device.record_command("show command {}".format(i), True)
+            device.save_capability()
+    thread_list = [threading.Thread(target=save, args=(device,)) for device in device_list]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    capability_all_dict = json.loads(capability_file.read_text())
+    assert sorted(capability_all_dict) == sorted(device.capability_key for device in device_list)
+    for device in device_list:
+        assert len(capability_all_dict[device.capability_key]["commands"]) == 20
+
+
+def test_reset_unsupport_list_keeps_the_monitors_recorded_as_unsupported(tmp_path):
+    device = new_device("sw1", tmp_path / "capability_cache.json")
+    device.capability_dict["monitors"] = {"FabricpathMonitor_instance": {"supported": False, "recorded": 0}}
+    unsupport_list = device.unsupport_list = ["VlanMonitor_instance", "FabricpathMonitor_instance"]
+    device.reset_unsupport_list()
+    assert device.unsupport_list == ["FabricpathMonitor_instance"]
+    assert device.unsupport_list is unsupport_list
@@ -0,0 +1,45 @@
+import nxos_monitor_oop
+from nxos_monitor_oop import ChangeReporter
+
+
+def test_only_new_changed_and_cleared_entries_are_reported(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(nxos_monitor_oop, "monotonic", lambda: now[0])
+    reporter = ChangeReporter(heartbeat_interval=300)
+
+    string = reporter.report("sw1", {"ArpMonitor_instance": ("5 lost", "5 ARP entries lost.\n")})
+    assert "5 ARP entries lost.\n" in string
+
+    # The same fingerprint with a new text (e.g. a timestamp) is not reported again.
+    now[0] = 1010.0
+    assert reporter.report("sw1", {"ArpMonitor_instance": ("5 lost", "5 ARP entries lost at 10:00.\n")}) == ""
+
+    string = reporter.report("sw1", {"ArpMonitor_instance": ("7 lost", "7 ARP entries lost.\n"),
+                                     "VlanMonitor_instance": ("1 down", "1 VLAN down.\n")})
+    assert "7 ARP entries lost.\n" in string
+    assert "1 VLAN down.\n" in string
+
+    string = reporter.report("sw1", {"VlanMonitor_instance": ("1 down", "1 VLAN down.\n")})
+    assert "ArpMonitor_instance is cleared.\n" in string
+    assert "VLAN" not in string
+
+
+def test_a_heartbeat_is_written_when_nothing_changes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(nxos_monitor_oop, "monotonic", lambda: now[0])
+    reporter = ChangeReporter(heartbeat_interval=300)
+    entry_dict = {"VlanMonitor_instance": ("1 down", "1 VLAN down.\n")}
+    assert reporter.report("sw1", entry_dict) != ""
+
+    now[0] = 1299.0
+    assert reporter.report("sw1", entry_dict) == ""
+    now[0] = 1300.0
+    assert reporter.report("sw1", entry_dict).endswith("sw1 is still monitored, 1 open item(s) unchanged.")
+    now[0] = 1400.0
+    assert reporter.report("sw1", entry_dict) == ""
+    now[0] = 1600.0
+    assert "VlanMonitor_instance is cleared.\n" in reporter.report("sw1", {})
+    now[0] = 1899.0
+    assert reporter.report("sw1", {}) == ""
+    now[0] = 1900.0
+    assert reporter.report("sw1", {}).endswith("sw1 is still monitored and does not change.")
@@ -0,0 +1,69 @@
+import threading
+
+import nxos_monitor_oop
+from nxos_monitor_oop import ArpMonitor, AsyncCollector, CircuitBreaker, Device, collect
+
+
+def test_circuit_breaker_opens_after_threshold_failures(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(nxos_monitor_oop, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(threshold=2, backoff=10, max_backoff=15)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    now[0] = 1010.0
+    assert breaker.allow()
+    assert breaker.state == "half-open"
+    # A failure half-open opens it again for twice the backoff, up to max_backoff.
+    breaker.record(False)
+    assert not breaker.allow()
+    now[0] = 1024.0
+    assert not breaker.allow()
+    now[0] = 1025.0
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+class ArpDevice(Device):
+    """A device answering the ARP table from arp_entries, without a connection."""
+
+    def __init__(self):
+        self.hostname = "sw1"
+        self.unsupport_list = []
+        self.feature_enabled_list = None
+        self.feature_disabled_list = []
+        self.deferred_list = []
+        self.breaker_dict = {}
+        self.command_cache_ttl = 0
+        self.command_cache_dict = {}
+        self.command_cache_lock = threading.Lock()
+        self.lost_arp_safe = 30
+        self.arp_entries = 0
+
+    def learn_json(self, cmd, function):
+        if isinstance(self.arp_entries, Exception):
+            raise self.arp_entries
+        return self.arp_entries
+
+
+def test_an_empty_table_is_a_valid_sample_and_an_exception_a_failure(monkeypatch):
+    monkeypatch.setattr(nxos_monitor_oop, "get_option", lambda name, default: 1 if name == "breaker_threshold" else default)
+    device = ArpDevice()
+    instance_monitor_dict = {"ArpMonitor_instance": ArpMonitor(device)}
+    instance_monitor_dict["ArpMonitor_instance"].arp_entries_original = 10
+    collector = AsyncCollector()
+
+    device.arp_entries = 0
+    collect(collector, device, instance_monitor_dict, "current")
+    assert device.get_breaker("ArpMonitor_instance").state == "closed"
+    # Losing every entry is reported, not taken as an unsupported table.
+    assert instance_monitor_dict["ArpMonitor_instance"].is_changed()
+
+    device.arp_entries = RuntimeError("parse failure")
+    collect(collector, device, instance_monitor_dict, "current")
+    assert device.get_breaker("ArpMonitor_instance").state == "open"
@@ -0,0 +1,69 @@
+from nxos_monitor_oop import FabricpathMonitor, delta_text, item_fingerprints, record_delta
+
+
+def test_record_delta_reports_moved_counts():
+    delta = record_delta({"counts": {"lost": 1, "same": 2}}, {"counts": {"lost": 3, "same": 2}})
+    assert delta == {"counts": {"lost": [1, 3]}}
+
+
+def test_record_delta_reports_new_and_cleared_items():
+    delta = record_delta({"items": {"down": ["Ethernet1/1", "Ethernet1/2"]}},
+                         {"items": {"down": ["Ethernet1/2", "Ethernet1/3"]}})
+    assert delta["new"] == {"down": ["Ethernet1/3"]}
+    assert delta["cleared"] == {"down": ["Ethernet1/1"]}
+
+
+def test_record_delta_of_equal_records_is_empty():
+    record = {"counts": {"lost": 1}, "items": {"down": {"Ethernet1/1": {"state": "down"}}}}
+    assert record_delta(record, record) == {}
+
+
+def test_record_delta_clears_everything_when_the_monitor_recovers():
+    delta = record_delta({"counts": {"lost": 2}, "items": {"down": ["Ethernet1/1"]}}, {})
+    assert delta["cleared"] == {"down": ["Ethernet1/1"]}
+
+
+def test_item_fingerprints_accepts_single_values():
+    assert item_fingerprints(0) == {}
+    assert item_fingerprints(None) == {}
+    assert item_fingerprints("Ethernet1/1") == {"Ethernet1/1": "Ethernet1/1"}
+
+
+def fabricpath_monitor(fabricpath_diff_dict):
+    monitor = FabricpathMonitor.__new__(FabricpathMonitor)
+    monitor.fabricpath_diff_dict = fabricpath_diff_dict
+    return monitor
+
+
+def test_fabricpath_diff_record_on_a_healthy_fabric():
+    monitor = fabricpath_monitor({"num_switchid_lost": 0, "Adjacencies lost": 0,
+                                  "delta_fabricpath_adjacency": 0, "percentage_delta_fabricpath_adjacency": 0,
+                                  "delta_fabricpath_interface": 0, "percentage_delta_fabricpath_interface": 0})
+    record = monitor.diff_record()
+    assert record["items"] == {"interfaces_lost": {}, "adjacencies_lost": {}}
+    assert record_delta({}, record) == {}
+
+
+def test_fabricpath_diff_record_reports_lost_interfaces():
+    monitor = fabricpath_monitor({"num_switchid_lost": 1, "Adjacencies lost": "Not support",
+                                  "Interfaces lost": {"Ethernet1/1": {"state": "Not found in fabricpath isis interface brief"}},
+                                  "delta_fabricpath_interface": 1, "percentage_delta_fabricpath_interface": 50.0})
+    delta = record_delta({}, monitor.diff_record())
+    assert delta["counts"] == {"switch_ids_lost": [0, 1], "interfaces_changed": [0, 1]}
+    assert list(delta["new"]["interfaces_lost"]) == ["Ethernet1/1"]
+
+
+def test_record_delta_reports_an_item_whose_value_changed_as_new():
+    delta = record_delta({"items": {"down": {"VLAN 10": {"state": "down"}, "VLAN 20": {"state": "down"}}}},
+                         {"items": {"down": {"VLAN 10": {"state": "shutdown"}, "VLAN 20": {"state": "down"}}}})
+    assert delta == {"new": {"down": ["VLAN 10"]}}
+
+
+def test_delta_text_lists_the_counts_and_items():
+    delta = {"counts": {"lost": [1, 3]}, "new": {"down": ["Ethernet1/3", {"vrf": "default"}]},
+             "cleared": {"down": ["Ethernet1/1"]}}
+    assert delta_text("InterfaceMonitor_instance", delta) == (
+        "InterfaceMonitor_instance since the last cycle:\n"
+        "   lost: 1 --> 3\n"
+        "   new down: Ethernet1/3, {\"vrf\": \"default\"}\n"
+        "   cleared down: Ethernet1/1\n")
@@ -0,0 +1,84 @@
+import nxos_monitor_oop
+from nxos_monitor_oop import FlapTracker, InterfaceMonitor
+
+
+def test_stable_object_is_not_flapping():
+    tracker = FlapTracker(window=10, threshold=3, quiet=3)
+    for i in range(10):
+        tracker.update("Ethernet1/1", True)
+    assert tracker.flapping_set == set()
+    assert tracker.dampened_set == set()
+
+
+def test_object_changing_threshold_times_is_flapping():
+    tracker = FlapTracker(window=10, threshold=3, quiet=3)
+    for state in [True, False, True, False]:
+        tracker.update("Ethernet1/1", state)
+    assert tracker.flapping_set == {"Ethernet1/1"}
+
+
+def test_flapping_object_becomes_dampened_then_stable():
+    tracker = FlapTracker(window=8, threshold=3, quiet=3)
+    for state in [True, False, True, False, True, True, True]:
+        tracker.update("Ethernet1/1", state)
+    assert tracker.dampened_set == {"Ethernet1/1"}
+    assert tracker.flapping_set == set()
+    for i in range(8):
+        tracker.update("Ethernet1/1", True)
+    assert tracker.dampened_set == set()
+
+
+def test_changes_older_than_the_window_are_forgotten():
+    tracker = FlapTracker(window=4, threshold=2, quiet=4)
+    for state in [True, False, True]:
+        tracker.update("a", state)
+    assert "a" in tracker.flapping_set
+    for i in range(4):
+        tracker.update("a", True)
+    assert "a" not in tracker.flapping_set
+    assert "a" not in tracker.dampened_set
+
+
+def test_update_all_samples_missing_objects_as_false():
+    tracker = FlapTracker(window=10, threshold=2, quiet=5)
+    tracker.update_all({"a": True, "b": True})
+    tracker.update_all({"b": True})
+    tracker.update_all({"a": True, "b": True})
+    assert tracker.flapping_set == {"a"}
+
+
+def test_the_window_is_at_most_one_word():
+    tracker = FlapTracker(window=100, threshold=2, quiet=5)
+    assert tracker.window == 64
+    for state in [True, False, True]:
+        tracker.update("a", state)
+    # The first change is still in the last 64 samples after 61 more.
+    for i in range(61):
+        tracker.update("a", True)
+    assert "a" in tracker.dampened_set
+    tracker.update("a", True)
+    assert "a" not in tracker.dampened_set
+
+
+class InterfaceDevice:
+    """Answers show interface with the next list of interfaces up."""
+
+    def __init__(self, up_list_list):
+        self.up_list_list = list(up_list_list)
+
+    def learn_json(self, cmd, function):
+        return self.up_list_list.pop(0)
+
+
+def test_a_flapping_interface_is_reported_while_it_is_up(monkeypatch):
+    monkeypatch.setattr(nxos_monitor_oop, "get_option", lambda name, default: {
+        "flap_window": 10, "flap_threshold": 3, "flap_quiet": 4}.get(name, default))
+    up_list_list = [["Ethernet1/1", "Ethernet1/2"], ["Ethernet1/1"]] * 2 + [["Ethernet1/1", "Ethernet1/2"]]
+    monitor = InterfaceMonitor(InterfaceDevice(up_list_list))
+    monitor.intf_up_list_original = ["Ethernet1/1", "Ethernet1/2"]
+    for i in range(len(up_list_list)):
+        monitor.current()
+    assert monitor.intf_down_list == []
+    assert monitor.is_changed()
+    assert "1 interfaces are flapping:\n   Ethernet1/2\n" in monitor.diff()
+    assert monitor.diff_record()["items"]["interfaces_flapping"] == ["Ethernet1/2"]
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import threading
+
+from nxos_monitor_oop import AsyncCollector, Device, NxapiSession, collect_fleet
+
+
+class NxapiStandIn:
+    """An HTTP server on a local port answering NX-API JSON-RPC requests like a switch."""
+
+    def __init__(self, chunked=False):
+        self.chunked = chunked
+        self.request_list = []
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.handle, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def handle(self, reader, writer):
+        header_dict = {}
+        await reader.readline()
+        while True:
+            line = (await reader.readline()).decode()
+            if line.strip() == "":
+                break
+            name, sep, value = line.partition(":")
+            header_dict[name.strip().lower()] = value.strip()
+        request_list = json.loads(await reader.readexactly(int(header_dict["content-length"])))
+        self.request_list.append(request_list)
+        response_list = []
+        for request in request_list:
+            cmd = request["params"]["cmd"]
+            if cmd == "show bogus":
+                response_list.append({"jsonrpc": "2.0", "error": {"code": -32602, "message": "Invalid params"}, "id": request["id"]})
+            elif request["method"] == "cli":
+                response_list.append({"jsonrpc": "2.0", "result": {"body": {"cmd": cmd}}, "id": request["id"]})
+            elif cmd == "show empty":
+                response_list.append({"jsonrpc": "2.0", "result": None, "id": request["id"]})
+            else:
+                response_list.append({"jsonrpc": "2.0", "result": {"msg": "text of {}\n".format(cmd)}, "id": request["id"]})
+        data = json.dumps(response_list).encode()
+        if self.chunked:
+            half = len(data) // 2
+            writer.write(b"HTTP/1.1 500 Internal Server Error\r\nTransfer-Encoding: chunked\r\n\r\n" + b"%x\r\n" % half + data[:half] +
+                         b"\r\n" + b"%x\r\n" % (len(data) - half) + data[half:] + b"\r\n0\r\n\r\n")
+        else:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(data) + data)
+        await writer.drain()
+        writer.close()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def test_nxapi_session_runs_a_batch_in_one_request():
+    for chunked in (False, True):
+        stand_in = NxapiStandIn(chunked)
+        try:
+            session = NxapiSession("127.0.0.1", "admin", "secret", stand_in.port, use_ssl=False, timeout=5)
+            output_dict = asyncio.run(session.run(["show interface | json", "show version", "show bogus", "show empty"]))
+        finally:
+            stand_in.close()
+        assert output_dict == {"show interface | json": json.dumps({"cmd": "show interface"}),
+                               "show version": "text of show version\n", "show empty": ""}
+        assert [request["method"] for request in stand_in.request_list[0]] == ["cli", "cli_ascii", "cli_ascii", "cli_ascii"]
+
+
+class FleetMonitor:
+    commands = ["show interface"]
+
+    def __init__(self, device):
+        self.device = device
+        self.output = None
+
+    def original(self):
+        self.output = self.device.execute("show interface")
+
+    def current(self):
+        if self.device.hostname == "down":
+            raise ConnectionError("unreachable")
+        self.output = self.device.execute("show interface")
+
+
+def new_fleet_device(hostname, port):
+    device = Device.__new__(Device)
+    device.hostname = hostname
+    device.unsupport_list = []
+    device.feature_enabled_list = None
+    device.feature_disabled_list = []
+    device.deferred_list = []
+    device.breaker_dict = {}
+    device.command_cache_ttl = 30
+    device.command_cache_dict = {}
+    device.command_lock_dict = {}
+    device.command_cache_lock = threading.Lock()
+    device.batch_size = 8
+    device.structured_output = False
+    device.structured_unsupport_list = []
+    device.capability_dict = {}
+    device.session_pool_size = 1
+    device.nxapi = NxapiSession("127.0.0.1", "admin", "secret", port, use_ssl=False, timeout=5)
+
+    def execute_uncached(cmd, **kwargs):
+        raise AssertionError("{} ran over SSH".format(cmd))
+    device.execute_uncached = execute_uncached
+    return device
+
+
+def test_collect_fleet_fetches_every_device_through_nxapi_and_isolates_failures():
+    stand_in = NxapiStandIn()
+    collector = AsyncCollector(max_sessions=2)
+    try:
+        device_instance_list = []
+        for hostname in ["sw{}".format(i) for i in range(20)] + ["down"]:
+            device = new_fleet_device(hostname, stand_in.port)
+            device_instance_list.append((device, {"FleetMonitor_instance": FleetMonitor(device)}))
+        assert collect_fleet(collector, device_instance_list, "original", deadline=False) == {}
+        exception_dict = collect_fleet(collector, device_instance_list, "current")
+    finally:
+        stand_in.close()
+    assert list(exception_dict) == ["down"]
+    for device, instance_monitor_dict in device_instance_list:
+        assert instance_monitor_dict["FleetMonitor_instance"].output == "text of show interface\n"
+    # One request per device and cycle, and none for the monitors.
+    assert len(stand_in.request_list) == 2 * len(device_instance_list)
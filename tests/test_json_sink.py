@@ -0,0 +1,74 @@
+import gzip
+import json
+
+import nxos_monitor_oop
+from nxos_monitor_oop import JsonLinesSink
+
+
+class RecordMonitor:
+    def __init__(self, count):
+        self.count = count
+
+    def diff_record(self):
+        return {"counts": {"lost": self.count}, "percentages": {}, "items": {}}
+
+
+def read_lines(file_name):
+    with open(file_name) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_are_written_once_per_change_and_when_cleared(tmp_path):
+    file_name = str(tmp_path / "sw1_diff.jsonl")
+    sink = JsonLinesSink(file_name)
+    monitor_dict = {"ArpMonitor_instance": RecordMonitor(5)}
+    sink.write("sw1", monitor_dict, ["ArpMonitor_instance"])
+    sink.write("sw1", monitor_dict, ["ArpMonitor_instance"])
+    monitor_dict["ArpMonitor_instance"].count = 7
+    sink.write("sw1", monitor_dict, ["ArpMonitor_instance"])
+    sink.write("sw1", monitor_dict, [])
+    sink.write("sw1", monitor_dict, [])
+    line_list = read_lines(file_name)
+    assert [line["counts"] for line in line_list] == [{"lost": 5}, {"lost": 7}, {}]
+    assert line_list[2]["cleared"]
+    assert {line["device"] for line in line_list} == {"sw1"}
+
+
+def test_the_file_is_rotated_by_size_and_compressed(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(nxos_monitor_oop, "monotonic", lambda: now[0])
+    file_name = str(tmp_path / "sw1_diff.jsonl")
+    sink = JsonLinesSink(file_name, max_bytes=200, max_age=3600)
+    monitor_dict = {"ArpMonitor_instance": RecordMonitor(0)}
+    for count in range(1, 4):
+        monitor_dict["ArpMonitor_instance"].count = count
+        sink.write("sw1", monitor_dict, ["ArpMonitor_instance"])
+        now[0] = now[0] + 1
+    sink.executor.shutdown(wait=True)
+    rotated_list = sorted(tmp_path.glob("sw1_diff.jsonl.*.gz"))
+    assert len(rotated_list) == 1
+    with gzip.open(str(rotated_list[0]), "rt") as f:
+        assert [json.loads(line)["counts"] for line in f] == [{"lost": 1}, {"lost": 2}]
+    assert [line["counts"] for line in read_lines(file_name)] == [{"lost": 3}]
+
+
+def test_the_file_is_rotated_by_age(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(nxos_monitor_oop, "monotonic", lambda: now[0])
+    file_name = str(tmp_path / "sw1_diff.jsonl")
+    sink = JsonLinesSink(file_name, max_bytes=10 ** 6, max_age=3600, compression=None)
+    monitor_dict = {"ArpMonitor_instance": RecordMonitor(1)}
+    sink.write("sw1", monitor_dict, ["ArpMonitor_instance"])
+    now[0] = 4599.0
+    monitor_dict["ArpMonitor_instance"].count = 2
+    sink.write("sw1", monitor_dict, ["ArpMonitor_instance"])
+    assert len(read_lines(file_name)) == 2
+
+    now[0] = 4600.0
+    monitor_dict["ArpMonitor_instance"].count = 3
+    sink.write("sw1", monitor_dict, ["ArpMonitor_instance"])
+    sink.executor.shutdown(wait=True)
+    assert [line["counts"] for line in read_lines(file_name)] == [{"lost": 3}]
+    rotated_list = list(tmp_path.glob("sw1_diff.jsonl.*"))
+    assert len(rotated_list) == 1
+    assert [line["counts"] for line in read_lines(str(rotated_list[0]))] == [{"lost": 1}, {"lost": 2}]
@@ -0,0 +1,107 @@
+import pytest
+
+import nxos_monitor_oop
+from nxos_monitor_oop import MerkleDiff
+
+
+def digest(value, exclude=[]):
+    merkle_diff = MerkleDiff()
+    merkle_diff.set_exclude(exclude)
+    return merkle_diff.node_hash(merkle_diff.hash_tree(value))
+
+
+def test_leaf_values_that_collide_with_hash_differ():
+    # hash(-1) == hash(-2) in CPython.
+    assert digest({"show a": {"x": -1}}) != digest({"show a": {"x": -2}})
+
+
+def test_types_are_part_of_the_digest():
+    assert digest({"x": 1}) != digest({"x": "1"})
+    assert digest({"x": 1}) != digest({"x": True})
+    assert digest({"x": [1, 2]}) != digest({"x": [2, 1]})
+
+
+def test_key_order_does_not_change_the_digest():
+    assert digest({"a": 1, "b": {"c": [1, "x"]}}) == digest({"b": {"c": [1, "x"]}, "a": 1})
+
+
+def test_excluded_keys_are_left_out():
+    assert digest({"a": 1, "uptime": 5}, ["uptime"]) == digest({"a": 1, "uptime": 6}, ["uptime"])
+
+
+def test_prune_keeps_only_changed_branches():
+    merkle_diff = MerkleDiff()
+    merkle_diff.set_exclude([])
+    original = {"show a": {"x": -1, "y": {"z": 1}}, "show b": {"k": 1}, "show c": {"gone": 1}}
+    current = {"show a": {"x": -2, "y": {"z": 1}}, "show b": {"k": 1}, "show d": {"new": 1}}
+    original_pruned, current_pruned = merkle_diff.prune(
+        original, current, merkle_diff.hash_tree(original), merkle_diff.hash_tree(current))
+    assert original_pruned == {"show a": {"x": -1}, "show c": {"gone": 1}}
+    assert current_pruned == {"show a": {"x": -2}, "show d": {"new": 1}}
+
+
+def test_identical_outputs_give_no_diff():
+    assert MerkleDiff().diff({"show a": {"x": 1}}, {"show a": {"x": 1}}, []) == ""
+
+
+def test_diff_matches_genie_diff():
+    pytest.importorskip("genie")
+    from genie.utils.diff import Diff
+
+    original = {"show a": {"x": -1, "y": {"z": 1}, "uptime": 1}, "show b": {"k": 1}}
+    current = {"show a": {"x": -2, "y": {"z": 1}, "uptime": 2}, "show b": {"k": 1}, "show c": {"n": 1}}
+    diff = Diff(original, current, exclude=["uptime"])
+    diff.findDiff()
+    nxos_monitor_oop.import_genie()
+    assert MerkleDiff().diff(original, current, ["uptime"]) == str(diff)
+
+
+class StubDiff:
+    """Reports every changed leaf by path, like genie Diff does for the branches it walks."""
+
+    def __init__(self, original, current, exclude=None):
+        self.original = original
+        self.current = current
+        self.exclude = exclude or []
+        self.line_list = []
+
+    def walk(self, original, current, path):
+        for key in sorted(set(original) | set(current), key=repr):
+            if key in self.exclude:
+                continue
+            key_path = "{}/{}".format(path, key)
+            if key not in current:
+                self.line_list.append("-{}: {!r}".format(key_path, original[key]))
+            elif key not in original:
+                self.line_list.append("+{}: {!r}".format(key_path, current[key]))
+            elif isinstance(original[key], dict) and isinstance(current[key], dict):
+                self.walk(original[key], current[key], key_path)
+            elif original[key] != current[key] or type(original[key]) is not type(current[key]):
+                self.line_list.append("-{}: {!r}".format(key_path, original[key]))
+                self.line_list.append("+{}: {!r}".format(key_path, current[key]))
+
+    def findDiff(self):
+        self.walk(self.original, self.current, "")
+
+    def __str__(self):
+        return "\n".join(self.line_list)
+
+
+def test_pruned_diff_matches_the_diff_of_the_full_outputs(monkeypatch):
+    monkeypatch.setattr(nxos_monitor_oop, "Diff", StubDiff)
+    monkeypatch.setattr(nxos_monitor_oop, "import_genie", lambda: None)
+    original = {"show a": {"x": -1, "y": {"z": 1, "w": [1, 2]}, "uptime": 1},
+                "show b": {"k": 1, "m": {"n": {"o": "up"}}}, "show c": {"gone": 1}}
+    current_list = [
+        {"show a": {"x": -2, "y": {"z": 1, "w": [2, 1]}, "uptime": 2},
+         "show b": {"k": 1, "m": {"n": {"o": "down"}}}, "show d": {"new": 1}},
+        {"show a": {"x": -1, "y": {"z": True, "w": [1, 2]}, "uptime": 3},
+         "show b": {"k": 1, "m": {"n": {"o": "up", "p": 0}}}, "show c": {"gone": 1}},
+        {"show a": {"x": -1, "y": {"z": 1, "w": [1, 2]}, "uptime": 4},
+         "show b": {"k": 1, "m": {"n": {"o": "up"}}}, "show c": {"gone": 1}},
+    ]
+    merkle_diff = MerkleDiff()
+    for current in current_list:
+        full_diff = StubDiff(original, current, exclude=["uptime"])
+        full_diff.findDiff()
+        assert merkle_diff.diff(original, current, ["uptime"]) == str(full_diff)
@@ -0,0 +1,118 @@
+import concurrent.futures
+import os
+import time
+from importlib import metadata
+
+import pytest
+
+import nxos_monitor_oop
+from nxos_monitor_oop import PluginMonitor, plugin_group
+
+
+class Counter:
+    """A plugin counting its current() runs and reading show version through the device."""
+
+    def __init__(self, device):
+        self.device = device
+        self.count = 0
+        self.output = ""
+
+    def original(self):
+        self.count = 0
+
+    def current(self):
+        self.count += 1
+        self.output = self.device.execute("show version")
+        # Stands in for a plugin stuck in its own code.
+        if os.path.exists(os.environ.get("PLUGIN_SLOW_FILE", "")):
+            time.sleep(10)
+            self.device.execute("show late")
+
+    def is_changed(self):
+        return True
+
+    def diff(self):
+        return "{} {} {}".format(os.getpid(), self.count, self.output)
+
+
+class Hog(Counter):
+    time_budget = 30
+    cpu_budget = 1
+
+    def current(self):
+        while True:
+            pass
+
+
+class RecordingDevice:
+    """The monitor's side of the device, recording the commands the plugin sent."""
+
+    def __init__(self):
+        self.hostname = "sw1"
+        self.unsupport_list = []
+        self.command_list = []
+
+    def execute(self, cmd, **kwargs):
+        self.command_list.append((cmd, kwargs))
+        return "version of {}".format(self.hostname)
+
+
+def new_plugin_monitor(name, time_budget=30):
+    monitor = PluginMonitor(RecordingDevice(), name, metadata.EntryPoint(
+        name, "test_plugins:{}".format(name), plugin_group))
+    monitor.time_budget = time_budget
+    return monitor
+
+
+def test_plugin_runs_in_its_own_process_with_commands_run_by_the_monitor():
+    monitor = new_plugin_monitor("Counter")
+    try:
+        monitor.original()
+        monitor.current()
+        monitor.current()
+    finally:
+        monitor.stop()
+    assert not monitor.failed
+    pid, count, output = monitor.diff().split(" ", 2)
+    assert int(pid) != os.getpid()
+    assert count == "2"
+    assert output == "version of sw1"
+    assert [cmd for cmd, kwargs in monitor.device.command_list] == ["show version"] * 2
+    # Each command is bounded by the rest of the plugin's time budget.
+    assert all(0 < kwargs["timeout"] <= 30 for cmd, kwargs in monitor.device.command_list)
+
+
+def test_plugin_past_its_time_budget_is_killed_and_restarted_from_its_state(tmp_path, monkeypatch):
+    slow_file = tmp_path / "slow"
+    slow_file.touch()
+    monkeypatch.setenv("PLUGIN_SLOW_FILE", str(slow_file))
+    monitor = new_plugin_monitor("Counter", time_budget=2)
+    try:
+        monitor.original()
+        monitor.current()
+        assert monitor.failed
+        assert "time budget" in monitor.error
+        # The run's thread kills the process, so it never gets to run another command.
+        concurrent.futures.wait([monitor._future], timeout=10)
+        assert monitor._process is None
+        slow_file.unlink()
+        monitor.last_run = None
+        monitor.current()
+    finally:
+        monitor.stop()
+    assert not monitor.failed
+    # The count of the killed run is lost; the new process starts from the state after original().
+    assert monitor.diff().split(" ", 2)[1] == "1"
+    assert [cmd for cmd, kwargs in monitor.device.command_list] == ["show version"] * 2
+
+
+@pytest.mark.skipif(nxos_monitor_oop.resource is None, reason="RLIMIT_CPU is not available")
+def test_plugin_past_its_cpu_budget_is_stopped_by_the_kernel():
+    monitor = new_plugin_monitor("Hog")
+    try:
+        monitor.original()
+        monitor.current()
+    finally:
+        monitor.stop()
+    assert monitor.failed
+    assert monitor.error == "was stopped past its CPU budget of 1 seconds"
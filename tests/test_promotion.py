@@ -0,0 +1,81 @@
+import concurrent.futures
+import json
+import os
+
+from nxos_monitor_oop import AllDetail, ArpMonitor, CircuitBreaker, Device, FdbMonitor, VlanMonitor, promote_baseline, prune_snapshots
+
+
+def new_device(tmp_path):
+    device = Device.__new__(Device)
+    device.hostname = "sw1"
+    device.dir_original_snapshot_import = "default"
+    device.dir_original_snapshot_create = str(tmp_path / "sw1_original_snapshot_20260101-000000")
+    device.baseline_version = 0
+    device.cycle_count = 5
+    device.unsupport_list = []
+    device.feature_disabled_list = []
+    device.breaker_dict = {}
+    device.lost_arp_safe = device.lost_mac_safe = 30
+    device.snapshot_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    device.snapshot_future_list = []
+    return device
+
+
+def read_member(directory, file_name):
+    with open(os.path.join(directory, file_name)) as f:
+        return json.load(f)
+
+
+def test_only_a_good_state_of_the_last_cycle_is_promoted(tmp_path):
+    device = new_device(tmp_path)
+    instance_monitor_dict = {"ArpMonitor_instance": ArpMonitor(device), "FdbMonitor_instance": FdbMonitor(device),
+                             "VlanMonitor_instance": VlanMonitor(device)}
+    instance_monitor_dict["ArpMonitor_instance"].arp_entries_original = 100
+    instance_monitor_dict["ArpMonitor_instance"].arp_entries_current = 90
+    instance_monitor_dict["FdbMonitor_instance"].total_mac_addresses_original = 100
+    instance_monitor_dict["FdbMonitor_instance"].total_mac_addresses_current = 10
+    instance_monitor_dict["VlanMonitor_instance"].vlan_dict_original = {"10": {"state": "active"}}
+    instance_monitor_dict["VlanMonitor_instance"].vlan_dict_current = {}
+    device.feature_disabled_list = ["VlanMonitor_instance"]
+    alldetail_instance = AllDetail.__new__(AllDetail)
+    alldetail_instance.all_detail_original = {"show a": {"x": 1}}
+    alldetail_instance.all_detail_current = {"show a": {"x": 2}}
+    # Collected in an earlier cycle, before the mode compare all detail differences was turned off.
+    alldetail_instance.all_detail_cycle = 3
+
+    directory = tmp_path / "sw1_original_snapshot_20260102-000000"
+    directory.mkdir()
+    promoted_list = promote_baseline(device, instance_monitor_dict, alldetail_instance, str(directory),
+                                     [("sw1", "FdbMonitor_instance")])
+    assert promoted_list == ["ArpMonitor_instance"]
+    assert read_member(directory, "arp.json") == {"total_arp_entries_original": 90}
+    assert read_member(directory, "fdb.json") == {"total_mac_addresses_original": 100}
+    assert read_member(directory, "vlan.json") == {"10": {"state": "active"}}
+    assert read_member(directory, "all_detail_original.json") == {"show a": {"x": 1}}
+    snapshot_info = read_member(directory, "snapshot_info.json")
+    assert (snapshot_info["version"], snapshot_info["cycle"]) == (1, 5)
+    assert snapshot_info["promoted_from"] == str(tmp_path / "sw1_original_snapshot_20260101-000000")
+    assert not instance_monitor_dict["ArpMonitor_instance"].is_changed()
+
+    # A monitor whose breaker saw a failure keeps its original state; the all details of the last cycle are promoted.
+    device.feature_disabled_list = []
+    device.breaker_dict["FdbMonitor_instance"] = CircuitBreaker()
+    device.breaker_dict["FdbMonitor_instance"].record(False)
+    alldetail_instance.all_detail_cycle = 5
+    directory = tmp_path / "sw1_original_snapshot_20260103-000000"
+    directory.mkdir()
+    promoted_list = promote_baseline(device, instance_monitor_dict, alldetail_instance, str(directory))
+    assert promoted_list == ["ArpMonitor_instance", "VlanMonitor_instance", "AllDetail"]
+    assert read_member(directory, "fdb.json") == {"total_mac_addresses_original": 100}
+    assert read_member(directory, "all_detail_original.json") == {"show a": {"x": 2}}
+    assert read_member(directory, "snapshot_info.json")["version"] == 2
+
+
+def test_prune_keeps_the_newest_and_the_directories_in_use(tmp_path):
+    name_list = ["sw1_original_snapshot_2026010{}-000000".format(i) for i in range(1, 6)]
+    for name in name_list + ["sw2_original_snapshot_20260101-000000"]:
+        (tmp_path / name).mkdir()
+    (tmp_path / "sw1_original_snapshot_notes.txt").write_text("not a directory")
+    prune_snapshots(str(tmp_path), "sw1", 2, [str(tmp_path / name_list[0])])
+    assert sorted(os.listdir(str(tmp_path))) == sorted([name_list[0], name_list[3], name_list[4],
+                                                        "sw1_original_snapshot_notes.txt", "sw2_original_snapshot_20260101-000000"])